@@ -0,0 +1,223 @@
+"""A local stand-in for the pfSense REST API (v2), with configurable latency.
+
+Implements just what update_pfsense.py and monitor.py use: the DNS
+Resolver host override(s) and apply endpoints, the services status list
+and the service restart action, the OpenVPN client status list and the
+gateway status list, the gateway group and routing apply endpoints
+the make-before-break mode uses, and the OpenVPN client config list and
+PATCH direct mode uses. Behind it is a small in-memory model of
+two OpenVPN clients (OPENVPN_VPNID on DNS_HOST and GATEWAY_NAME, and a
+standby STANDBY_VPNID on STANDBY_DNS_HOST and STANDBY_GATEWAY_NAME, tiers
+1 and 2 of GATEWAY_GROUP), each connecting to its server_addr - the
+override's name, until direct mode PATCHes in an IP (which restarts the
+client, as pfSense does): a restarted client reports "up" again after
+restart_seconds (never, while its override points at one of dead_ips), an
+apply reports as pending for apply_seconds, and a client's gateway reports
+a slow, lossy link while its override points at one of degraded_ips.
+Every restart of the client on tier 1 - the one carrying traffic - adds
+restart_seconds to stats["active_outage_seconds"].
+
+Every request is delayed by latency_ms and counted (with its response size)
+in `stats`, so a benchmark can report both wall time and API traffic.
+
+    with FakePfSense(overrides=500, latency_ms=20) as api:
+        config["PFSENSE_BASE_URL"] = api.base_url
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, List
+from urllib.parse import parse_qs, urlparse
+
+API_KEY = "bench-api-key"
+DNS_HOST = "fastest"
+DNS_DOMAIN = "protonvpn.com"
+OPENVPN_VPNID = 1
+GATEWAY_NAME = "PROTONVPN_VPNV4"
+STANDBY_DNS_HOST = "fastest-b"
+STANDBY_VPNID = 2
+STANDBY_GATEWAY_NAME = "PROTONVPN_B_VPNV4"
+GATEWAY_GROUP = "PROTONVPN_GROUP"
+
+
+class FakePfSense:
+    def __init__(self, overrides: int = 50, latency_ms: float = 0, restart_seconds: float = 0,
+                 apply_seconds: float = 0, current_ip: str = "203.0.113.1", port: int = 0,
+                 dead_ips: Iterable[str] = (), degraded_ips: Iterable[str] = ()):
+        self.latency = latency_ms / 1000
+        self.restart_seconds = restart_seconds
+        self.dead_ips = set(dead_ips)
+        self.degraded_ips = set(degraded_ips)
+        self.apply_seconds = apply_seconds
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "bytes_out": 0, "by_endpoint": {}, "active_outage_seconds": 0.0}
+
+        # The override update_pfsense.py looks for sits in the middle of a
+        # long list, as it would on a busy firewall.
+        self.host_overrides: List[Dict[str, Any]] = [
+            {"id": i, "host": f"host{i}", "domain": "lan", "ip": [f"10.0.{i // 250}.{i % 250 + 1}"], "descr": ""}
+            for i in range(overrides)
+        ]
+        self.host_overrides.insert(overrides // 2, {
+            "id": overrides, "host": DNS_HOST, "domain": DNS_DOMAIN, "ip": [current_ip], "descr": "",
+        })
+        self.host_overrides.append({
+            "id": overrides + 1, "host": STANDBY_DNS_HOST, "domain": DNS_DOMAIN, "ip": [current_ip], "descr": "",
+        })
+        self.services: List[Dict[str, Any]] = [
+            {"id": 0, "name": "unbound", "description": "DNS Resolver", "enabled": True, "status": True},
+            {"id": 1, "name": "openvpn", "description": "OpenVPN client", "vpnid": OPENVPN_VPNID,
+             "mode": "client", "enabled": True, "status": True},
+            {"id": 2, "name": "openvpn", "description": "OpenVPN client (standby)", "vpnid": STANDBY_VPNID,
+             "mode": "client", "enabled": True, "status": True},
+        ]
+        # vpnid -> (its host override's host, its gateway)
+        self.clients = {OPENVPN_VPNID: (DNS_HOST, GATEWAY_NAME), STANDBY_VPNID: (STANDBY_DNS_HOST, STANDBY_GATEWAY_NAME)}
+        self.client_up_at = {vpnid: 0.0 for vpnid in self.clients}
+        self.openvpn_clients: List[Dict[str, Any]] = [
+            {"id": i, "vpnid": vpnid, "description": f"ProtonVPN {vpnid}", "server_addr": f"{host}.{DNS_DOMAIN}",
+             "server_port": "1194", "protocol": "UDP4"}
+            for i, (vpnid, (host, _)) in enumerate(self.clients.items())
+        ]
+        self.gateway_group = {"id": 0, "name": GATEWAY_GROUP, "trigger": "down", "priorities": [
+            {"gateway": GATEWAY_NAME, "tier": 1, "virtual_ip": "address"},
+            {"gateway": STANDBY_GATEWAY_NAME, "tier": 2, "virtual_ip": "address"},
+        ]}
+        self.applied_at = 0.0
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code: int, data: Any = None) -> None:
+                body = json.dumps({"code": code, "status": "ok" if code < 300 else "error", "data": data}).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with fake.lock:
+                    fake.stats["requests"] += 1
+                    fake.stats["bytes_out"] += len(body)
+                    key = f"{self.command} {urlparse(self.path).path}"
+                    fake.stats["by_endpoint"][key] = fake.stats["by_endpoint"].get(key, 0) + 1
+
+            def _handle(self) -> None:
+                time.sleep(fake.latency)
+                if self.headers.get("X-API-Key") != API_KEY:
+                    return self._reply(401)
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+                route = (self.command, url.path)
+                with fake.lock:
+                    code, data = fake.route(route, query, body)
+                self._reply(code, data)
+
+            do_GET = do_POST = do_PATCH = _handle
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @staticmethod
+    def _filter(entries: List[Dict[str, Any]], query: Dict[str, str]) -> List[Dict[str, Any]]:
+        return [e for e in entries if all(str(e.get(k)) == v for k, v in query.items())]
+
+    def route(self, route, query: Dict[str, str], body: Dict[str, Any]):
+        """Returns (code, data) for one request. Called with self.lock held."""
+        now = time.monotonic()
+        if route == ("GET", "/api/v2/services/dns_resolver/host_overrides"):
+            return 200, self._filter(self.host_overrides, query)
+        if route in (("GET", "/api/v2/services/dns_resolver/host_override"),
+                     ("PATCH", "/api/v2/services/dns_resolver/host_override")):
+            wanted = query.get("id", body.get("id"))
+            entry = next((e for e in self.host_overrides if str(e["id"]) == str(wanted)), None)
+            if entry is None:
+                return 404, None
+            if route[0] == "PATCH":
+                entry.update({k: v for k, v in body.items() if k != "id"})
+                self.applied_at = float("inf")  # pending until the next apply
+            return 200, entry
+        if route == ("POST", "/api/v2/services/dns_resolver/apply"):
+            self.applied_at = now + self.apply_seconds
+            return 200, {"applied": self.apply_seconds <= 0}
+        if route == ("GET", "/api/v2/services/dns_resolver/apply"):
+            return 200, {"applied": now >= self.applied_at}
+        if route == ("GET", "/api/v2/status/services"):
+            return 200, self._filter(self.services, query)
+        if route == ("POST", "/api/v2/status/service"):
+            entry = next((e for e in self.services if e["id"] == body.get("id")), None)
+            if entry is None or body.get("action") not in ("start", "stop", "restart"):
+                return 400, None
+            if entry["name"] == "openvpn":
+                self._restart(entry["vpnid"], now)
+            return 200, entry
+        if route == ("GET", "/api/v2/vpn/openvpn/clients"):
+            return 200, self._filter(self.openvpn_clients, query)
+        if route == ("PATCH", "/api/v2/vpn/openvpn/client"):
+            entry = next((e for e in self.openvpn_clients if e["id"] == body.get("id")), None)
+            if entry is None:
+                return 404, None
+            entry.update({k: v for k, v in body.items() if k != "id"})
+            self._restart(entry["vpnid"], now)
+            return 200, entry
+        if route == ("GET", "/api/v2/status/openvpn/clients"):
+            return 200, [
+                {"vpnid": vpnid, "name": f"ProtonVPN {vpnid}", "remote_host": self.client_ip(vpnid),
+                 "status": "up" if now >= self.client_up_at[vpnid] and self.client_ip(vpnid) not in self.dead_ips
+                 else "reconnecting"}
+                for vpnid in self.clients
+            ]
+        if route == ("GET", "/api/v2/status/gateways"):
+            gateways = [{"name": "WAN_DHCP", "status": "online", "delay": "8.112ms", "stddev": "0.4ms", "loss": "0.0%"}]
+            for vpnid, (_, gateway) in self.clients.items():
+                degraded = self.client_ip(vpnid) in self.degraded_ips
+                gateways.append({"name": gateway, "status": "loss" if degraded else "online",
+                                 "delay": "480.5ms" if degraded else "31.2ms", "stddev": "2.1ms",
+                                 "loss": "25.0%" if degraded else "0.0%"})
+            return 200, gateways
+        if route == ("GET", "/api/v2/routing/gateway/groups"):
+            return 200, self._filter([self.gateway_group], query)
+        if route == ("PATCH", "/api/v2/routing/gateway/group"):
+            if body.get("id") != self.gateway_group["id"]:
+                return 404, None
+            self.gateway_group["priorities"] = body.get("priorities", self.gateway_group["priorities"])
+            return 200, self.gateway_group
+        if route == ("POST", "/api/v2/routing/apply"):
+            return 200, {"applied": True}
+        return 404, None
+
+    def _restart(self, vpnid: int, now: float) -> None:
+        self.client_up_at[vpnid] = now + self.restart_seconds
+        if self.clients[vpnid][1] == self.active_gateway:
+            self.stats["active_outage_seconds"] += self.restart_seconds
+
+    def client_ip(self, vpnid: int) -> str:
+        """The IP the client connects to: its server_addr, resolved through
+        the host overrides if it's a name."""
+        server_addr = next(e["server_addr"] for e in self.openvpn_clients if e["vpnid"] == vpnid)
+        entry = next((e for e in self.host_overrides if f"{e['host']}.{e['domain']}" == server_addr), None)
+        return entry["ip"][0] if entry else server_addr
+
+    @property
+    def current_ip(self) -> str:
+        """The IP traffic is going to: that of the client on tier 1."""
+        vpnid = next(v for v, (_, gateway) in self.clients.items() if gateway == self.active_gateway)
+        return self.client_ip(vpnid)
+
+    @property
+    def active_gateway(self) -> str:
+        return min(self.gateway_group["priorities"], key=lambda entry: int(entry["tier"]))["gateway"]
+
+    def __enter__(self) -> "FakePfSense":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
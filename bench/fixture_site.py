@@ -0,0 +1,212 @@
+"""A local stand-in for ProtonVPN's login and downloads pages.
+
+Serves synthetic pages shaped like the real ones as far as scrape-ng-v2.py
+cares: the same element ids and selectors (config.example.json's USER_ID,
+PASS_ID, TOTP_ID, MAILBOX_PASSWORD_ID, CONTINUE_BUTTON_SELECTOR,
+P2P_ICON_SELECTOR, ...), the four-step login, a `role="alert"` error banner
+on a wrong password, collapsible per-country <details> blocks, and one
+download button per server row that fetches a real-looking .ovpn file. The
+server table can be made arbitrarily large to measure how extraction
+scales.
+
+Run directly to browse it by hand:
+
+    python3 bench/fixture_site.py --rows 1000 --port 8081
+"""
+import argparse
+import html
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+from urllib.parse import unquote, urlparse
+
+USERNAME = "bench-user"
+PASSWORD = "bench-password"
+MAILBOX_PASSWORD = "bench-mailbox"
+# Any valid base32 works; the fixture accepts whatever 6 digits it's sent.
+TOTP_SECRET_KEY = "JBSWY3DPEHPK3PXP"
+
+_STATES = ["MA", "NY", "NJ", "CA", "TX", "FL", "IL", "WA", "GA", "CO"]
+_OTHER_COUNTRIES = ["Canada", "Germany", "Japan", "Netherlands", "Switzerland"]
+_CONTINUE_BUTTON_CLASS = "w-full button-large button-solid-norm mt-6"
+_P2P_ICON = '<span class="mx-2" title="P2P">P2P</span>'
+
+_LOGIN_PAGE = """<!doctype html>
+<html><head><title>Sign in</title></head><body>
+<div id="alert" role="alert" style="display:none"></div>
+<form onsubmit="return false">
+  <div id="step-username"><input id="username" autocomplete="off"></div>
+  <div id="step-password" style="display:none"><input id="password" type="password"></div>
+  <div id="step-totp" style="display:none"><input id="totp" maxlength="6"></div>
+  <div id="step-mailbox" style="display:none"><input id="mailboxPassword" type="password"></div>
+  <button type="button" class="%(button_class)s" onclick="next()">Continue</button>
+</form>
+<script>
+let step = "username";
+function show(id) {
+  for (const el of document.querySelectorAll("[id^=step-]")) el.style.display = "none";
+  document.getElementById("step-" + id).style.display = "";
+  step = id;
+}
+function fail(message) {
+  const alert = document.getElementById("alert");
+  alert.textContent = message;
+  alert.style.display = "";
+}
+function next() {
+  if (step === "username") {
+    show("password");
+  } else if (step === "password") {
+    if (document.getElementById("password").value !== %(password)s) return fail("Incorrect login credentials.");
+    show("totp");
+  } else if (step === "mailbox") {
+    if (document.getElementById("mailboxPassword").value !== %(mailbox)s) return fail("Incorrect mailbox password.");
+    document.cookie = "bench_session=1; path=/";
+    window.location = "/dashboard";
+  }
+}
+// Proton submits the TOTP step on its own once six digits are in.
+document.getElementById("totp").addEventListener("input", (e) => {
+  if (/^\\d{6}$/.test(e.target.value)) setTimeout(() => show("mailbox"), 50);
+});
+</script>
+</body></html>
+"""
+
+_DOWNLOAD_SCRIPT = """<script>
+function download(name) {
+  const a = document.createElement("a");
+  a.href = "/ovpn/" + encodeURIComponent(name) + ".ovpn";
+  a.download = name + ".ovpn";
+  document.body.appendChild(a);
+  a.click();
+  a.remove();
+}
+</script>"""
+
+
+def generate_servers(rows: int, seed: int = 1) -> List[Tuple[str, int, bool]]:
+    """Deterministic (server_name, utilization, supports_p2p) rows."""
+    rng = random.Random(seed)
+    servers = []
+    for i in range(rows):
+        state = _STATES[i % len(_STATES)]
+        servers.append((f"US-{state}#{i + 1}", rng.randint(5, 99), rng.random() < 0.6))
+    return servers
+
+
+def server_ip(server_name: str) -> str:
+    """A stable fake entry IP for server_name (TEST-NET-2, never routable)."""
+    number = int(server_name.rsplit("#", 1)[1])
+    return f"198.51.{100 + number // 250 % 100}.{number % 250 + 1}"
+
+
+def ovpn_config(server_name: str) -> str:
+    ip = server_ip(server_name)
+    remotes = "\n".join(f"remote {ip} {port}" for port in (80, 51820, 4569, 1194, 5060))
+    return (
+        "# Fixture OpenVPN config\n"
+        "client\ndev tun\nproto udp\n\n"
+        f"{remotes}\n\n"
+        "server-poll-timeout 20\nremote-random\nresolv-retry infinite\nnobind\n"
+        "cipher AES-256-GCM\nverb 3\n"
+    )
+
+
+def downloads_page(servers: List[Tuple[str, int, bool]]) -> str:
+    def table(rows: List[Tuple[str, int, bool]]) -> str:
+        body = "".join(
+            f"<tr><td>{html.escape(name)}</td>"
+            f"<td>{_P2P_ICON if p2p else ''}</td>"
+            f"<td>{utilization}%</td>"
+            f"<td><button type=\"button\" onclick=\"download('{html.escape(name)}')\">Download</button></td></tr>"
+            for name, utilization, p2p in rows
+        )
+        return f"<table><tr><th>Name</th><th>Features</th><th>Load</th><th></th></tr>{body}</table>"
+
+    blocks = [
+        f"<details><summary>{country}</summary><div><div>{table([])}</div></div></details>"
+        for country in _OTHER_COUNTRIES[:3]
+    ]
+    blocks.append(f"<details><summary>United States</summary><div><div>{table(servers)}</div></div></details>")
+    blocks.extend(
+        f"<details><summary>{country}</summary><div><div>{table([])}</div></div></details>"
+        for country in _OTHER_COUNTRIES[3:]
+    )
+    return (
+        "<!doctype html><html><head><title>Downloads</title></head><body>"
+        f"<section id=\"openvpn-configuration-files\">{''.join(blocks)}</section>"
+        f"{_DOWNLOAD_SCRIPT}</body></html>"
+    )
+
+
+class FixtureSite:
+    """The fixture site on a background thread. Use as a context manager;
+    base_url is e.g. http://127.0.0.1:PORT."""
+
+    def __init__(self, rows: int = 500, port: int = 0, seed: int = 1):
+        self.servers = generate_servers(rows, seed)
+        login_page = _LOGIN_PAGE % {
+            "button_class": _CONTINUE_BUTTON_CLASS,
+            "password": repr(PASSWORD),
+            "mailbox": repr(MAILBOX_PASSWORD),
+        }
+        pages = {"login": login_page.encode(), "downloads": downloads_page(self.servers).encode()}
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str = "text/html", extra=()):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for header, value in extra:
+                    self.send_header(header, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                logged_in = "bench_session=1" in (self.headers.get("Cookie") or "")
+                if path == "/login":
+                    self._send(200, pages["login"])
+                elif path == "/dashboard":
+                    self._send(200, b"<!doctype html><html><body><h1>Dashboard</h1></body></html>")
+                elif path == "/downloads":
+                    if logged_in:
+                        self._send(200, pages["downloads"])
+                    else:
+                        self._send(302, b"", extra=[("Location", "/login")])
+                elif path.startswith("/ovpn/") and path.endswith(".ovpn"):
+                    name = unquote(path[len("/ovpn/"):-len(".ovpn")])
+                    self._send(200, ovpn_config(name).encode(), "application/x-openvpn-profile",
+                               [("Content-Disposition", f'attachment; filename="{name}.ovpn"')])
+                else:
+                    self._send(404, b"not found", "text/plain")
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self) -> "FixtureSite":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    with FixtureSite(args.rows, args.port) as site:
+        print(f"Serving {args.rows} rows at {site.base_url}/login (Ctrl-C to stop)")
+        try:
+            site.thread.join()
+        except KeyboardInterrupt:
+            pass
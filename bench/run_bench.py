@@ -0,0 +1,485 @@
+"""Offline benchmarks for scrape-ng-v2.py and update_pfsense.py.
+
+Runs every timed scenario against local stand-ins - fixture_site.py for
+Proton's login/downloads pages, fake_pfsense.py for the pfSense REST API -
+so nothing touches Proton or a real firewall. Results (per-scenario median,
+min and max seconds, plus counters such as WebDriver commands or API
+requests) are written as JSON; pass a previous run's file to --compare to
+print the change per scenario.
+
+Scenarios whose dependencies aren't installed here (selenium and
+undetected_chromedriver plus Chrome for the browser ones, requests for the
+updater) are recorded as skipped with the reason, rather than failing the
+run.
+
+    python3 bench/run_bench.py --rows 1000 --latency-ms 20 --output bench_results.json
+    python3 bench/run_bench.py --compare bench_results.json
+"""
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import fake_pfsense  # noqa: E402
+import fixture_site  # noqa: E402
+from startup_cache import StartupCache  # noqa: E402
+
+NEW_IP = "198.51.100.7"
+FAILOVER_IP = "198.51.100.8"
+# How long the fake's OpenVPN client takes to reconnect in the
+# make-before-break comparison.
+RESTART_SECONDS = 0.5
+
+
+def load_scraper():
+    """Imports scrape-ng-v2.py (whose name isn't a valid module name)."""
+    spec = importlib.util.spec_from_file_location("scrape_ng_v2", os.path.join(REPO_DIR, "scrape-ng-v2.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed(fn: Callable[[], Any], repeat: int, setup: Optional[Callable[[], Any]] = None) -> Dict[str, Any]:
+    """Calls fn repeat times (each after an untimed setup(), if given) and
+    returns the timing summary plus fn's last return value as "last"."""
+    seconds = []
+    result = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        seconds.append(time.perf_counter() - start)
+    return {
+        "status": "ok",
+        "runs": repeat,
+        "median": statistics.median(seconds),
+        "min": min(seconds),
+        "max": max(seconds),
+        "last": result,
+    }
+
+
+def skipped(reason: str) -> Dict[str, Any]:
+    return {"status": "skipped", "reason": reason}
+
+
+# Imports one script by path in a fresh interpreter and reports which of the
+# heavy dependencies that pulled in.
+IMPORT_PROBE = """
+import importlib.util, json, sys
+sys.path.insert(0, sys.argv[2])
+spec = importlib.util.spec_from_file_location("probe", sys.argv[1])
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+heavy = ("undetected_chromedriver", "selenium.webdriver.remote.webdriver", "requests", "asyncio", "pyotp")
+print(json.dumps([name for name in heavy if name in sys.modules]))
+"""
+
+
+def bench_imports(args) -> Dict[str, Dict[str, Any]]:
+    """Each script's cold start up to the end of its imports, in a fresh
+    interpreter as every cron run pays it, plus which heavy dependencies
+    the import alone loaded."""
+    results = {}
+    for script in ("scrape-ng-v2.py", "update_pfsense.py"):
+        command = [sys.executable, "-c", IMPORT_PROBE, os.path.join(REPO_DIR, script), REPO_DIR]
+        try:
+            summary = timed(lambda: subprocess.run(command, capture_output=True, text=True, check=True),
+                            args.repeat)
+        except subprocess.CalledProcessError as e:
+            results[f"import {script}"] = skipped(f"could not be imported: {e.stderr.strip().splitlines()[-1:]}")
+            continue
+        summary["extra"] = {"heavy_modules": json.loads(summary.pop("last").stdout)}
+        results[f"import {script}"] = summary
+    return results
+
+
+def configure_scraper(scraper, site: fixture_site.FixtureSite) -> None:
+    scraper.LOGIN_URL = f"{site.base_url}/login"
+    scraper.DOWNLOAD_URL = f"{site.base_url}/downloads"
+    scraper.USERNAME = fixture_site.USERNAME
+    scraper.PASSWORD = fixture_site.PASSWORD
+    scraper.MAILBOX_PASSWORD = fixture_site.MAILBOX_PASSWORD
+    scraper.TOTP_SECRET_KEY = fixture_site.TOTP_SECRET_KEY
+    scraper.STATES = []
+    scraper.PERSISTENT_PROFILE_DIR = ""
+    scraper.HISTORY_DB = ""
+    scraper.ENDPOINT_CACHE_FILE = ""
+
+
+def bench_parsing(scraper, args, work_dir: str) -> Dict[str, Dict[str, Any]]:
+    """Scenarios that need the scraper module but no browser."""
+    results = {}
+    records = [(name, util, p2p, index) for index, (name, util, p2p)
+               in enumerate(fixture_site.generate_servers(args.rows), start=1)]
+    summary = timed(lambda: scraper.find_lowest_utilization_p2p_server(records), args.repeat)
+    summary["extra"] = {"records": len(records), "winner": list(summary.pop("last")[:2])}
+    results["find_lowest_utilization_p2p_server"] = summary
+
+    config_path = os.path.join(work_dir, "fixture.ovpn")
+    with open(config_path, "w") as f:
+        f.write(fixture_site.ovpn_config("US-NY#2"))
+    summary = timed(lambda: scraper.extract_endpoint_ip(config_path), args.repeat)
+    summary["extra"] = {"ip": summary.pop("last")}
+    results["extract_endpoint_ip"] = summary
+    return results
+
+
+def bench_http(scraper, args, work_dir: str) -> Dict[str, Dict[str, Any]]:
+    """The browserless refresh path (read_tables_http) against the fixture,
+    with a saved cookie like the one a browser login would leave."""
+    import http_scrape
+
+    with fixture_site.FixtureSite(rows=args.rows) as site:
+        configure_scraper(scraper, site)
+        scraper.SESSION_COOKIE_FILE = os.path.join(work_dir, "session_cookies.json")
+        scraper.HTTP_SOURCE = "html"
+        http_scrape.save_cookies(scraper.SESSION_COOKIE_FILE, [
+            {"name": "bench_session", "value": "1", "domain": "127.0.0.1", "path": "/"},
+        ])
+        summary = timed(lambda: scraper.read_tables_http(scraper.active_profiles()), args.repeat)
+        summary["extra"] = {"records": sum(len(records) for records in summary.pop("last").values())}
+    return {"read_tables_http": summary}
+
+
+def bench_browser(scraper, args, work_dir: str) -> Dict[str, Dict[str, Any]]:
+    """Scenarios driving headless Chrome against the fixture site."""
+    results = {}
+    download_dir = os.path.join(work_dir, "downloads")
+    os.makedirs(download_dir)
+    with fixture_site.FixtureSite(rows=args.rows) as site:
+        configure_scraper(scraper, site)
+        scraper.STARTUP_CACHE_FILE = os.path.join(work_dir, "startup_cache.json")
+        startup_cache = StartupCache(scraper.STARTUP_CACHE_FILE)
+
+        def first_navigation():
+            started = scraper.start_driver(download_dir)
+            try:
+                started.get(scraper.LOGIN_URL)
+            finally:
+                started.quit()
+
+        # Launch to first page, with the version probe and chromedriver
+        # download-and-patch every time, then from the startup cache the
+        # last of those runs left behind.
+        summary = timed(first_navigation, args.repeat, setup=startup_cache.invalidate)
+        summary.pop("last")
+        results["start_driver+get (no startup cache)"] = summary
+        summary = timed(first_navigation, args.repeat)
+        summary.pop("last")
+        results["start_driver+get (startup cache)"] = summary
+
+        driver = scraper.start_driver(download_dir)
+        try:
+            counts = scraper.count_webdriver_commands(driver)
+
+            def commands_during(fn: Callable[[], Any]) -> Dict[str, Any]:
+                before = sum(counts.values())
+                summary = timed(fn, args.repeat)
+                summary["extra"] = {"webdriver_commands_per_run": (sum(counts.values()) - before) // args.repeat}
+                return summary
+
+            summary = commands_during(lambda: scraper.log_in(driver))
+            summary.pop("last")
+            results["log_in"] = summary
+
+            rows: List[Any] = []
+
+            def per_row():
+                rows[:] = scraper.extract_server_rows(driver)
+                return scraper.parse_rows(rows)
+
+            summary = commands_during(per_row)
+            summary["extra"]["records"] = len(summary.pop("last"))
+            results["extract_server_rows+parse_row"] = summary
+
+            summary = commands_during(lambda: [scraper.parse_row(row) for row in rows])
+            summary["extra"]["rows"] = len(summary.pop("last"))
+            results["parse_row"] = summary
+
+            summary = commands_during(lambda: scraper.extract_server_records(driver))
+            summary["extra"]["records"] = len(summary.pop("last"))
+            results["extract_server_records"] = summary
+
+            # The row goes stale once the page is reloaded above, so look it
+            # up afresh for the download.
+            records = scraper.extract_server_records(driver, navigate=False)
+            row = scraper.row_element(driver, records[0][3])
+            summary = commands_during(lambda: scraper.download_openvpn_config(driver, row, download_dir))
+            summary["extra"]["file_bytes"] = os.path.getsize(summary.pop("last"))
+            results["download_openvpn_config"] = summary
+
+            # The top few candidates' files, fetched together as the
+            # scraper does for RTT probing and failover.
+            top_rows = [scraper.row_element(driver, record[3]) for record in records[:3]]
+            summary = commands_during(lambda: scraper.download_openvpn_configs(driver, top_rows, download_dir))
+            summary["extra"]["files"] = len(summary.pop("last"))
+            results["download_openvpn_configs (top 3)"] = summary
+        finally:
+            driver.quit()
+    return results
+
+
+def updater_config(work_dir: str) -> Dict[str, Any]:
+    """The updater's config for the fake API (everything but its URL), with
+    NEW_IP as the scraper's result."""
+    output_file = os.path.join(work_dir, "ip.txt")
+    with open(output_file, "w") as f:
+        f.write(NEW_IP)
+    return {
+        "PFSENSE_API_KEY": fake_pfsense.API_KEY,
+        "DNS_HOST": fake_pfsense.DNS_HOST,
+        "DNS_DOMAIN": fake_pfsense.DNS_DOMAIN,
+        "OPENVPN_VPNID": fake_pfsense.OPENVPN_VPNID,
+        "OUTPUT_FILE": output_file,
+        "SELECTION_FILE": os.path.join(work_dir, "selection.json"),
+        "APPLIED_STATE_FILE": os.path.join(work_dir, "applied.json"),
+        "PFSENSE_ID_CACHE_FILE": os.path.join(work_dir, "pfsense_ids.json"),
+        "ENDPOINT_CACHE_FILE": "",
+        "LOG_FILE": os.path.join(work_dir, "update_pfsense.log"),
+        "READY_POLL_INTERVAL_SECONDS": 0.05,
+        "DNS_READY_TIMEOUT_SECONDS": 5,
+        "TUNNEL_READY_TIMEOUT_SECONDS": 5,
+    }
+
+
+def bench_updater(args, work_dir: str) -> Dict[str, Dict[str, Any]]:
+    """update_pfsense.main() end to end against the fake API: once when the
+    new IP differs (lookup, PATCH, apply, readiness polls, restart), once
+    when the override already holds it (lookups only), and once when the
+    tunnel never comes up on the winner, so the updater fails over to the
+    next candidate in the selection file. Then a switch with a client that
+    takes RESTART_SECONDS to reconnect, once restarting the only client and
+    once make-before-break with the standby client, each reporting how long
+    the client carrying traffic was down (active_outage_seconds). Last, the
+    plain switch again in direct mode, which PATCHes the OpenVPN client
+    instead of the override and so reloads the resolver
+    (resolver_reloads) not at all."""
+    import update_pfsense
+
+    results = {}
+    config = updater_config(work_dir)
+    update_pfsense.CONFIG_FILE = os.path.join(work_dir, "config.json")
+
+    failover_selection = {
+        "server": "US-NY#1", "utilization": 10, "ip": NEW_IP,
+        "candidates": [
+            {"server": "US-NY#1", "utilization": 10, "ip": NEW_IP, "remotes": [[NEW_IP, 1194, "udp"]]},
+            {"server": "US-NJ#2", "utilization": 12, "ip": FAILOVER_IP, "remotes": [[FAILOVER_IP, 1194, "udp"]]},
+        ],
+    }
+    dual_client = {
+        "STANDBY_OPENVPN_VPNID": fake_pfsense.STANDBY_VPNID,
+        "STANDBY_DNS_HOST": fake_pfsense.STANDBY_DNS_HOST,
+        "OPENVPN_GATEWAY": fake_pfsense.GATEWAY_NAME,
+        "STANDBY_OPENVPN_GATEWAY": fake_pfsense.STANDBY_GATEWAY_NAME,
+        "GATEWAY_GROUP": fake_pfsense.GATEWAY_GROUP,
+    }
+    for scenario, current_ip, dead_ips, selection, extra_config, restart_seconds in (
+        ("update_pfsense.main (switch)", "203.0.113.1", (), None, {}, 0),
+        ("update_pfsense.main (unchanged)", NEW_IP, (), None, {}, 0),
+        ("update_pfsense.main (failover)", "203.0.113.1", (NEW_IP,), failover_selection, {}, 0),
+        ("update_pfsense.main (slow restart)", "203.0.113.1", (), None, {}, RESTART_SECONDS),
+        ("update_pfsense.main (make-before-break)", "203.0.113.1", (), None, dual_client, RESTART_SECONDS),
+        ("update_pfsense.main (direct)", "203.0.113.1", (), None, {"OPENVPN_ENDPOINT_MODE": "direct"}, 0),
+    ):
+        fakes: List[fake_pfsense.FakePfSense] = []
+
+        def setup():
+            # A fresh fake firewall per run, so every run starts from the
+            # same state instead of the previous run's applied change.
+            while fakes:
+                fakes.pop().__exit__(None, None, None)
+            fake = fake_pfsense.FakePfSense(overrides=args.overrides, latency_ms=args.latency_ms,
+                                            current_ip=current_ip, dead_ips=dead_ips,
+                                            restart_seconds=restart_seconds).__enter__()
+            fakes.append(fake)
+            with open(update_pfsense.CONFIG_FILE, "w") as f:
+                # A dead endpoint costs a whole tunnel timeout; keep it short.
+                json.dump({**config, **extra_config, "PFSENSE_BASE_URL": fake.base_url,
+                           **({"TUNNEL_READY_TIMEOUT_SECONDS": 0.5} if dead_ips else {})}, f)
+            for path in (config["APPLIED_STATE_FILE"], config["PFSENSE_ID_CACHE_FILE"], config["SELECTION_FILE"]):
+                if os.path.exists(path):
+                    os.remove(path)
+            if selection:
+                with open(config["SELECTION_FILE"], "w") as f:
+                    json.dump(selection, f)
+
+        try:
+            summary = timed(update_pfsense.main, args.repeat, setup)
+            stats = fakes[0].stats
+            final_ip = fakes[0].current_ip
+        finally:
+            while fakes:
+                fakes.pop().__exit__(None, None, None)
+        summary["extra"] = {
+            "exit_code": summary.pop("last"),
+            "final_ip": final_ip,
+            "api_requests_per_run": stats["requests"],
+            "api_bytes_per_run": stats["bytes_out"],
+            "active_outage_seconds": stats["active_outage_seconds"],
+            "resolver_reloads": stats["by_endpoint"].get("POST /api/v2/services/dns_resolver/apply", 0),
+            "by_endpoint": stats["by_endpoint"],
+        }
+        results[scenario] = summary
+    return results
+
+
+def bench_monitor(args, work_dir: str) -> Dict[str, Dict[str, Any]]:
+    """monitor.Monitor.check() against the fake API: a healthy tunnel (one
+    sample - what each cycle costs instead of a scrape), and a degraded one
+    with a zero breach window, so the first sample marks the applied server
+    unhealthy and re-selects. update_pfsense.main() on a fresh result stands
+    in for pipeline.py there; the result is only a point better than the
+    applied server, so only the unhealthy mark gets it past hysteresis."""
+    import monitor
+    import update_pfsense
+
+    results = {}
+    config = {**updater_config(work_dir), "MONITOR_GATEWAY": fake_pfsense.GATEWAY_NAME,
+              "MONITOR_BREACH_WINDOW_SECONDS": 0, "MONITOR_MIN_RESELECT_INTERVAL_SECONDS": 0}
+    for scenario, degraded in (("monitor.check (healthy)", False), ("monitor.check (degraded)", True)):
+        fakes: List[fake_pfsense.FakePfSense] = []
+
+        def setup():
+            while fakes:
+                fakes.pop().__exit__(None, None, None)
+            current_ip = "203.0.113.1"
+            fake = fake_pfsense.FakePfSense(overrides=args.overrides, latency_ms=args.latency_ms,
+                                            current_ip=current_ip,
+                                            degraded_ips=(current_ip,) if degraded else ()).__enter__()
+            fakes.append(fake)
+            config["PFSENSE_BASE_URL"] = fake.base_url
+            monitor.apply_settings(config)
+            update_pfsense.save_json_file(config["APPLIED_STATE_FILE"], {
+                "server": "US-NY#9", "ip": current_ip, "utilization": 41, "applied_at": time.time(),
+            })
+            update_pfsense.save_json_file(config["SELECTION_FILE"], {
+                "server": "US-NJ#3", "ip": NEW_IP, "utilization": 40, "current_utilization": 41,
+            })
+
+        watcher = monitor.Monitor(reselect=lambda: update_pfsense.main(config))
+        try:
+            summary = timed(lambda: watcher.check(config), args.repeat, setup)
+            stats = fakes[0].stats
+            final_ip = fakes[0].current_ip
+        finally:
+            while fakes:
+                fakes.pop().__exit__(None, None, None)
+        summary["extra"] = {
+            "reselected": summary.pop("last"),
+            "final_ip": final_ip,
+            "api_requests_per_run": stats["requests"],
+        }
+        results[scenario] = summary
+    return results
+
+
+def run_scenarios(args, work_dir: str, scenarios: Dict[str, Dict[str, Any]]) -> None:
+    scenarios.update(bench_imports(args))
+    try:
+        scraper = load_scraper()
+    except ImportError as e:
+        scraper = None
+        reason = f"scrape-ng-v2.py could not be imported: {e}"
+        for name in ("find_lowest_utilization_p2p_server", "extract_endpoint_ip", "read_tables_http",
+                     "start_driver+get (no startup cache)", "start_driver+get (startup cache)", "log_in",
+                     "extract_server_rows+parse_row", "parse_row", "extract_server_records",
+                     "download_openvpn_config", "download_openvpn_configs (top 3)"):
+            scenarios[name] = skipped(reason)
+
+    if scraper:
+        scenarios.update(bench_parsing(scraper, args, work_dir))
+        scenarios.update(bench_http(scraper, args, work_dir))
+        if args.skip_browser:
+            scenarios["browser"] = skipped("--skip-browser")
+        else:
+            try:
+                scenarios.update(bench_browser(scraper, args, work_dir))
+            except Exception as e:
+                scenarios["browser"] = skipped(f"could not run headless Chrome: {type(e).__name__}: {e}")
+
+    try:
+        scenarios.update(bench_updater(args, work_dir))
+    except ImportError as e:
+        scenarios["update_pfsense.main"] = skipped(f"update_pfsense.py could not be imported: {e}")
+    try:
+        scenarios.update(bench_monitor(args, work_dir))
+    except ImportError as e:
+        scenarios["monitor.check"] = skipped(f"monitor.py could not be imported: {e}")
+
+
+def compare(results: Dict[str, Any], previous_path: str) -> None:
+    with open(previous_path, "r") as f:
+        previous = json.load(f)["scenarios"]
+    print(f"\n{'scenario':<36} {'before':>10} {'after':>10} {'change':>8}")
+    for name, summary in results.items():
+        before = previous.get(name, {})
+        if summary.get("status") != "ok" or before.get("status") != "ok":
+            continue
+        change = (summary["median"] - before["median"]) / before["median"] * 100 if before["median"] else 0.0
+        print(f"{name:<36} {before['median'] * 1000:>8.1f}ms {summary['median'] * 1000:>8.1f}ms {change:>+7.1f}%")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmarks against local fixtures.")
+    parser.add_argument("--rows", type=int, default=500, help="server table rows in the fixture (default 500)")
+    parser.add_argument("--overrides", type=int, default=200, help="host overrides on the fake firewall (default 200)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="added latency per fake API request")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per scenario (default 5)")
+    parser.add_argument("--output", default="bench_results.json", help="results file (default bench_results.json)")
+    parser.add_argument("--compare", metavar="PREVIOUS", help="a previous results file to compare against")
+    parser.add_argument("--skip-browser", action="store_true", help="skip the scenarios that launch Chrome")
+    parser.add_argument("--verbose", action="store_true", help="show the scripts' own output while they run")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="protonvpn-bench-")
+    scenarios: Dict[str, Dict[str, Any]] = {}
+    # The scripts narrate every step; keep that off the terminal (it's still
+    # inside the timings) unless asked for.
+    devnull = open(os.devnull, "w")
+    try:
+        with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull):
+            run_scenarios(args, work_dir, scenarios)
+    finally:
+        devnull.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "params": {"rows": args.rows, "overrides": args.overrides, "latency_ms": args.latency_ms,
+                   "repeat": args.repeat},
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "scenarios": scenarios,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for name, summary in scenarios.items():
+        if summary["status"] == "ok":
+            print(f"{name:<36} median {summary['median'] * 1000:>9.2f}ms  {summary.get('extra', '')}")
+        else:
+            print(f"{name:<36} skipped: {summary['reason']}")
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        compare(scenarios, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
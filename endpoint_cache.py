@@ -0,0 +1,88 @@
+"""On-disk cache of ProtonVPN server name -> its .ovpn `remote` endpoints.
+
+The same handful of servers win run after run, and a server's entry IPs
+change far less often than its utilization does. Caching them lets
+scrape-ng-v2.py resolve a repeat winner without clicking its download
+button and parsing the file again. Each entry carries the time it was
+fetched (checked against a TTL) and a hash of the .ovpn content it came
+from, so a refresh can tell whether Proton actually changed anything.
+
+update_pfsense.py drops every entry containing an IP the tunnel failed to
+come up on, so the next scrape downloads that server's config fresh instead
+of trusting a possibly-stale cached endpoint. Kept in its own module (rather
+than in scrape-ng-v2.py) so the updater can use it without importing any of
+the scraper's browser dependencies.
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+# One `remote` line of a .ovpn file: (ip, port, proto), proto "udp" or "tcp".
+Remote = Tuple[str, int, str]
+
+
+class EndpointCache:
+    def __init__(self, path: str, ttl_seconds: float):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self) -> Dict[str, dict]:
+        # Re-read on every call so an invalidation written by another process
+        # (update_pfsense.py) is seen by a long-running scraper daemon.
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, entries: Dict[str, dict]) -> None:
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def get(self, server_name: str) -> Optional[List[Remote]]:
+        """Returns the cached [(ip, port, proto), ...] for server_name, or
+        None (a miss) if there's no entry or it's older than the TTL. Entries
+        written before the proto was recorded read back as udp, OpenVPN's
+        default."""
+        entry = self._load().get(server_name)
+        if entry and time.time() - entry.get("fetched_at", 0) < self.ttl_seconds and entry.get("remotes"):
+            self.hits += 1
+            return [(remote[0], int(remote[1]), remote[2] if len(remote) > 2 else "udp")
+                    for remote in entry["remotes"]]
+        self.misses += 1
+        return None
+
+    def put(self, server_name: str, remotes: List[Remote], content: str) -> None:
+        entries = self._load()
+        content_hash = hashlib.sha256(content.encode()).hexdigest()
+        previous = entries.get(server_name)
+        if previous and previous.get("sha256") != content_hash:
+            print(f"Endpoint cache: {server_name}'s .ovpn changed since it was last cached.")
+        entries[server_name] = {
+            "remotes": [list(remote) for remote in remotes],
+            "fetched_at": time.time(),
+            "sha256": content_hash,
+        }
+        self._save(entries)
+
+    def invalidate_ip(self, ip: str) -> List[str]:
+        """Drops every entry with ip among its remotes, and returns the server
+        names dropped."""
+        entries = self._load()
+        dropped = [name for name, entry in entries.items()
+                   if any(remote[0] == ip for remote in entry.get("remotes", []))]
+        if dropped:
+            for name in dropped:
+                del entries[name]
+            self._save(entries)
+        return dropped
+
+    def summary(self) -> str:
+        return f"Endpoint cache: {self.hits} hit(s), {self.misses} miss(es)."
@@ -7,6 +7,13 @@
 # the restart uses the local pfSsh.php playback mechanism since this script
 # runs directly on the firewall.
 #
+# With ENDPOINT_MODE="direct", the OpenVPN client's own server address and
+# port are PATCHed instead (the port from SELECTION_FILE's .ovpn remotes,
+# if it's copied over too). pfSense restarts the client to apply that, so
+# there's no DNS Resolver apply - no unbound reload for every LAN client -
+# and no wait for it to settle. DIRECT_UPDATE_HOST_OVERRIDE="true" still
+# updates the host override afterwards, as a record.
+#
 # All environment-specific values (API key, host, DNS names, paths, wait
 # times) live in find_vpn.conf, sourced below - never hardcode them here.
 
@@ -24,8 +31,13 @@ fi
 
 : "${PFSENSE_BASE_URL:?PFSENSE_BASE_URL not set in $CONFIG_FILE}"
 : "${PFSENSE_API_KEY:?PFSENSE_API_KEY not set in $CONFIG_FILE}"
-: "${DNS_HOST:?DNS_HOST not set in $CONFIG_FILE}"
-: "${DNS_DOMAIN:?DNS_DOMAIN not set in $CONFIG_FILE}"
+: "${ENDPOINT_MODE:=dns}"
+: "${DIRECT_UPDATE_HOST_OVERRIDE:=false}"
+: "${SELECTION_FILE:=}"
+if [ "$ENDPOINT_MODE" != "direct" ] || [ "$DIRECT_UPDATE_HOST_OVERRIDE" = "true" ]; then
+    : "${DNS_HOST:?DNS_HOST not set in $CONFIG_FILE}"
+    : "${DNS_DOMAIN:?DNS_DOMAIN not set in $CONFIG_FILE}"
+fi
 : "${OPENVPN_VPNID:?OPENVPN_VPNID not set in $CONFIG_FILE}"
 : "${IP_FILE:?IP_FILE not set in $CONFIG_FILE}"
 : "${LOG_FILE:=/var/log/find_vpn.log}"
@@ -33,6 +45,11 @@ fi
 : "${PFSENSE_VERIFY_TLS:=false}"
 : "${APPLY_WAIT_SECONDS:=5}"
 : "${RESTART_WAIT_SECONDS:=30}"
+: "${READINESS_POLLING:=true}"
+: "${DNS_READY_SERVER:=127.0.0.1}"
+: "${DNS_READY_TIMEOUT_SECONDS:=30}"
+: "${TUNNEL_READY_TIMEOUT_SECONDS:=60}"
+: "${READY_POLL_INTERVAL_SECONDS:=1}"
 
 curl_insecure_flag=""
 if [ "$PFSENSE_VERIFY_TLS" = "false" ]; then
@@ -85,6 +102,136 @@ check_response() {
     echo "$body"
 }
 
+# wait_until DESCRIPTION TIMEOUT COMMAND...
+# Re-runs COMMAND every READY_POLL_INTERVAL_SECONDS until it succeeds
+# (returns 0) or TIMEOUT seconds pass (returns 1), logging the time spent.
+wait_until() {
+    local description="$1" timeout="$2"
+    shift 2
+    local start=$SECONDS
+    while true; do
+        if "$@"; then
+            log_data "$description after $((SECONDS - start))s"
+            return 0
+        fi
+        if [ $((SECONDS - start)) -ge "$timeout" ]; then
+            log_data "WARNING: gave up waiting for $description after ${timeout}s"
+            return 1
+        fi
+        sleep "$READY_POLL_INTERVAL_SECONDS"
+    done
+}
+
+# Asks the resolver directly (not through any local cache) whether it's
+# serving the new IP yet.
+dns_is_ready() {
+    drill "@${DNS_READY_SERVER}" "${DNS_HOST}.${DNS_DOMAIN}" A 2>/dev/null \
+        | awk '$4 == "A" {print $5}' | grep -qxF "$new_ip"
+}
+
+openvpn_client_is_up() {
+    api_request GET "/api/v2/status/openvpn/clients" | sed '$d' \
+        | jq -e --arg vpnid "$OPENVPN_VPNID" \
+            '.data[] | select((.vpnid | tostring) == $vpnid and .status == "up")' >/dev/null 2>&1
+}
+
+# Direct mode: up, and connected to the new IP where the API says which.
+openvpn_client_is_up_on_new_ip() {
+    api_request GET "/api/v2/status/openvpn/clients" | sed '$d' \
+        | jq -e --arg vpnid "$OPENVPN_VPNID" --arg ip "$new_ip" \
+            '.data[] | select((.vpnid | tostring) == $vpnid and .status == "up"
+                              and ((.remote_host // "") == "" or .remote_host == $ip))' >/dev/null 2>&1
+}
+
+# Sets override_id and lookup_body. Looks up the host override's real id -
+# never assume it's 0, since that shifts if overrides are ever
+# added/reordered in the pfSense UI.
+lookup_host_override() {
+    local lookup_raw
+    lookup_raw=$(api_request GET "/api/v2/services/dns_resolver/host_overrides")
+    lookup_body=$(check_response "$lookup_raw" "Host override lookup") || return 1
+
+    override_id=$(echo "$lookup_body" | jq -r --arg host "$DNS_HOST" --arg domain "$DNS_DOMAIN" \
+        '.data[] | select(.host == $host and .domain == $domain) | .id' | head -1)
+
+    if [ -z "$override_id" ]; then
+        log_data "ERROR: no existing DNS Resolver host override found for ${DNS_HOST}.${DNS_DOMAIN} - create it once in the pfSense UI before running this script."
+        return 1
+    fi
+    log_data "Found host override id=$override_id for ${DNS_HOST}.${DNS_DOMAIN}"
+}
+
+# PATCHes the host override to new_ip and applies the DNS Resolver change.
+update_host_override() {
+    local data patch_raw apply_raw
+    printf -v data '{"id": %s, "host": "%s", "domain": "%s", "ip": ["%s"], "descr": "Fastest ProtonVPN server, updated %s"}' \
+        "$override_id" "$DNS_HOST" "$DNS_DOMAIN" "$new_ip" "$(date '+%Y-%m-%d %H:%M:%S')"
+
+    patch_raw=$(api_request PATCH "/api/v2/services/dns_resolver/host_override" "$data")
+    check_response "$patch_raw" "Host override update" >/dev/null || return 1
+
+    apply_raw=$(api_request POST "/api/v2/services/dns_resolver/apply")
+    check_response "$apply_raw" "DNS Resolver apply" >/dev/null || return 1
+}
+
+# The port of new_ip's remote line in SELECTION_FILE for the client's
+# protocol (e.g. UDP4), else new_ip's first remote; empty if unknown.
+selection_port() {
+    local protocol="$1"
+    [ -n "$SELECTION_FILE" ] && [ -f "$SELECTION_FILE" ] || return 0
+    jq -r --arg ip "$new_ip" --arg proto "$(echo "$protocol" | tr 'A-Z' 'a-z')" \
+        '[.remotes[]?, .candidates[]?.remotes[]? | select(.[0] == $ip)] as $r
+         | ([$r[] | select((.[2] // "") as $p | $p != "" and ($proto | startswith($p)))][0] // $r[0] // [])
+         | .[1] // empty' "$SELECTION_FILE" 2>/dev/null
+}
+
+update_endpoint_direct() {
+    local clients_raw clients_body client_json client_id current_addr protocol port data patch_raw
+    clients_raw=$(api_request GET "/api/v2/vpn/openvpn/clients")
+    clients_body=$(check_response "$clients_raw" "OpenVPN client lookup") || exit 1
+
+    client_json=$(echo "$clients_body" | jq -c --arg vpnid "$OPENVPN_VPNID" \
+        '[.data[] | select((.vpnid | tostring) == $vpnid)][0] // empty')
+    if [ -z "$client_json" ]; then
+        log_data "ERROR: no OpenVPN client configured with vpnid=$OPENVPN_VPNID."
+        exit 1
+    fi
+    client_id=$(echo "$client_json" | jq -r '.id')
+    current_addr=$(echo "$client_json" | jq -r '.server_addr // empty')
+    protocol=$(echo "$client_json" | jq -r '.protocol // empty')
+    log_data "Found OpenVPN client id=$client_id (vpnid=$OPENVPN_VPNID, server $current_addr)"
+
+    if [ "$current_addr" = "$new_ip" ]; then
+        log_data "OpenVPN client already points at $new_ip; leaving pfSense and the tunnel untouched."
+        exit 0
+    fi
+
+    # Without a port from the scraper, the client keeps its configured one.
+    port=$(selection_port "$protocol")
+    data=$(jq -nc --argjson id "$client_id" --arg ip "$new_ip" --arg port "$port" \
+        '{id: $id, server_addr: $ip} + (if $port != "" then {server_port: $port} else {} end)')
+
+    # pfSense applies this by restarting the client on the new remote.
+    patch_raw=$(api_request PATCH "/api/v2/vpn/openvpn/client" "$data")
+    check_response "$patch_raw" "OpenVPN client update" >/dev/null || exit 1
+
+    if [ "$READINESS_POLLING" = "true" ] && \
+        ! wait_until "OpenVPN client is up" "$TUNNEL_READY_TIMEOUT_SECONDS" openvpn_client_is_up_on_new_ip; then
+        log_data "ERROR: OpenVPN client (vpnid=$OPENVPN_VPNID) did not come up on $new_ip"
+        exit 1
+    fi
+
+    # The tunnel no longer depends on the override, so this is best-effort.
+    if [ "$DIRECT_UPDATE_HOST_OVERRIDE" = "true" ]; then
+        if ! { lookup_host_override && update_host_override; }; then
+            log_data "WARNING: the tunnel is up on $new_ip, but updating the host override failed."
+        fi
+    fi
+
+    log_data "Done."
+    exit 0
+}
+
 if [ ! -f "$IP_FILE" ]; then
     log_data "ERROR: $IP_FILE does not exist. Nothing to do."
     exit 1
@@ -99,35 +246,31 @@ fi
 log_data "Read best server IP: $new_ip"
 cp "$IP_FILE" "$BACKUP_FILE"
 
-# Look up the host override's real id - never assume it's 0, since that
-# shifts if overrides are ever added/reordered in the pfSense UI.
-lookup_raw=$(api_request GET "/api/v2/services/dns_resolver/host_overrides")
-lookup_body=$(check_response "$lookup_raw" "Host override lookup") || exit 1
-
-override_id=$(echo "$lookup_body" | jq -r --arg host "$DNS_HOST" --arg domain "$DNS_DOMAIN" \
-    '.data[] | select(.host == $host and .domain == $domain) | .id' | head -1)
-
-if [ -z "$override_id" ]; then
-    log_data "ERROR: no existing DNS Resolver host override found for ${DNS_HOST}.${DNS_DOMAIN} - create it once in the pfSense UI before running this script."
-    exit 1
+if [ "$ENDPOINT_MODE" = "direct" ]; then
+    update_endpoint_direct
 fi
 
-log_data "Found host override id=$override_id for ${DNS_HOST}.${DNS_DOMAIN}"
-
-printf -v data '{"id": %s, "host": "%s", "domain": "%s", "ip": ["%s"], "descr": "Fastest ProtonVPN server, updated %s"}' \
-    "$override_id" "$DNS_HOST" "$DNS_DOMAIN" "$new_ip" "$(date '+%Y-%m-%d %H:%M:%S')"
+lookup_host_override || exit 1
 
-patch_raw=$(api_request PATCH "/api/v2/services/dns_resolver/host_override" "$data")
-check_response "$patch_raw" "Host override update" >/dev/null || exit 1
+# Already pointed at this IP - nothing to change, so don't restart the tunnel.
+if echo "$lookup_body" | jq -e --arg id "$override_id" --arg ip "$new_ip" \
+    '.data[] | select((.id | tostring) == $id) | .ip | index($ip)' >/dev/null 2>&1; then
+    log_data "Host override already points at $new_ip; leaving pfSense and the tunnel untouched."
+    exit 0
+fi
 
-apply_raw=$(api_request POST "/api/v2/services/dns_resolver/apply")
-check_response "$apply_raw" "DNS Resolver apply" >/dev/null || exit 1
+update_host_override || exit 1
 
-log_data "Waiting ${APPLY_WAIT_SECONDS}s for DNS apply to settle..."
-sleep "$APPLY_WAIT_SECONDS"
+if [ "$READINESS_POLLING" = "true" ]; then
+    # Not fatal if it never confirms - no worse than the fixed sleep below.
+    wait_until "DNS Resolver is serving the new IP" "$DNS_READY_TIMEOUT_SECONDS" dns_is_ready
+else
+    log_data "Waiting ${APPLY_WAIT_SECONDS}s for DNS apply to settle..."
+    sleep "$APPLY_WAIT_SECONDS"
 
-log_data "Waiting ${RESTART_WAIT_SECONDS}s before restarting OpenVPN..."
-sleep "$RESTART_WAIT_SECONDS"
+    log_data "Waiting ${RESTART_WAIT_SECONDS}s before restarting OpenVPN..."
+    sleep "$RESTART_WAIT_SECONDS"
+fi
 
 log_data "Restarting OpenVPN client (vpnid=$OPENVPN_VPNID)..."
 openvpn_restart=$(pfSsh.php playback svc restart openvpn client "$OPENVPN_VPNID" 2>&1)
@@ -139,5 +282,11 @@ if [ "$restart_status" -ne 0 ]; then
     exit 1
 fi
 
+if [ "$READINESS_POLLING" = "true" ] && \
+    ! wait_until "OpenVPN client is up" "$TUNNEL_READY_TIMEOUT_SECONDS" openvpn_client_is_up; then
+    log_data "ERROR: OpenVPN client (vpnid=$OPENVPN_VPNID) did not come up on $new_ip"
+    exit 1
+fi
+
 log_data "Done."
 exit 0
@@ -0,0 +1,133 @@
+"""The handoff files between scrape-ng-v2.py and update_pfsense.py.
+
+Each run writes the winning IP to OUTPUT_FILE (all find_vpn.sh reads), then
+its structured record to SELECTION_FILE: server, utilization, ip and ips,
+the remotes and ranked failover candidates, plus when it was written
+(timestamp) and by which run (run_id, the same id as the run's metrics).
+Both are written whole under a temp name and renamed into place, so a
+reader - possibly another process, or the other end of a network share -
+never sees a half-written file. SELECTION_FILE goes last, so whoever sees it
+change can trust the matching OUTPUT_FILE is already there.
+
+HandoffWatcher lets update_pfsense.py --watch react the moment a scraper
+(another host, cron, a daemon) replaces those files. On Linux it uses
+inotify through libc; anywhere else, or if that fails, it polls the files'
+inode and mtime instead. Nothing here imports Selenium or requests.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+# From <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+POLL_INTERVAL_SECONDS = 1.0
+
+
+def write_atomic(path: str, text: str) -> None:
+    """Writes text to path via a temp file in the same directory + rename."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class HandoffWatcher:
+    """Waits for any of paths to be replaced or rewritten. The watch is on
+    each file's directory, not the file itself: an atomic rename swaps in a
+    new inode, which a watch on the old one would never hear about. If
+    inotify can't be set up, it polls instead and inotify_error says why,
+    for the caller to report in its own log."""
+
+    def __init__(self, paths: Iterable[str]):
+        self.paths = {os.path.abspath(path) for path in paths}
+        self.fd = -1
+        self.dirs: Dict[int, str] = {}
+        self.stamps: Dict[str, Optional[Tuple[int, int]]] = {}
+        self.inotify_error: Optional[str] = None
+        try:
+            self._start_inotify()
+        except OSError as e:
+            self.inotify_error = str(e)
+            self.close()
+            self.stamps = {path: self._stamp(path) for path in self.paths}
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self.fd >= 0 else "polling"
+
+    def _start_inotify(self) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("not supported on this platform")
+        self.fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        for directory in {os.path.dirname(path) for path in self.paths}:
+            wd = libc.inotify_add_watch(self.fd, directory.encode(), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"{directory}: {os.strerror(ctypes.get_errno())}")
+            self.dirs[wd] = directory
+
+    @staticmethod
+    def _stamp(path: str) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def wait(self, timeout: Optional[float] = None) -> Set[str]:
+        """Blocks until at least one watched file changes (or timeout
+        seconds pass) and returns the changed paths - empty on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            changed = self._wait_inotify(remaining) if self.fd >= 0 else self._wait_polling(remaining)
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def _wait_inotify(self, timeout: Optional[float]) -> Set[str]:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            path = os.path.join(self.dirs.get(wd, ""), name)
+            if path in self.paths:
+                changed.add(path)
+        return changed
+
+    def _wait_polling(self, timeout: Optional[float]) -> Set[str]:
+        time.sleep(POLL_INTERVAL_SECONDS if timeout is None else min(POLL_INTERVAL_SECONDS, timeout))
+        changed = set()
+        for path in self.paths:
+            stamp = self._stamp(path)
+            if stamp is not None and stamp != self.stamps.get(path):
+                changed.add(path)
+            self.stamps[path] = stamp
+        return changed
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+        self.fd = -1
+        self.dirs = {}
@@ -0,0 +1,186 @@
+"""Local history of every scraped server row, and trend-aware scoring on it.
+
+scrape-ng-v2.py records each run's full table - (timestamp, server, state,
+utilization, p2p) for every row, not just the winner - into a small SQLite
+database (HISTORY_DB). One run's rows go in as a single batched insert, and
+the table is indexed by server and time. Old rows are kept small in two
+steps: past HISTORY_DOWNSAMPLE_AFTER_HOURS they're collapsed to one
+hourly-average row per server, and past HISTORY_RETENTION_DAYS they're
+deleted.
+
+On top of that, trend_scores() gives each server a score from its recent
+samples instead of a single snapshot. The score is its exponentially-
+weighted moving average load (EWMA, with a half-life in hours), plus a
+penalty proportional to its exponentially-weighted standard deviation. With
+SELECTION_POLICY set to "ewma", the scraper ranks candidates by this score.
+A server that's only quiet for a moment then no longer beats one that's
+steadily quiet, which avoids switching to it and away again an hour later.
+
+Run directly for a small query/export CLI (reads HISTORY_DB and the EWMA
+settings from config.json):
+
+    python3 history.py summary [--hours 24] [--server US-NY#1]
+    python3 history.py export [--hours 24] [--server US-NY#1] [--format csv|json]
+"""
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import sqlite3
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+CONFIG_FILE = "config.json"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    ts INTEGER NOT NULL,
+    server TEXT NOT NULL,
+    state TEXT,
+    utilization INTEGER NOT NULL,
+    p2p INTEGER NOT NULL,
+    downsampled INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS samples_server_ts ON samples (server, ts);
+CREATE INDEX IF NOT EXISTS samples_ts ON samples (ts);
+"""
+
+
+class HistoryStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def record(self, rows: Iterable[Tuple[str, Optional[str], int, bool]], ts: Optional[int] = None) -> int:
+        """Stores one scrape's (server, state, utilization, p2p) rows, all
+        stamped ts (default now), in a single transaction. Returns the number
+        of rows stored."""
+        ts = int(ts if ts is not None else time.time())
+        batch = [(ts, server, state, utilization, int(p2p)) for server, state, utilization, p2p in rows]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO samples (ts, server, state, utilization, p2p) VALUES (?, ?, ?, ?, ?)", batch
+            )
+        return len(batch)
+
+    def prune(self, downsample_after_hours: float, retention_days: float) -> None:
+        """Collapses raw rows older than downsample_after_hours into one
+        hourly-average row per server, and deletes anything older than
+        retention_days. Only whole hours are collapsed: the cutoff is
+        rounded down to the hour, so the hour it falls in keeps its raw rows
+        until a later prune takes it all at once, rather than being
+        averaged piecemeal into several rows."""
+        now = time.time()
+        downsample_before = int(now - downsample_after_hours * 3600) // 3600 * 3600
+        with self.conn:
+            self.conn.execute(
+                """INSERT INTO samples (ts, server, state, utilization, p2p, downsampled)
+                   SELECT (ts / 3600) * 3600, server, MAX(state), CAST(ROUND(AVG(utilization)) AS INTEGER),
+                          MAX(p2p), 1
+                   FROM samples WHERE ts < ? AND downsampled = 0
+                   GROUP BY ts / 3600, server""",
+                (downsample_before,),
+            )
+            self.conn.execute("DELETE FROM samples WHERE ts < ? AND downsampled = 0", (downsample_before,))
+            self.conn.execute("DELETE FROM samples WHERE ts < ?", (int(now - retention_days * 86400),))
+
+    def samples(self, since: int, servers: Optional[List[str]] = None) -> List[Tuple[int, str, Optional[str], int, int]]:
+        """(ts, server, state, utilization, p2p) rows since the given time,
+        grouped by server and oldest first, optionally only for the given
+        servers. Those are filtered here rather than bound into an IN (...)
+        clause: a whole country's table can exceed the 999 variables SQLite
+        before 3.32 allows per statement."""
+        rows = self.conn.execute(
+            "SELECT ts, server, state, utilization, p2p FROM samples WHERE ts >= ? ORDER BY server, ts", (since,)
+        ).fetchall()
+        if servers:
+            wanted = set(servers)
+            rows = [row for row in rows if row[1] in wanted]
+        return rows
+
+    def trend_stats(self, since: int, half_life_hours: float,
+                    servers: Optional[List[str]] = None) -> Dict[str, Tuple[float, float, int]]:
+        """{server: (ewma_load, ewma_stddev, sample_count)} over samples since
+        the given time. Samples are irregularly spaced, so each one's weight
+        decays by its actual age (half_life_hours) rather than per sample."""
+        stats: Dict[str, Tuple[float, float, int]] = {}
+        half_life = half_life_hours * 3600
+        for server, rows in itertools.groupby(self.samples(since, servers), key=lambda row: row[1]):
+            rows = list(rows)
+            last_ts, mean, var = rows[0][0], float(rows[0][3]), 0.0
+            for ts, _, _, utilization, _ in rows[1:]:
+                alpha = 1 - 0.5 ** ((ts - last_ts) / half_life) if half_life > 0 else 1.0
+                diff = utilization - mean
+                mean += alpha * diff
+                var = (1 - alpha) * (var + alpha * diff * diff)
+                last_ts = ts
+            stats[server] = (mean, math.sqrt(var), len(rows))
+        return stats
+
+    def trend_scores(self, servers: List[str], window_hours: float, half_life_hours: float,
+                     variance_weight: float) -> Dict[str, float]:
+        """{server: ewma_load + variance_weight * ewma_stddev} for the given
+        servers, from their samples in the last window_hours. Lower is
+        better. Servers with no history are absent."""
+        since = int(time.time() - window_hours * 3600)
+        return {
+            server: mean + variance_weight * stddev
+            for server, (mean, stddev, _) in self.trend_stats(since, half_life_hours, servers).items()
+        }
+
+
+def _cli() -> int:
+    parser = argparse.ArgumentParser(description="Query or export the scraped server utilization history.")
+    parser.add_argument("--db", help="history database (default: HISTORY_DB from config.json)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("summary", "per-server trend statistics"), ("export", "raw samples")):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument("--hours", type=float, default=24, help="how far back to look (default 24)")
+        sub.add_argument("--server", action="append", help="only this server (repeatable)")
+    subparsers.choices["export"].add_argument("--format", choices=("csv", "json"), default="csv")
+    args = parser.parse_args()
+
+    config = {}
+    if os.path.exists(CONFIG_FILE):
+        with open(CONFIG_FILE, "r") as f:
+            config = json.load(f)
+    db_path = args.db or config.get("HISTORY_DB", "history.sqlite3")
+    if not db_path or not os.path.exists(db_path):
+        print(f"No history database found at {db_path!r}.", file=sys.stderr)
+        return 1
+
+    store = HistoryStore(db_path)
+    try:
+        since = int(time.time() - args.hours * 3600)
+        if args.command == "export":
+            rows = store.samples(since, args.server)
+            fields = ("ts", "server", "state", "utilization", "p2p")
+            if args.format == "json":
+                json.dump([dict(zip(fields, row)) for row in rows], sys.stdout, indent=2)
+                print()
+            else:
+                writer = csv.writer(sys.stdout)
+                writer.writerow(fields)
+                writer.writerows(rows)
+            return 0
+
+        half_life = config.get("HISTORY_EWMA_HALF_LIFE_HOURS", 6)
+        variance_weight = config.get("HISTORY_VARIANCE_WEIGHT", 0.5)
+        stats = store.trend_stats(since, half_life, args.server)
+        print(f"{'server':<16} {'samples':>7} {'ewma':>6} {'stddev':>6} {'score':>6}")
+        for server, (mean, stddev, count) in sorted(stats.items(), key=lambda item: item[1][0]):
+            print(f"{server:<16} {count:>7} {mean:>6.1f} {stddev:>6.1f} {mean + variance_weight * stddev:>6.1f}")
+        return 0
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    sys.exit(_cli())
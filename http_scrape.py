@@ -0,0 +1,197 @@
+"""Browserless refresh of the server table, using a saved session's cookies.
+
+After a successful browser run, scrape-ng-v2.py (with HTTP_REFRESH on)
+exports the browser's cookies to SESSION_COOKIE_FILE. Later runs first try
+to read the server table over plain HTTP with those cookies - no Chrome
+at all - and only fall back to the browser when that can't work: the
+session has expired (a redirect to the login page, or a 401/403), the
+response can't be parsed, or the winner's endpoint isn't in the endpoint
+cache (downloading a .ovpn still needs the page's own JavaScript).
+
+Two sources are supported (HTTP_SOURCE):
+
+- "html": DOWNLOAD_URL's HTML, parsed for the same <details>/<table> rows
+  extract_server_rows() reads. This needs the table to be in the served
+  HTML; it's what bench/fixture_site.py serves.
+- "json": the JSON the downloads page itself loads the list from
+  (HTTP_SERVERS_JSON_URL, Proton's "logicals" format: LogicalServers
+  entries with Name, ExitCountry, Load, Features and Status).
+
+Both return the raw (server_name, utilization_text, supports_p2p) rows the
+browser path produces, so the scraper's own parsing, filtering and
+selection code runs unchanged on either. Nothing here imports Selenium.
+"""
+import json
+import os
+import re
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+RawRow = Tuple[str, str, bool]
+
+# Proton's logical server feature bits; P2P is 4.
+P2P_FEATURE_BIT = 4
+
+
+class SessionExpired(Exception):
+    """The saved cookies no longer authenticate; a browser login is needed."""
+
+
+class HttpScrapeError(Exception):
+    """The HTTP path couldn't produce a result; the browser path should run."""
+
+
+def save_cookies(path: str, cookies: List[Dict[str, Any]]) -> None:
+    """Writes Selenium-style cookie dicts (driver.get_cookies()) to path,
+    owner-only, via a temp file + rename. They're a live session - treat
+    the file like config.json."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(cookies, f)
+    os.replace(tmp_path, path)
+
+
+def load_session(path: str, headers: Optional[Dict[str, str]] = None) -> requests.Session:
+    """A requests.Session carrying the cookies saved at path. Proton's API
+    also wants the session's UID as an x-pm-uid header; it's derived from
+    the AUTH-<uid> cookie unless headers already sets it."""
+    try:
+        with open(path, "r") as f:
+            cookies = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SessionExpired(f"no usable saved session in {path} ({e})")
+
+    session = requests.Session()
+    session.headers.update({"Accept": "text/html,application/json"})
+    session.headers.update(headers or {})
+    for cookie in cookies:
+        session.cookies.set(cookie["name"], cookie["value"],
+                            domain=cookie.get("domain", ""), path=cookie.get("path", "/"))
+        if cookie["name"].startswith("AUTH-") and "x-pm-uid" not in {k.lower() for k in session.headers}:
+            session.headers["x-pm-uid"] = cookie["name"][len("AUTH-"):]
+    return session
+
+
+def fetch(session: requests.Session, url: str, login_url: str, timeout: float) -> requests.Response:
+    """GETs url, following redirects, and raises SessionExpired if that
+    lands on login_url or is refused outright."""
+    try:
+        response = session.get(url, timeout=timeout)
+    except requests.RequestException as e:
+        raise HttpScrapeError(f"GET {url} failed: {e}")
+    if response.url.startswith(login_url) or response.status_code in (401, 403):
+        raise SessionExpired(f"{url} redirected to the login page (HTTP {response.status_code})")
+    if not response.ok:
+        raise HttpScrapeError(f"GET {url} returned HTTP {response.status_code}")
+    return response
+
+
+def parse_simple_selector(selector: str) -> Tuple[str, List[str]]:
+    """Splits a tag.class.class CSS selector (the only form the HTML path
+    evaluates) into (tag, classes). Anything else raises HttpScrapeError so
+    the browser, which understands full CSS, is used instead."""
+    match = re.fullmatch(r"([a-zA-Z][a-zA-Z0-9]*)?((?:\.[\w-]+)*)", selector.strip())
+    if not match or not selector.strip():
+        raise HttpScrapeError(f"selector {selector!r} is too complex for the HTTP path")
+    return (match.group(1) or "").lower(), [c for c in match.group(2).split(".") if c]
+
+
+class _ServerTableParser(HTMLParser):
+    """Collects the rows of the first <table> inside the <details> block
+    whose <summary> mentions country_name."""
+
+    def __init__(self, country_name: str, p2p_selector: str):
+        super().__init__(convert_charrefs=True)
+        self.country_name = country_name
+        self.p2p_tag, self.p2p_classes = parse_simple_selector(p2p_selector)
+        self.details_depth = 0
+        self.matching_depth = 0  # details_depth of the matching block, 0 if none yet
+        self.in_summary = False
+        self.summary_text: List[str] = []
+        self.table_depth = 0
+        self.done = False
+        self.rows: List[RawRow] = []
+        self.cells: Optional[List[List[str]]] = None
+        self.row_p2p = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == "details":
+            self.details_depth += 1
+        elif tag == "summary" and not self.matching_depth:
+            self.in_summary, self.summary_text = True, []
+        elif self.matching_depth:
+            if tag == "table":
+                self.table_depth += 1
+            elif self.table_depth == 1 and tag == "tr":
+                self.cells, self.row_p2p = [], False
+            elif self.cells is not None and tag == "td":
+                self.cells.append([])
+            if self.cells is not None and (not self.p2p_tag or tag == self.p2p_tag):
+                classes = (dict(attrs).get("class") or "").split()
+                if all(c in classes for c in self.p2p_classes):
+                    self.row_p2p = True
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+        if tag == "summary" and self.in_summary:
+            self.in_summary = False
+            if self.country_name in " ".join("".join(self.summary_text).split()):
+                self.matching_depth = self.details_depth
+        elif tag == "tr" and self.cells is not None:
+            if len(self.cells) >= 3:
+                self.rows.append((
+                    " ".join("".join(self.cells[0]).split()),
+                    " ".join("".join(self.cells[2]).split()),
+                    self.row_p2p,
+                ))
+            self.cells = None
+        elif tag == "table" and self.table_depth:
+            self.table_depth -= 1
+            if not self.table_depth:
+                self.done = True
+        elif tag == "details":
+            if self.matching_depth == self.details_depth:
+                self.done = True
+            self.details_depth -= 1
+
+    def handle_data(self, data):
+        if self.in_summary:
+            self.summary_text.append(data)
+        elif self.cells:
+            self.cells[-1].append(data)
+
+
+def parse_server_table(html: str, country_name: str, p2p_selector: str) -> List[RawRow]:
+    """The country's server rows from the downloads page HTML, as
+    (server_name, utilization_text, supports_p2p)."""
+    parser = _ServerTableParser(country_name, p2p_selector)
+    parser.feed(html)
+    parser.close()
+    if not parser.matching_depth:
+        raise HttpScrapeError(f"no server section for {country_name!r} in the page")
+    if not parser.rows:
+        raise HttpScrapeError(f"the {country_name!r} section has no server rows")
+    return parser.rows
+
+
+def parse_logicals(data: Dict[str, Any], country_code: str) -> List[RawRow]:
+    """The same rows from Proton's logicals JSON: online servers exiting in
+    country_code."""
+    try:
+        servers = data["LogicalServers"]
+    except (KeyError, TypeError):
+        raise HttpScrapeError("the server list JSON has no LogicalServers")
+    rows = [
+        (server["Name"], f"{server['Load']}%", bool(int(server.get("Features", 0)) & P2P_FEATURE_BIT))
+        for server in servers
+        if server.get("ExitCountry") == country_code and server.get("Status", 1) == 1
+    ]
+    if not rows:
+        raise HttpScrapeError(f"no online {country_code} servers in the server list JSON")
+    return rows
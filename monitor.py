@@ -0,0 +1,320 @@
+"""Re-selects a server only when the tunnel is actually unhealthy.
+
+Instead of running scrape-ng-v2.py and update_pfsense.py from cron on a
+fixed schedule, whether or not the current tunnel is fine, run
+
+    venv/bin/python3 monitor.py
+
+Every MONITOR_INTERVAL_SECONDS it samples each firewall/profile target
+(see update_pfsense.firewall_targets) through the pfSense REST API:
+
+- the OpenVPN client's status (OPENVPN_VPNID) - a client that isn't up is
+  always a breach;
+- MONITOR_GATEWAY's RTT and packet loss, as pfSense's gateway monitor
+  (dpinger) reports them, if set;
+- optionally MONITOR_PROBE_URL, fetched from this host - whose traffic has
+  to route through that tunnel - for its time to first byte and
+  throughput.
+
+A sample breaches if the tunnel is down or any of RTT, loss, probe time or
+throughput is past its threshold (MONITOR_MAX_RTT_MS,
+MONITOR_MAX_LOSS_PERCENT, MONITOR_MAX_PROBE_MS,
+MONITOR_MIN_THROUGHPUT_KBPS; 0 disables one). A target that has breached
+on every sample for MONITOR_BREACH_WINDOW_SECONDS gets its applied server
+marked unhealthy in its own APPLIED_STATE_FILE - one per firewall and
+profile, so only that target's flag is set. The scraper then passes that
+server over, and the updater switches that target away from it regardless
+of hysteresis; other firewalls keep their dwell and improvement checks.
+Then MONITOR_RESELECT_COMMAND (pipeline.py by default) runs, at most once
+per MONITOR_MIN_RESELECT_INTERVAL_SECONDS.
+
+A sample that can't reach the pfSense API at all says nothing about the
+tunnel and is skipped. MONITOR_GATEWAY and MONITOR_PROBE_URL can be set per
+firewall or selection profile, like DNS_HOST. Each cycle's samples are
+exported through telemetry.py as the "monitor" job. --once takes a single
+sample and exits, e.g. to check the thresholds against the live tunnel.
+Like update_pfsense.py, nothing here imports the scraper or Selenium.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+import update_pfsense
+from update_pfsense import (
+    PfSenseClient,
+    client_roles,
+    find_gateway_group,
+    firewall_targets,
+    is_dual_client,
+    load_config,
+    load_json_file,
+    log,
+    openvpn_client_is_up,
+    save_json_file,
+)
+from telemetry import RunTelemetry
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Fallback defaults only; apply_settings() sets them from config.json at
+# the start of every cycle.
+MONITOR_INTERVAL_SECONDS = 60
+MONITOR_GATEWAY = ""
+MONITOR_MAX_RTT_MS = 250
+MONITOR_MAX_LOSS_PERCENT = 10
+MONITOR_PROBE_URL = ""
+MONITOR_PROBE_TIMEOUT_SECONDS = 10
+MONITOR_MAX_PROBE_MS = 0
+MONITOR_MIN_THROUGHPUT_KBPS = 0
+MONITOR_BREACH_WINDOW_SECONDS = 300
+MONITOR_MIN_RESELECT_INTERVAL_SECONDS = 1800
+# Empty runs pipeline.py (scrape, then update) with this interpreter.
+MONITOR_RESELECT_COMMAND: List[str] = []
+
+
+def apply_settings(config: Dict[str, Any]) -> None:
+    global MONITOR_INTERVAL_SECONDS, MONITOR_GATEWAY, MONITOR_MAX_RTT_MS, MONITOR_MAX_LOSS_PERCENT
+    global MONITOR_PROBE_URL, MONITOR_PROBE_TIMEOUT_SECONDS, MONITOR_MAX_PROBE_MS, MONITOR_MIN_THROUGHPUT_KBPS
+    global MONITOR_BREACH_WINDOW_SECONDS, MONITOR_MIN_RESELECT_INTERVAL_SECONDS, MONITOR_RESELECT_COMMAND
+
+    update_pfsense.apply_settings(config)  # LOG_FILE and the metrics settings
+    MONITOR_INTERVAL_SECONDS = config.get("MONITOR_INTERVAL_SECONDS", MONITOR_INTERVAL_SECONDS)
+    MONITOR_GATEWAY = config.get("MONITOR_GATEWAY", MONITOR_GATEWAY)
+    MONITOR_MAX_RTT_MS = config.get("MONITOR_MAX_RTT_MS", MONITOR_MAX_RTT_MS)
+    MONITOR_MAX_LOSS_PERCENT = config.get("MONITOR_MAX_LOSS_PERCENT", MONITOR_MAX_LOSS_PERCENT)
+    MONITOR_PROBE_URL = config.get("MONITOR_PROBE_URL", MONITOR_PROBE_URL)
+    MONITOR_PROBE_TIMEOUT_SECONDS = config.get("MONITOR_PROBE_TIMEOUT_SECONDS", MONITOR_PROBE_TIMEOUT_SECONDS)
+    MONITOR_MAX_PROBE_MS = config.get("MONITOR_MAX_PROBE_MS", MONITOR_MAX_PROBE_MS)
+    MONITOR_MIN_THROUGHPUT_KBPS = config.get("MONITOR_MIN_THROUGHPUT_KBPS", MONITOR_MIN_THROUGHPUT_KBPS)
+    MONITOR_BREACH_WINDOW_SECONDS = config.get("MONITOR_BREACH_WINDOW_SECONDS", MONITOR_BREACH_WINDOW_SECONDS)
+    MONITOR_MIN_RESELECT_INTERVAL_SECONDS = config.get("MONITOR_MIN_RESELECT_INTERVAL_SECONDS",
+                                                       MONITOR_MIN_RESELECT_INTERVAL_SECONDS)
+    MONITOR_RESELECT_COMMAND = config.get("MONITOR_RESELECT_COMMAND", MONITOR_RESELECT_COMMAND)
+
+
+def parse_measurement(value: Any) -> Optional[float]:
+    """pfSense reports gateway figures as strings with units ("12.3ms",
+    "0.0%"); returns the number, or None if there isn't one."""
+    match = re.match(r"\s*(\d+(?:\.\d+)?)", str(value)) if value is not None else None
+    return float(match.group(1)) if match else None
+
+
+def gateway_status(client: PfSenseClient, gateway: str) -> Dict[str, Any]:
+    """The named gateway's monitor figures: rtt_ms, loss_percent and
+    whether pfSense has marked it down (as opposed to merely lossy or
+    slow, which the thresholds judge)."""
+    body = client.request("GET", "/api/v2/status/gateways")
+    for entry in body.get("data") or []:
+        if entry.get("name") == gateway:
+            return {
+                "gateway_online": str(entry.get("status", "")).lower() != "down",
+                "rtt_ms": parse_measurement(entry.get("delay")),
+                "loss_percent": parse_measurement(entry.get("loss")),
+            }
+    raise RuntimeError(f"No gateway named {gateway} in /status/gateways.")
+
+
+def probe_tunnel(url: str, timeout: float) -> Dict[str, Any]:
+    """GETs url and returns its time to first byte (probe_ms) and the
+    transfer's throughput (throughput_kbps). A failed probe reports
+    probe_ok False instead of raising - through a bad tunnel that's the
+    expected outcome."""
+    start = time.monotonic()
+    first_byte = None
+    size = 0
+    try:
+        with requests.get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(64 * 1024):
+                if first_byte is None:
+                    first_byte = time.monotonic() - start
+                size += len(chunk)
+                if time.monotonic() - start > timeout:
+                    break
+    except requests.RequestException as e:
+        return {"probe_ok": False, "probe_error": str(e)}
+    elapsed = max(time.monotonic() - start, 1e-6)
+    return {
+        "probe_ok": True,
+        "probe_ms": (first_byte if first_byte is not None else elapsed) * 1000,
+        "throughput_kbps": size * 8 / 1000 / elapsed,
+    }
+
+
+def sample_health(client: PfSenseClient) -> Dict[str, Any]:
+    """One look at client's target: tunnel status, plus its gateway and
+    probe figures when those are configured. With a standby client (see
+    update_pfsense.apply_update_make_before_break), it's whichever of the
+    two is carrying traffic that's looked at, through its own gateway."""
+    config = client.config
+    vpnid = config["OPENVPN_VPNID"]
+    gateway = config.get("MONITOR_GATEWAY", MONITOR_GATEWAY)
+    if is_dual_client(config):
+        active, _ = client_roles(config, find_gateway_group(client))
+        vpnid, gateway = active["OPENVPN_VPNID"], active["OPENVPN_GATEWAY"]
+    sample: Dict[str, Any] = {"up": openvpn_client_is_up(client, vpnid)}
+    if gateway:
+        sample.update(gateway_status(client, gateway))
+    probe_url = config.get("MONITOR_PROBE_URL", MONITOR_PROBE_URL)
+    if probe_url and sample["up"]:
+        sample.update(probe_tunnel(probe_url, MONITOR_PROBE_TIMEOUT_SECONDS))
+    return sample
+
+
+def breaches(sample: Dict[str, Any]) -> List[str]:
+    """Which thresholds sample is past, as readable reasons; empty if
+    healthy."""
+    if not sample["up"]:
+        return ["OpenVPN client is not up"]
+    reasons = []
+    if sample.get("gateway_online") is False:
+        reasons.append("gateway is down")
+    if MONITOR_MAX_RTT_MS and (sample.get("rtt_ms") or 0) > MONITOR_MAX_RTT_MS:
+        reasons.append(f"RTT {sample['rtt_ms']:.0f} ms > {MONITOR_MAX_RTT_MS} ms")
+    if MONITOR_MAX_LOSS_PERCENT and (sample.get("loss_percent") or 0) > MONITOR_MAX_LOSS_PERCENT:
+        reasons.append(f"loss {sample['loss_percent']:.0f}% > {MONITOR_MAX_LOSS_PERCENT}%")
+    if sample.get("probe_ok") is False:
+        reasons.append(f"probe failed ({sample.get('probe_error')})")
+    elif sample.get("probe_ok"):
+        if MONITOR_MAX_PROBE_MS and sample["probe_ms"] > MONITOR_MAX_PROBE_MS:
+            reasons.append(f"probe {sample['probe_ms']:.0f} ms > {MONITOR_MAX_PROBE_MS} ms")
+        if MONITOR_MIN_THROUGHPUT_KBPS and sample["throughput_kbps"] < MONITOR_MIN_THROUGHPUT_KBPS:
+            reasons.append(f"throughput {sample['throughput_kbps']:.0f} kbps < {MONITOR_MIN_THROUGHPUT_KBPS} kbps")
+    return reasons
+
+
+def mark_unhealthy(target: Dict[str, Any], reasons: List[str]) -> None:
+    """Flags target's applied server as unhealthy for the re-selection (see
+    the module docstring). The updater's next switch rewrites the file and
+    clears the flag. Nothing to flag if nothing was ever applied."""
+    path = target["APPLIED_STATE_FILE"]
+    applied = load_json_file(path)
+    if not applied:
+        return
+    applied.update({"unhealthy_at": time.time(), "unhealthy_reason": "; ".join(reasons)})
+    try:
+        save_json_file(path, applied)
+    except OSError as e:
+        log(f"WARNING: could not mark {applied.get('server')} unhealthy in {path}: {e}")
+
+
+def run_reselect_command() -> int:
+    """Runs MONITOR_RESELECT_COMMAND and returns its exit code."""
+    command = MONITOR_RESELECT_COMMAND or [sys.executable, os.path.join(HERE, "pipeline.py")]
+    log(f"Running {' '.join(command)}")
+    return subprocess.run(command).returncode
+
+
+class Monitor:
+    """Tracks how long each target has been breaching across cycles, and
+    when the last re-selection ran. reselect is what a due re-selection
+    calls (run_reselect_command unless given) and returns an exit code."""
+
+    def __init__(self, reselect: Optional[Callable[[], int]] = None):
+        self.reselect = reselect or run_reselect_command
+        self.breach_since: Dict[str, float] = {}
+        self.last_reselect: Optional[float] = None
+        self.reselects = 0
+
+    def check(self, config: Dict[str, Any]) -> bool:
+        """Samples every target once and re-selects if one has been
+        breaching for the whole window and the rate limit allows it.
+        Returns whether it re-selected."""
+        telemetry = RunTelemetry("monitor")
+        reselected = False
+        try:
+            targets = firewall_targets(config)
+            due = []
+            for target in targets:
+                prefix = f"[{target['NAME']}] " if len(targets) > 1 else ""
+                labels = {"target": target["NAME"]} if len(targets) > 1 else {}
+                client = PfSenseClient(target, telemetry, labels)
+                try:
+                    with client.span("sample"):
+                        sample = sample_health(client)
+                except Exception as e:
+                    log(f"{prefix}WARNING: could not sample the tunnel ({type(e).__name__} - {e}); skipping.")
+                    continue
+                finally:
+                    client.close()
+                self.report(sample, telemetry, labels)
+
+                reasons = breaches(sample)
+                now = time.monotonic()
+                if not reasons:
+                    if self.breach_since.pop(target["NAME"], None) is not None:
+                        log(f"{prefix}Tunnel healthy again.")
+                    continue
+                since = self.breach_since.setdefault(target["NAME"], now)
+                log(f"{prefix}Unhealthy for {now - since:.0f}s "
+                    f"(window {MONITOR_BREACH_WINDOW_SECONDS}s): {', '.join(reasons)}")
+                if now - since >= MONITOR_BREACH_WINDOW_SECONDS:
+                    due.append((target, reasons))
+            if due:
+                reselected = self.maybe_reselect(due)
+        finally:
+            telemetry.gauge("reselects_total", self.reselects, "Re-selections this monitor has run.")
+            telemetry.finish(True, update_pfsense.METRICS_TRACE_FILE, update_pfsense.METRICS_TEXTFILE_DIR)
+        return reselected
+
+    @staticmethod
+    def report(sample: Dict[str, Any], telemetry: RunTelemetry, labels: Dict[str, str]) -> None:
+        telemetry.gauge("tunnel_up", int(sample["up"]), "Whether the OpenVPN client is up.", **labels)
+        for key, name, help_text in (
+            ("rtt_ms", "gateway_rtt_ms", "Gateway monitor RTT."),
+            ("loss_percent", "gateway_loss_percent", "Gateway monitor packet loss."),
+            ("probe_ms", "probe_ms", "Time to first byte of MONITOR_PROBE_URL."),
+            ("throughput_kbps", "probe_throughput_kbps", "Throughput fetching MONITOR_PROBE_URL."),
+        ):
+            if sample.get(key) is not None:
+                telemetry.gauge(name, sample[key], help_text, **labels)
+
+    def maybe_reselect(self, due: List[Any]) -> bool:
+        now = time.monotonic()
+        if self.last_reselect is not None and now - self.last_reselect < MONITOR_MIN_RESELECT_INTERVAL_SECONDS:
+            log(f"Re-selection due but rate-limited: the last one ran {now - self.last_reselect:.0f}s ago "
+                f"(minimum {MONITOR_MIN_RESELECT_INTERVAL_SECONDS}s).")
+            return False
+        for target, reasons in due:
+            mark_unhealthy(target, reasons)
+        log(f"Re-selecting: {', '.join(target['NAME'] or 'tunnel' for target, _ in due)} "
+            f"unhealthy for {MONITOR_BREACH_WINDOW_SECONDS}s or more.")
+        self.last_reselect = now
+        self.reselects += 1
+        exit_code = self.reselect()
+        log(f"Re-selection {'succeeded' if exit_code == 0 else f'failed (exit code {exit_code})'}.")
+        # The new (or failed-over) tunnel gets a fresh window.
+        self.breach_since.clear()
+        return True
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Re-select a ProtonVPN server only when the tunnel is unhealthy.")
+    parser.add_argument("--once", action="store_true", help="take one sample of every target and exit")
+    args = parser.parse_args()
+
+    monitor = Monitor()
+    while True:
+        cycle_start = time.monotonic()
+        try:
+            # Reloaded every cycle, as a fresh cron run would.
+            config = load_config(update_pfsense.CONFIG_FILE)
+            apply_settings(config)
+            monitor.check(config)
+        except Exception as e:
+            log(f"ERROR: {type(e).__name__} - {e}")
+            if args.once:
+                return 1
+        if args.once:
+            return 0
+        time.sleep(max(0, MONITOR_INTERVAL_SECONDS - (time.monotonic() - cycle_start)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""Runs scrape-ng-v2.py then update_pfsense.py in one process.
+
+The same as `scrape-ng-v2.py && update_pfsense.py`, minus a second Python
+start-up, a second round of imports and a second parse of config.json:
+both stages get the one config loaded here. The handoff still goes through
+OUTPUT_FILE / SELECTION_FILE (see handoff.py), so find_vpn.sh and a
+separate update_pfsense.py --watch keep seeing every run. The updater only
+runs if the scrape succeeded, and the exit code is the failing stage's. If
+the scrape reused an overlapping run's result (see scrape_lock.py) and
+that run is a pipeline.py too, it updates pfSense with it, so this one
+doesn't as well. A result from --daemon or a bare scraper run is applied
+here - the updater leaves an override that already holds the IP alone.
+
+    venv/bin/python3 pipeline.py
+"""
+import importlib.util
+import os
+import sys
+
+import update_pfsense
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_scraper():
+    # The scraper's file name isn't a valid module name, so import it by path.
+    spec = importlib.util.spec_from_file_location("scrape_ng_v2", os.path.join(HERE, "scrape-ng-v2.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main() -> int:
+    scraper = load_scraper()
+    try:
+        config = update_pfsense.load_config(scraper.CONFIG_FILE)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: could not load {scraper.CONFIG_FILE}: {e}")
+        return 1
+
+    exit_code = scraper.main(config, updates_pfsense=True)
+    if exit_code == scraper.EXIT_SCRAPE_IN_FLIGHT:
+        print("Another scrape is still in flight; not updating pfSense.")
+        return exit_code
+    if exit_code != 0:
+        print("Scrape failed; not updating pfSense.")
+        return exit_code
+    if scraper.reused_in_flight_result and scraper.reused_result_owner_updates:
+        print("Reused the overlapping run's result; it updates pfSense itself.")
+        return 0
+    if scraper.reused_in_flight_result:
+        print("Reused the overlapping run's result; its run doesn't update pfSense, so updating here.")
+    return update_pfsense.main(config)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
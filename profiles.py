@@ -0,0 +1,106 @@
+"""Selection profiles: several tunnels' servers picked from one scrape.
+
+SELECTION_PROFILES in config.json lists one entry per OpenVPN client to
+pick a server for, e.g. a P2P tunnel in MA/NY/NJ, a non-P2P one anywhere
+in the US and one in Canada:
+
+    "SELECTION_PROFILES": [
+      {"NAME": "p2p", "STATES": ["MA", "NY", "NJ"], "DNS_HOST": "fastest", "OPENVPN_VPNID": 1},
+      {"NAME": "general", "STATES": [], "P2P_REQUIRED": false, "DNS_HOST": "general", "OPENVPN_VPNID": 2},
+      {"NAME": "canada", "COUNTRY_NAME": "Canada", "HTTP_COUNTRY_CODE": "CA", "STATES": [],
+       "DNS_HOST": "canada", "OPENVPN_VPNID": 3}
+    ]
+
+Any key a profile leaves out falls back to its top-level value, so the
+first entry above uses the top-level COUNTRY_NAME. An empty STATES list
+means any state. Each profile gets its own OUTPUT_FILE, SELECTION_FILE and
+APPLIED_STATE_FILE. Unless set explicitly, these are the top-level paths
+with the profile's NAME inserted before the extension, e.g.
+/tmp/tmpIPFile.p2p.txt. scrape-ng-v2.py evaluates every profile from a
+single login and page load, and update_pfsense.py updates each profile's
+DNS_HOST / OPENVPN_VPNID from that profile's files.
+
+Without SELECTION_PROFILES there's a single profile made of the top-level
+settings, with the top-level file paths unchanged.
+
+With FIREWALLS as well (see update_pfsense.py), every profile is applied
+on every firewall, and each firewall records what it applied in its own
+APPLIED_STATE_FILE: the profile's path with the firewall's NAME inserted
+as well, e.g. applied_server.p2p.fw-a.json, unless the FIREWALLS entry
+sets one. expand_targets() works those out for both scripts.
+"""
+import os
+import re
+from typing import Any, Dict, List
+
+# Handoff/state files each profile needs its own copy of, with their
+# top-level defaults.
+PER_PROFILE_FILES = {
+    "OUTPUT_FILE": "/tmp/tmpIPFile.txt",
+    "SELECTION_FILE": "/tmp/tmpSelection.json",
+    "APPLIED_STATE_FILE": "applied_server.json",
+}
+
+
+def profile_path(path: str, name: str) -> str:
+    """path with the profile name inserted before its extension."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{name}{ext}"
+
+
+def selection_profiles(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One fully-merged config dict per profile. Each carries the profile's
+    name under PROFILE, or "default" for the implicit single profile."""
+    base = {k: v for k, v in config.items() if k != "SELECTION_PROFILES"}
+    for key, default in PER_PROFILE_FILES.items():
+        base.setdefault(key, default)
+    base.setdefault("P2P_REQUIRED", True)
+    if not config.get("SELECTION_PROFILES"):
+        return [{**base, "PROFILE": "default"}]
+
+    profiles = []
+    for index, entry in enumerate(config["SELECTION_PROFILES"]):
+        name = entry.get("NAME") or f"profile{index + 1}"
+        profile = {**base, **{k: v for k, v in entry.items() if k != "NAME"}, "PROFILE": name}
+        for key in PER_PROFILE_FILES:
+            if key not in entry:
+                profile[key] = profile_path(base[key], name)
+        profiles.append(profile)
+
+    for key in ("PROFILE", "OUTPUT_FILE", "SELECTION_FILE"):
+        values = [profile[key] for profile in profiles]
+        duplicates = sorted({value for value in values if values.count(value) > 1})
+        if duplicates:
+            raise ValueError(f"SELECTION_PROFILES share a {key}: {', '.join(duplicates)}")
+    return profiles
+
+
+def expand_targets(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One fully-merged config per firewall and selection profile. Without
+    FIREWALLS that's just selection_profiles(config); with it, each entry
+    is laid over the top-level config, defaults its NAME to its
+    PFSENSE_BASE_URL, and gets its own APPLIED_STATE_FILE (see the module
+    docstring) - firewalls can come up on different failover endpoints, so
+    they mustn't share one. Each profile's target is named
+    "<firewall>/<profile>"."""
+    base = {k: v for k, v in config.items() if k != "FIREWALLS"}
+    entries = config.get("FIREWALLS") or []
+    firewalls = [{**base, **entry} for entry in entries] if entries else [base]
+
+    targets = []
+    for entry, firewall in zip(entries or [{}], firewalls):
+        firewall.setdefault("NAME", firewall.get("PFSENSE_BASE_URL", ""))
+        for profile in selection_profiles(firewall):
+            if config.get("SELECTION_PROFILES"):
+                profile["NAME"] = f"{firewall['NAME']}/{profile['PROFILE']}"
+            if entries and "APPLIED_STATE_FILE" not in entry:
+                slug = re.sub(r"[^A-Za-z0-9_-]+", "_", firewall["NAME"]).strip("_")
+                profile["APPLIED_STATE_FILE"] = profile_path(profile["APPLIED_STATE_FILE"], slug)
+            targets.append(profile)
+
+    values = [target["APPLIED_STATE_FILE"] for target in targets]
+    duplicates = sorted({value for value in values if values.count(value) > 1})
+    if duplicates:
+        raise ValueError(f"FIREWALLS share an APPLIED_STATE_FILE: {', '.join(duplicates)} "
+                         f"- give each firewall a distinct NAME or its own APPLIED_STATE_FILE")
+    return targets
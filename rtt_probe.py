@@ -0,0 +1,83 @@
+"""Concurrent round-trip-time probing of candidate VPN endpoints.
+
+Used by scrape-ng-v2.py's optional latency-aware selection: utilization on
+Proton's page says nothing about how far a server is from *this* site, so
+the top few candidates by load are timed from here before one is picked.
+
+Each probe times a TCP connect to (host, port). The connection doesn't have
+to be accepted to be useful: a refused connection (RST) also comes back
+after exactly one round trip, so it counts as a valid sample. Only a
+timeout or an unreachable network yields no RTT. All probes run at once
+under a single overall deadline, so probing K endpoints costs about one
+deadline at most, not K of them.
+
+Nothing here knows about Selenium or Proton, so it can be exercised against
+local stand-in listeners. The kernel completes a TCP handshake before the
+listener ever sees it, so to inject delay pass probe_all() a `probe`
+coroutine that wraps tcp_connect() with an asyncio.sleep().
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+Endpoint = Tuple[str, int]
+Probe = Callable[[str, int], Awaitable[bool]]
+
+
+async def tcp_connect(host: str, port: int) -> bool:
+    """Completes one TCP connect round trip to (host, port). Returns False if
+    the endpoint couldn't be reached at all."""
+    try:
+        _, writer = await asyncio.open_connection(host, port)
+    except ConnectionRefusedError:
+        return True
+    except OSError:
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
+
+
+async def _sample(probe: Probe, host: str, port: int, attempts: int, samples: List[float]) -> None:
+    # Sequential per endpoint, so samples don't queue behind each other.
+    # Results go straight into samples so that ones already taken survive
+    # this task being cancelled at the deadline.
+    for _ in range(attempts):
+        start = time.perf_counter()
+        if await probe(host, port):
+            samples.append((time.perf_counter() - start) * 1000)
+
+
+async def probe_all(endpoints: List[Endpoint], deadline_seconds: float, attempts: int = 1,
+                    probe: Probe = tcp_connect) -> Dict[Endpoint, Optional[float]]:
+    """Probes every endpoint concurrently and returns {endpoint: rtt_ms},
+    timing each call to probe (tcp_connect by default) and keeping the best
+    of up to `attempts` samples - the least noisy estimate of the path's RTT.
+    Probes still running when deadline_seconds runs out are cancelled; an
+    endpoint with no completed sample by then is reported as None."""
+    samples: Dict[Endpoint, List[float]] = {endpoint: [] for endpoint in endpoints}
+    tasks = [
+        asyncio.ensure_future(_sample(probe, host, port, attempts, samples[(host, port)]))
+        for host, port in samples
+    ]
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=deadline_seconds)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    return {endpoint: min(taken) if taken else None for endpoint, taken in samples.items()}
+
+
+def probe_rtts(endpoints: List[Endpoint], deadline_seconds: float,
+               attempts: int = 1) -> Dict[Endpoint, Optional[float]]:
+    """Synchronous wrapper around probe_all()."""
+    return asyncio.run(probe_all(endpoints, deadline_seconds, attempts))
+
+
+def weighted_score(utilization: int, rtt_ms: float, load_weight: float, rtt_weight: float) -> float:
+    """Lower is better: load_weight per utilization point plus rtt_weight per
+    millisecond of RTT."""
+    return load_weight * utilization + rtt_weight * rtt_ms
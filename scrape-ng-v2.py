@@ -1,21 +1,48 @@
-import pyotp
-import undetected_chromedriver as uc
+from __future__ import annotations
+
+import time
+
+# Taken before any other import, so time_to_first_navigation (see
+# scrape_once) includes what importing everything below costs.
+STARTED_AT = time.monotonic()
+
 from selenium.webdriver.common.by import By
-from selenium.webdriver.remote.webelement import WebElement
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
-import inspect
+from selenium.common.exceptions import (
+    NoSuchElementException,
+    StaleElementReferenceException,
+    TimeoutException,
+    WebDriverException,
+)
+import argparse
 import shutil
+import signal
+import sqlite3
 import subprocess
 import sys
 import tempfile
-import time
-from typing import List, Optional, Tuple
+import traceback
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set, Tuple
 import re
 import json
 import os
 
+from endpoint_cache import EndpointCache, Remote
+from handoff import write_atomic
+from history import HistoryStore
+from profiles import expand_targets, selection_profiles
+from scrape_lock import ScrapeLock
+from startup_cache import CHROME_BINARIES, StartupCache, find_chrome_binary
+from telemetry import RunTelemetry
+
+# undetected_chromedriver (and the parts of Selenium that pull in its whole
+# WebDriver client), pyotp, requests (http_scrape.py) and asyncio
+# (rtt_probe.py) are imported where they're first used instead: together
+# they're most of this script's start-up time, and a run served over HTTP,
+# or one that never probes RTTs, doesn't need them at all.
+if TYPE_CHECKING:
+    import undetected_chromedriver as uc
+    from selenium.webdriver.remote.webelement import WebElement
+
 # --- BOOTSTRAP CONSTANT ---
 # CONFIG_FILE can't itself live inside config.json (chicken-and-egg), so it's
 # the one true constant. Every value below is a fallback default only - the
@@ -31,15 +58,33 @@ MAILBOX_PASSWORD = ""
 TOTP_SECRET_KEY = ""
 
 OUTPUT_FILE_NAME = "/tmp/tmpIPFile.txt"
+# Structured record of each run's selection, next to the bare IP in
+# OUTPUT_FILE; update_pfsense.py's switch hysteresis reads it, and writes
+# APPLIED_STATE_FILE (which server it last switched to) for the scraper to
+# look up in the next run's table.
+SELECTION_FILE = "/tmp/tmpSelection.json"
+APPLIED_STATE_FILE = "applied_server.json"
 LOGIN_URL = "https://account.protonvpn.com/login"
 DOWNLOAD_URL = "https://account.protonvpn.com/downloads"
 
 STATES = ["MA", "NY", "NJ"]
+# The state part of a server name like US-NY#12 or CA-QC#3.
+STATE_PATTERN = re.compile(r'\b[a-z]{2}-([a-z]{2})#\d+', re.IGNORECASE)
 # Countries are rendered as collapsible <details><summary>Country Name</summary>...</details>
 # blocks. Matching on the visible country name is far more resilient to page changes than a
 # fixed positional index (the old `details[122]` approach broke every time Proton
 # added/removed/reordered a country).
 COUNTRY_NAME = "United States"
+# Several tunnels from one scrape (see profiles.py): each entry overrides
+# COUNTRY_NAME, STATES, P2P_REQUIRED (default true) and HTTP_COUNTRY_CODE
+# for one OpenVPN client and gets its own OUTPUT_FILE / SELECTION_FILE /
+# APPLIED_STATE_FILE. Every profile is evaluated from the same login and
+# page load, each needed country's section expanded once. Empty means one
+# profile made of the top-level settings. An empty STATES means any state.
+SELECTION_PROFILES: List[Dict[str, Any]] = []
+# Only read to find every firewall's APPLIED_STATE_FILE (see
+# profiles.expand_targets); update_pfsense.py does the updating.
+FIREWALLS: List[Dict[str, Any]] = []
 
 USER_ID = "username"
 PASS_ID = "password"
@@ -61,9 +106,157 @@ P2P_ICON_SELECTOR = "span.mx-2"
 # Scoped to a single row (each row has exactly one action button, in its last
 # cell) to avoid ever depending on an absolute nth-child position.
 DOWNLOAD_BUTTON_XPATH = ".//button"
+# Read the whole server table with one injected script (extract_server_records)
+# instead of several WebDriver round trips per row. Set false to fall back to
+# the per-row path, e.g. to compare the two with the command counts main logs.
+BULK_ROW_EXTRACTION = True
+
+# Opt-in persistent Chrome profile. When set, the browser's user-data-dir
+# (cookies included) lives here across runs, so a still-valid Proton session
+# skips the four-step login entirely - saving time and not burning a TOTP
+# window. Empty = a throwaway profile per run, as before. The directory holds
+# live session cookies, so it's created/kept owner-only (0700).
+PERSISTENT_PROFILE_DIR = ""
+
+# Chrome's major version and a ready-patched chromedriver, cached between
+# runs and rebuilt only when the Chrome binary changes (see
+# startup_cache.py), so a cold start skips the `--version` probes and
+# undetected_chromedriver's download-and-patch. The driver copy sits next to
+# this file. Empty disables the cache.
+STARTUP_CACHE_FILE = "startup_cache.json"
+
+# Server name -> .ovpn remote endpoints, so a repeat winner is resolved
+# without downloading its config again (see endpoint_cache.py). Entries older
+# than ENDPOINT_CACHE_TTL_SECONDS are re-downloaded. Empty disables the cache.
+ENDPOINT_CACHE_FILE = "endpoint_cache.json"
+ENDPOINT_CACHE_TTL_SECONDS = 86400
+
+# Every scrape's full table is stored in HISTORY_DB (see history.py; empty
+# disables it), downsampled to hourly averages after
+# HISTORY_DOWNSAMPLE_AFTER_HOURS and deleted after HISTORY_RETENTION_DAYS.
+# SELECTION_POLICY "ewma" ranks candidates by their trend over the last
+# HISTORY_WINDOW_HOURS (EWMA load + HISTORY_VARIANCE_WEIGHT * stddev) instead
+# of this one snapshot ("snapshot").
+HISTORY_DB = "history.sqlite3"
+HISTORY_RETENTION_DAYS = 30
+HISTORY_DOWNSAMPLE_AFTER_HOURS = 48
+SELECTION_POLICY = "snapshot"
+HISTORY_WINDOW_HOURS = 24
+HISTORY_EWMA_HALF_LIFE_HOURS = 6
+HISTORY_VARIANCE_WEIGHT = 0.5
+
+# Optional latency-aware selection: with RTT_PROBE_TOP_K > 1, the K
+# lowest-utilization candidates are TCP-probed from here (concurrently, on
+# RTT_PROBE_PORT, best of RTT_PROBE_ATTEMPTS, all within
+# RTT_PROBE_DEADLINE_SECONDS) and the lowest
+# SCORE_LOAD_WEIGHT * utilization + SCORE_RTT_WEIGHT * rtt_ms wins. 0 or 1
+# keeps plain lowest-utilization selection.
+RTT_PROBE_TOP_K = 0
+RTT_PROBE_PORT = 443
+RTT_PROBE_ATTEMPTS = 3
+RTT_PROBE_DEADLINE_SECONDS = 2
+SCORE_LOAD_WEIGHT = 1.0
+SCORE_RTT_WEIGHT = 0.5
+
+# How many ranked candidates per profile are handed to update_pfsense.py,
+# best first with every remote endpoint of each, so a tunnel that won't come
+# up on the winner fails over to the next one without another scrape. Their
+# .ovpn files are downloaded together with the winner's (and the
+# RTT_PROBE_TOP_K probe candidates'), unless the endpoint cache already has
+# them. 1 hands off the winner alone. FAILOVER_DOWNLOAD_UNCACHED false
+# downloads only the winners and probe candidates, handing off just the
+# runner-ups that are already cached: fewer downloads per run, but nothing
+# to fail over to while the cache is cold.
+FAILOVER_CANDIDATES = 3
+FAILOVER_DOWNLOAD_UNCACHED = True
+
+# --daemon mode: keep one browser alive and re-scrape every
+# DAEMON_INTERVAL_SECONDS. The browser is recycled (quit and relaunched) after
+# DAEMON_RECYCLE_AFTER_ITERATIONS scrapes, or as soon as Chrome's total RSS
+# exceeds DAEMON_MAX_RSS_MB, so a long-lived session can't grow unbounded.
+DAEMON_INTERVAL_SECONDS = 900
+DAEMON_RECYCLE_AFTER_ITERATIONS = 24
+DAEMON_MAX_RSS_MB = 1024
+
+# Single-flight (see scrape_lock.py): a scrape holds SCRAPE_LOCK_FILE, and
+# a run that finds another one in flight waits up to
+# SCRAPE_LOCK_WAIT_SECONDS for it. If every profile's SELECTION_FILE is
+# then at most SCRAPE_REUSE_MAX_AGE_SECONDS old, that result is reused
+# without starting a browser; otherwise it scrapes itself. 0 waits not at
+# all; a run that gives up waiting exits EXIT_SCRAPE_IN_FLIGHT. An empty
+# SCRAPE_LOCK_FILE disables the lock.
+SCRAPE_LOCK_FILE = "scrape.lock"
+SCRAPE_LOCK_WAIT_SECONDS = 300
+SCRAPE_REUSE_MAX_AGE_SECONDS = 600
+# EX_TEMPFAIL from sysexits.h: nothing failed, try again later.
+EXIT_SCRAPE_IN_FLIGHT = 75
+# Set by main() when its run reused another's result instead of scraping,
+# and reused_result_owner_updates when the run that produced it said (in
+# the lock file) that it goes on to update pfSense itself - pipeline.py then
+# leaves the update to it, rather than running it again if the producer was
+# --daemon or a bare scraper run. Run from the command line, a reusing run
+# exits EXIT_REUSED_RESULT instead of 0, so `scrape-ng-v2.py &&
+# update_pfsense.py` doesn't start a second update racing the other run's.
+reused_in_flight_result = False
+reused_result_owner_updates = False
+EXIT_REUSED_RESULT = 3
+
+# Opt-in browserless refresh (see http_scrape.py). After each successful
+# browser run the session's cookies are saved to SESSION_COOKIE_FILE; later
+# runs read the table over plain HTTP with them - from DOWNLOAD_URL's HTML
+# or, with HTTP_SOURCE "json", from HTTP_SERVERS_JSON_URL (servers exiting
+# in HTTP_COUNTRY_CODE) - and resolve the winner from the endpoint cache.
+# Chrome only starts if that fails: expired session, unparseable response,
+# or a winner whose endpoints aren't cached. HTTP_HEADERS are added to every
+# request.
+HTTP_REFRESH = False
+SESSION_COOKIE_FILE = "session_cookies.json"
+HTTP_SOURCE = "html"
+HTTP_SERVERS_JSON_URL = "https://account.protonvpn.com/api/vpn/logicals"
+HTTP_COUNTRY_CODE = "US"
+HTTP_HEADERS: Dict[str, str] = {}
+HTTP_TIMEOUT_SECONDS = 20
+
+# Opt-in lean browser for small hosts: images off, requests matching any of
+# LEAN_BLOCKED_URL_PATTERNS (CDP Network.setBlockedURLs wildcards - fonts,
+# media, analytics beacons) never leave Chrome, the window is
+# LEAN_WINDOW_SIZE, and background networking, component updates, sync,
+# extensions and the GPU process are turned off. Page-load time and peak
+# Chrome RSS are reported either way, so the two modes can be compared.
+LEAN_MODE = False
+LEAN_BLOCKED_URL_PATTERNS = [
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.ico",
+    "*.mp4", "*.webm", "*.mp3",
+    "*sentry*", "*/reports/*", "*/metrics*",
+]
+LEAN_WINDOW_SIZE = [800, 600]
+# The Chrome switches LEAN_MODE adds: no images, and none of the background
+# services a one-shot scrape never uses.
+LEAN_CHROME_ARGUMENTS = [
+    "--blink-settings=imagesEnabled=false",
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-sync",
+    "--disable-default-apps",
+    "--disable-client-side-phishing-detection",
+    "--disable-domain-reliability",
+    "--disable-breakpad",
+    "--disable-features=Translate,OptimizationHints,MediaRouter,AutofillServerCommunication",
+    "--metrics-recording-only",
+    "--mute-audio",
+]
+
+# Per-phase timings and WebDriver command counts/latencies for every run (see
+# telemetry.py): appended as JSON lines to METRICS_TRACE_FILE, and written
+# as protonvpn_scraper.prom into METRICS_TEXTFILE_DIR for node_exporter's
+# textfile collector. Empty disables either.
+METRICS_TRACE_FILE = ""
+METRICS_TEXTFILE_DIR = ""
 
 ELEMENT_WAIT_TIMEOUT = 20
-LOGIN_ERROR_CHECK_TIMEOUT = 3
 DASHBOARD_WAIT_TIMEOUT = 20
 # Headless Chrome writes the file to disk rather than showing it in the DOM,
 # so this bounds how long to wait for the download to finish rather than for
@@ -76,32 +269,57 @@ def load_config(file_path: str):
     file, fresh on each run. Nothing dynamic is hardcoded above - the module
     level values are only fallback defaults for configs written before a given
     key existed."""
-    global USERNAME, PASSWORD, MAILBOX_PASSWORD, TOTP_SECRET_KEY, OUTPUT_FILE_NAME
-    global LOGIN_URL, DOWNLOAD_URL
-    global STATES, COUNTRY_NAME, USER_ID, PASS_ID, TOTP_ID, MAILBOX_PASSWORD_ID
-    global CONTINUE_BUTTON_SELECTOR, ERROR_BANNER_SELECTOR, BENIGN_BANNER_PHRASES
-    global P2P_ICON_SELECTOR, DOWNLOAD_BUTTON_XPATH
-    global ELEMENT_WAIT_TIMEOUT, LOGIN_ERROR_CHECK_TIMEOUT, DASHBOARD_WAIT_TIMEOUT, DOWNLOAD_WAIT_TIMEOUT
-
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"Configuration file not found: {file_path}. Please create it.")
 
     try:
         with open(file_path, 'r') as f:
             config = json.load(f)
+    except json.JSONDecodeError:
+        raise ValueError(f"Error decoding JSON from {file_path}. Check for syntax errors.")
+    apply_config(config)
 
+def apply_config(config: Dict[str, Any]):
+    """Sets every module-level setting from an already-parsed config.json,
+    e.g. the one pipeline.py loaded once for both stages."""
+    global USERNAME, PASSWORD, MAILBOX_PASSWORD, TOTP_SECRET_KEY, OUTPUT_FILE_NAME
+    global SELECTION_FILE, APPLIED_STATE_FILE
+    global LOGIN_URL, DOWNLOAD_URL, PERSISTENT_PROFILE_DIR, STARTUP_CACHE_FILE
+    global STATES, COUNTRY_NAME, SELECTION_PROFILES, FIREWALLS, USER_ID, PASS_ID, TOTP_ID, MAILBOX_PASSWORD_ID
+    global CONTINUE_BUTTON_SELECTOR, ERROR_BANNER_SELECTOR, BENIGN_BANNER_PHRASES
+    global P2P_ICON_SELECTOR, DOWNLOAD_BUTTON_XPATH, BULK_ROW_EXTRACTION
+    global ENDPOINT_CACHE_FILE, ENDPOINT_CACHE_TTL_SECONDS
+    global HISTORY_DB, HISTORY_RETENTION_DAYS, HISTORY_DOWNSAMPLE_AFTER_HOURS, SELECTION_POLICY
+    global HISTORY_WINDOW_HOURS, HISTORY_EWMA_HALF_LIFE_HOURS, HISTORY_VARIANCE_WEIGHT
+    global RTT_PROBE_TOP_K, RTT_PROBE_PORT, RTT_PROBE_ATTEMPTS, RTT_PROBE_DEADLINE_SECONDS
+    global SCORE_LOAD_WEIGHT, SCORE_RTT_WEIGHT, FAILOVER_CANDIDATES, FAILOVER_DOWNLOAD_UNCACHED
+    global DAEMON_INTERVAL_SECONDS, DAEMON_RECYCLE_AFTER_ITERATIONS, DAEMON_MAX_RSS_MB
+    global SCRAPE_LOCK_FILE, SCRAPE_LOCK_WAIT_SECONDS, SCRAPE_REUSE_MAX_AGE_SECONDS
+    global HTTP_REFRESH, SESSION_COOKIE_FILE, HTTP_SOURCE, HTTP_SERVERS_JSON_URL, HTTP_COUNTRY_CODE
+    global HTTP_HEADERS, HTTP_TIMEOUT_SECONDS
+    global LEAN_MODE, LEAN_BLOCKED_URL_PATTERNS, LEAN_WINDOW_SIZE
+    global METRICS_TRACE_FILE, METRICS_TEXTFILE_DIR
+    global ELEMENT_WAIT_TIMEOUT, DASHBOARD_WAIT_TIMEOUT, DOWNLOAD_WAIT_TIMEOUT
+
+    try:
         USERNAME = config.get("USERNAME", "")
         PASSWORD = config.get("PASSWORD", "")
         MAILBOX_PASSWORD = config.get("MAILBOX_PASSWORD", "")
         TOTP_SECRET_KEY = config.get("TOTP_SECRET_KEY", "")
         # OUTPUT_FILE is the single source of truth for the handoff path to update_pfsense.py.
         OUTPUT_FILE_NAME = config.get("OUTPUT_FILE", OUTPUT_FILE_NAME)
+        SELECTION_FILE = config.get("SELECTION_FILE", SELECTION_FILE)
+        APPLIED_STATE_FILE = config.get("APPLIED_STATE_FILE", APPLIED_STATE_FILE)
 
         LOGIN_URL = config.get("LOGIN_URL", LOGIN_URL)
         DOWNLOAD_URL = config.get("DOWNLOAD_URL", DOWNLOAD_URL)
+        PERSISTENT_PROFILE_DIR = config.get("PERSISTENT_PROFILE_DIR", PERSISTENT_PROFILE_DIR)
+        STARTUP_CACHE_FILE = config.get("STARTUP_CACHE_FILE", STARTUP_CACHE_FILE)
 
         STATES = config.get("STATES", STATES)
         COUNTRY_NAME = config.get("COUNTRY_NAME", COUNTRY_NAME)
+        SELECTION_PROFILES = config.get("SELECTION_PROFILES", SELECTION_PROFILES)
+        FIREWALLS = config.get("FIREWALLS", FIREWALLS)
 
         USER_ID = config.get("USER_ID", USER_ID)
         PASS_ID = config.get("PASS_ID", PASS_ID)
@@ -113,29 +331,72 @@ def load_config(file_path: str):
 
         P2P_ICON_SELECTOR = config.get("P2P_ICON_SELECTOR", P2P_ICON_SELECTOR)
         DOWNLOAD_BUTTON_XPATH = config.get("DOWNLOAD_BUTTON_XPATH", DOWNLOAD_BUTTON_XPATH)
+        BULK_ROW_EXTRACTION = config.get("BULK_ROW_EXTRACTION", BULK_ROW_EXTRACTION)
+
+        ENDPOINT_CACHE_FILE = config.get("ENDPOINT_CACHE_FILE", ENDPOINT_CACHE_FILE)
+        ENDPOINT_CACHE_TTL_SECONDS = config.get("ENDPOINT_CACHE_TTL_SECONDS", ENDPOINT_CACHE_TTL_SECONDS)
+
+        HISTORY_DB = config.get("HISTORY_DB", HISTORY_DB)
+        HISTORY_RETENTION_DAYS = config.get("HISTORY_RETENTION_DAYS", HISTORY_RETENTION_DAYS)
+        HISTORY_DOWNSAMPLE_AFTER_HOURS = config.get("HISTORY_DOWNSAMPLE_AFTER_HOURS", HISTORY_DOWNSAMPLE_AFTER_HOURS)
+        SELECTION_POLICY = config.get("SELECTION_POLICY", SELECTION_POLICY)
+        HISTORY_WINDOW_HOURS = config.get("HISTORY_WINDOW_HOURS", HISTORY_WINDOW_HOURS)
+        HISTORY_EWMA_HALF_LIFE_HOURS = config.get("HISTORY_EWMA_HALF_LIFE_HOURS", HISTORY_EWMA_HALF_LIFE_HOURS)
+        HISTORY_VARIANCE_WEIGHT = config.get("HISTORY_VARIANCE_WEIGHT", HISTORY_VARIANCE_WEIGHT)
+
+        RTT_PROBE_TOP_K = config.get("RTT_PROBE_TOP_K", RTT_PROBE_TOP_K)
+        RTT_PROBE_PORT = config.get("RTT_PROBE_PORT", RTT_PROBE_PORT)
+        RTT_PROBE_ATTEMPTS = config.get("RTT_PROBE_ATTEMPTS", RTT_PROBE_ATTEMPTS)
+        RTT_PROBE_DEADLINE_SECONDS = config.get("RTT_PROBE_DEADLINE_SECONDS", RTT_PROBE_DEADLINE_SECONDS)
+        SCORE_LOAD_WEIGHT = config.get("SCORE_LOAD_WEIGHT", SCORE_LOAD_WEIGHT)
+        SCORE_RTT_WEIGHT = config.get("SCORE_RTT_WEIGHT", SCORE_RTT_WEIGHT)
+        FAILOVER_CANDIDATES = config.get("FAILOVER_CANDIDATES", FAILOVER_CANDIDATES)
+        FAILOVER_DOWNLOAD_UNCACHED = config.get("FAILOVER_DOWNLOAD_UNCACHED", FAILOVER_DOWNLOAD_UNCACHED)
+
+        DAEMON_INTERVAL_SECONDS = config.get("DAEMON_INTERVAL_SECONDS", DAEMON_INTERVAL_SECONDS)
+        DAEMON_RECYCLE_AFTER_ITERATIONS = config.get("DAEMON_RECYCLE_AFTER_ITERATIONS", DAEMON_RECYCLE_AFTER_ITERATIONS)
+        DAEMON_MAX_RSS_MB = config.get("DAEMON_MAX_RSS_MB", DAEMON_MAX_RSS_MB)
+
+        SCRAPE_LOCK_FILE = config.get("SCRAPE_LOCK_FILE", SCRAPE_LOCK_FILE)
+        SCRAPE_LOCK_WAIT_SECONDS = config.get("SCRAPE_LOCK_WAIT_SECONDS", SCRAPE_LOCK_WAIT_SECONDS)
+        SCRAPE_REUSE_MAX_AGE_SECONDS = config.get("SCRAPE_REUSE_MAX_AGE_SECONDS", SCRAPE_REUSE_MAX_AGE_SECONDS)
+
+        HTTP_REFRESH = config.get("HTTP_REFRESH", HTTP_REFRESH)
+        SESSION_COOKIE_FILE = config.get("SESSION_COOKIE_FILE", SESSION_COOKIE_FILE)
+        HTTP_SOURCE = config.get("HTTP_SOURCE", HTTP_SOURCE)
+        HTTP_SERVERS_JSON_URL = config.get("HTTP_SERVERS_JSON_URL", HTTP_SERVERS_JSON_URL)
+        HTTP_COUNTRY_CODE = config.get("HTTP_COUNTRY_CODE", HTTP_COUNTRY_CODE)
+        HTTP_HEADERS = config.get("HTTP_HEADERS", HTTP_HEADERS)
+        HTTP_TIMEOUT_SECONDS = config.get("HTTP_TIMEOUT_SECONDS", HTTP_TIMEOUT_SECONDS)
+
+        LEAN_MODE = config.get("LEAN_MODE", LEAN_MODE)
+        LEAN_BLOCKED_URL_PATTERNS = config.get("LEAN_BLOCKED_URL_PATTERNS", LEAN_BLOCKED_URL_PATTERNS)
+        LEAN_WINDOW_SIZE = config.get("LEAN_WINDOW_SIZE", LEAN_WINDOW_SIZE)
+
+        METRICS_TRACE_FILE = config.get("METRICS_TRACE_FILE", METRICS_TRACE_FILE)
+        METRICS_TEXTFILE_DIR = config.get("METRICS_TEXTFILE_DIR", METRICS_TEXTFILE_DIR)
 
         ELEMENT_WAIT_TIMEOUT = config.get("ELEMENT_WAIT_TIMEOUT", ELEMENT_WAIT_TIMEOUT)
-        LOGIN_ERROR_CHECK_TIMEOUT = config.get("LOGIN_ERROR_CHECK_TIMEOUT", LOGIN_ERROR_CHECK_TIMEOUT)
         DASHBOARD_WAIT_TIMEOUT = config.get("DASHBOARD_WAIT_TIMEOUT", DASHBOARD_WAIT_TIMEOUT)
         DOWNLOAD_WAIT_TIMEOUT = config.get("DOWNLOAD_WAIT_TIMEOUT", DOWNLOAD_WAIT_TIMEOUT)
 
         if not all([USERNAME, PASSWORD, TOTP_SECRET_KEY]):
              raise ValueError("One or more required credentials (USERNAME, PASSWORD, TOTP_SECRET_KEY) are missing or empty in config.json.")
 
-    except json.JSONDecodeError:
-        raise ValueError(f"Error decoding JSON from {file_path}. Check for syntax errors.")
     except KeyError as e:
         raise ValueError(f"Missing required key in config.json: {e}. Check that all keys are present and correctly spelled.")
 
 # --- HELPER FUNCTIONS ---
 
-def detect_chrome_major_version() -> Optional[int]:
+def detect_chrome_major_version(chrome_binary: Optional[str] = None) -> Optional[int]:
     """Detects the installed Chrome/Chromium major version so we can request a
     matching chromedriver explicitly. undetected_chromedriver caches its patched
     driver and doesn't reliably re-check it against the browser actually
     installed, so a driver cached against one Chrome version can go stale after
-    an unrelated apt upgrade and fail with SessionNotCreatedException."""
-    for binary in ("google-chrome-stable", "google-chrome", "chromium-browser", "chromium"):
+    an unrelated apt upgrade and fail with SessionNotCreatedException. Only
+    chrome_binary is asked if given (see find_chrome_binary), otherwise each
+    known browser name in turn."""
+    for binary in [chrome_binary] if chrome_binary else CHROME_BINARIES:
         try:
             result = subprocess.run(
                 [binary, "--version"], capture_output=True, text=True, timeout=10
@@ -151,12 +412,15 @@ def get_totp_code() -> str:
     """Generates the current TOTP code using the loaded secret key."""
     if not TOTP_SECRET_KEY:
         raise ValueError("TOTP_SECRET_KEY is empty. Cannot generate TOTP.")
-        
+
+    import pyotp
     totp = pyotp.TOTP(TOTP_SECRET_KEY)
     return totp.now()
 
 def wait_and_find(driver: uc.Chrome, by: By, value: str, timeout: Optional[int] = None):
     """Waits for an element to be visible before finding and returning it."""
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
     if timeout is None:
         timeout = ELEMENT_WAIT_TIMEOUT
     return WebDriverWait(driver, timeout).until(
@@ -165,6 +429,8 @@ def wait_and_find(driver: uc.Chrome, by: By, value: str, timeout: Optional[int]
 
 def safe_click(driver: uc.Chrome, by: By, value: str, timeout: Optional[int] = None):
     """Waits for an element to be clickable and then clicks it."""
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
     if timeout is None:
         timeout = ELEMENT_WAIT_TIMEOUT
     element = WebDriverWait(driver, timeout).until(
@@ -172,53 +438,139 @@ def safe_click(driver: uc.Chrome, by: By, value: str, timeout: Optional[int] = N
     )
     element.click()
 
-def check_for_login_error(driver: uc.Chrome, timeout: Optional[int] = None):
-    """Briefly checks for a visible error banner (e.g. wrong password, bad TOTP)
-    so failures are reported clearly instead of surfacing as an opaque timeout
-    on the next step."""
+def wait_for_step_or_error(driver: uc.Chrome, next_step, description: str, timeout: Optional[int] = None):
+    """Races the next login step against the error banner and returns as soon
+    as either one shows up: next_step's result (an expected_conditions
+    callable, e.g. the next field becoming visible) on success, or a
+    RuntimeError carrying the banner text (e.g. wrong password, bad TOTP) on
+    failure. This reports failures as clearly as a dedicated banner check
+    would, without making every successful step sit out a fixed timeout
+    first."""
+    from selenium.webdriver.support.ui import WebDriverWait
     if timeout is None:
-        timeout = LOGIN_ERROR_CHECK_TIMEOUT
+        timeout = ELEMENT_WAIT_TIMEOUT
+    ignored_banners = set()
+
+    def next_step_or_error(d):
+        for banner in d.find_elements(By.CSS_SELECTOR, ERROR_BANNER_SELECTOR):
+            if not banner.is_displayed():
+                continue
+            banner_text = banner.text.strip()
+            if not banner_text:
+                continue
+            if any(phrase.lower() in banner_text.lower() for phrase in BENIGN_BANNER_PHRASES):
+                if banner_text not in ignored_banners:
+                    print(f"Ignoring benign banner: {banner_text!r}")
+                    ignored_banners.add(banner_text)
+                continue
+            raise RuntimeError(f"Login step failed: {banner_text}")
+        return next_step(d)
+
     try:
-        error_element = WebDriverWait(driver, timeout).until(
-            EC.visibility_of_element_located((By.CSS_SELECTOR, ERROR_BANNER_SELECTOR))
-        )
-        banner_text = error_element.text.strip()
-        if any(phrase.lower() in banner_text.lower() for phrase in BENIGN_BANNER_PHRASES):
-            print(f"Ignoring benign banner: {banner_text!r}")
-            return
-        raise RuntimeError(f"Login step failed: {banner_text}")
+        # Banners can be re-rendered between find_elements() and reading
+        # their text; just try again on the next poll.
+        return WebDriverWait(
+            driver, timeout, ignored_exceptions=(StaleElementReferenceException,)
+        ).until(next_step_or_error)
     except TimeoutException:
-        pass  # No error banner appeared - proceed as normal.
-
-def extract_server_rows(driver: uc.Chrome) -> List[WebElement]:
-    """Navigates to the download page, expands the country section, and
-    returns the raw <tr> WebElements (not just their text) so callers can
-    also inspect P2P support and trigger a specific row's own download
-    button."""
-    print("Navigating to the download page...")
-    driver.get(DOWNLOAD_URL)
+        raise TimeoutException(f"Timed out after {timeout}s waiting for {description}.") from None
 
-    # Built here (not at module load) since COUNTRY_NAME is only known once
-    # load_config() has run.
-    country_details_xpath = (
+def country_details_xpath(country: Optional[str] = None) -> str:
+    """XPath of country's <details> block (default: the configured
+    COUNTRY_NAME). Built on demand (not at module load) since COUNTRY_NAME is
+    only known once load_config() has run."""
+    return (
         f'//*[@id="openvpn-configuration-files"]'
-        f'//details[.//summary[contains(normalize-space(.), "{COUNTRY_NAME}")]]'
+        f'//details[.//summary[contains(normalize-space(.), "{country or COUNTRY_NAME}")]]'
     )
-    server_table_xpath = f'{country_details_xpath}/div/div/table'
+
+def server_table_xpath(country: Optional[str] = None) -> str:
+    return f'{country_details_xpath(country)}/div/div/table'
+
+def open_server_table(driver: uc.Chrome, navigate: bool = True, country: Optional[str] = None) -> WebElement:
+    """Navigates to the download page, expands the country section, and
+    returns its server <table> element. navigate=False skips the page load
+    when the driver is already on DOWNLOAD_URL (see session_is_valid), or
+    when another country's section was just read from the same page."""
+    if navigate:
+        print("Navigating to the download page...")
+        driver.get(DOWNLOAD_URL)
 
     try:
         # Wait for and expand the country section (e.g., US)
-        country_element = wait_and_find(driver, By.XPATH, country_details_xpath)
+        country_element = wait_and_find(driver, By.XPATH, country_details_xpath(country))
         driver.execute_script("arguments[0].setAttribute('open', '')", country_element)
 
         # Wait for the table to become visible after expanding the section
-        table = wait_and_find(driver, By.XPATH, server_table_xpath)
+        return wait_and_find(driver, By.XPATH, server_table_xpath(country))
     except TimeoutException:
-        raise Exception("Timed out waiting for server list table to load.")
+        raise Exception(f"Timed out waiting for the {country or COUNTRY_NAME} server list table to load.")
 
+def extract_server_rows(driver: uc.Chrome, navigate: bool = True, country: Optional[str] = None) -> List[WebElement]:
+    """Navigates to the download page, expands the country section, and
+    returns the raw <tr> WebElements (not just their text) so callers can
+    also inspect P2P support and trigger a specific row's own download
+    button. Every later read from these rows is its own WebDriver round trip
+    - see extract_server_records() for the bulk alternative."""
+    table = open_server_table(driver, navigate, country)
     rows = table.find_elements(By.TAG_NAME, "tr")
     return rows[1:]  # skip header row
 
+# Reads every row of the server table in a single execute_script call. Each
+# entry is [server_name, utilization_text, supports_p2p, row_index], where
+# row_index indexes the table's own <tr> list (header included) so the winner
+# can be turned back into a WebElement with row_element(). Cells are read via
+# innerText to match what WebElement.text returns for the per-row path.
+_EXTRACT_ROWS_SCRIPT = """
+const table = arguments[0], p2pSelector = arguments[1];
+const out = [];
+table.querySelectorAll('tr').forEach((row, index) => {
+    const cells = row.querySelectorAll('td');
+    if (cells.length < 3) return;
+    out.push([
+        cells[0].innerText.trim(),
+        cells[2].innerText.trim(),
+        row.querySelector(p2pSelector) !== null,
+        index,
+    ]);
+});
+return out;
+"""
+
+def extract_server_records(driver: uc.Chrome, navigate: bool = True,
+                           country: Optional[str] = None) -> List[Tuple[str, int, bool, int]]:
+    """Bulk equivalent of extract_server_rows() + parse_rows(): returns
+    (server_name, utilization, supports_p2p, row_index) for every row in one
+    WebDriver round trip instead of several per row. The US table has
+    hundreds of rows, so this turns thousands of chromedriver calls into a
+    handful."""
+    table = open_server_table(driver, navigate, country)
+    records = []
+    for server_name, utilization_str, supports_p2p, index in driver.execute_script(
+        _EXTRACT_ROWS_SCRIPT, table, P2P_ICON_SELECTOR
+    ):
+        parsed = parse_server_fields(server_name, utilization_str, supports_p2p)
+        if parsed is not None:
+            records.append((*parsed, index))
+    return records
+
+def row_element(driver: uc.Chrome, row_index: int, country: Optional[str] = None) -> WebElement:
+    """Resolves a row_index from extract_server_records() back into its <tr>
+    WebElement, so only the winning row ever becomes one."""
+    table = wait_and_find(driver, By.XPATH, server_table_xpath(country))
+    return driver.execute_script(
+        "return arguments[0].querySelectorAll('tr')[arguments[1]];", table, row_index
+    )
+
+def parse_server_fields(server_name: str, utilization_str: str, supports_p2p: bool) -> Optional[Tuple[str, int, bool]]:
+    """Normalizes raw cell text into (server_name, utilization_percent,
+    supports_p2p), or None if the utilization cell holds no number. Shared by
+    the per-row and bulk extraction paths so both parse identically."""
+    percent_str = re.sub(r'[^0-9]', '', utilization_str)
+    if not percent_str:
+        return None
+    return server_name.strip(), int(percent_str), supports_p2p
+
 def parse_row(row: WebElement) -> Optional[Tuple[str, int, bool]]:
     """Extracts (server_name, utilization_percent, supports_p2p) from a row,
     or None if the row is malformed / missing a utilization cell. P2P support
@@ -234,59 +586,96 @@ def parse_row(row: WebElement) -> Optional[Tuple[str, int, bool]]:
     except IndexError:
         return None
 
-    percent_str = re.sub(r'[^0-9]', '', utilization_str)
-    if not percent_str:
-        return None
-    utilization = int(percent_str)
-
     supports_p2p = len(row.find_elements(By.CSS_SELECTOR, P2P_ICON_SELECTOR)) > 0
-    return server_name, utilization, supports_p2p
+    return parse_server_fields(server_name, utilization_str, supports_p2p)
 
-def find_lowest_utilization_p2p_server(rows: List[WebElement]) -> Tuple[str, int, WebElement]:
-    """Filters rows to the configured states with live P2P support, and
-    returns (server_name, utilization, row) for the lowest-utilization match.
-    The row itself is returned (not just its data) so the caller can click
-    that specific server's own download button next."""
-    state_pattern = re.compile(r'us-([a-z]{2})#\d+', re.IGNORECASE)
-
-    candidates = []
+def parse_rows(rows: List[WebElement]) -> List[Tuple[str, int, bool, WebElement]]:
+    """Per-row counterpart of extract_server_records(): parses each row and
+    keeps the row itself as the record's handle."""
+    records = []
     for row in rows:
         parsed = parse_row(row)
-        if parsed is None:
-            continue
-        server_name, utilization, supports_p2p = parsed
-
-        match = state_pattern.search(server_name)
-        if not match:
-            continue
-        state_code = match.group(1).upper()
-        if state_code not in STATES:
+        if parsed is not None:
+            records.append((*parsed, row))
+    return records
+
+def server_state(server_name: str) -> Optional[str]:
+    """The two-letter state code in a server name like US-NY#12, or None."""
+    match = STATE_PATTERN.search(server_name)
+    return match.group(1).upper() if match else None
+
+def rank_candidates(records: List[Tuple[str, int, bool, Any]],
+                    scores: Optional[Dict[str, float]] = None,
+                    states: Optional[List[str]] = None,
+                    p2p_required: bool = True) -> List[Tuple[int, str, Any]]:
+    """Filters parsed (server_name, utilization, supports_p2p, handle) records
+    to the given states (default STATES; empty means any) with live P2P
+    support unless p2p_required is off, and returns them as (utilization,
+    server_name, handle), best first: by scores[server_name] where given (the
+    "ewma" SELECTION_POLICY's trend scores), otherwise by this snapshot's
+    utilization."""
+    states = STATES if states is None else states
+    candidates = []
+    for server_name, utilization, supports_p2p, handle in records:
+        if states and server_state(server_name) not in states:
             continue
 
-        if not supports_p2p:
+        if p2p_required and not supports_p2p:
             print(f"Skipping server {server_name} ({utilization}%): no P2P support.")
             continue
 
-        candidates.append((utilization, server_name, row))
+        candidates.append((utilization, server_name, handle))
 
     if not candidates:
-        raise ValueError("Could not find a P2P-capable server matching the state criteria.")
-
-    candidates.sort(key=lambda c: c[0])
-    utilization, server_name, row = candidates[0]
-    print(f"Selected {server_name} ({utilization}%) - lowest utilization P2P match.")
-    return server_name, utilization, row
-
-def download_openvpn_config(driver: uc.Chrome, row: WebElement, download_dir: str) -> str:
-    """Clicks the row's own download button and returns the local path to
-    the downloaded .ovpn file. Headless Chrome blocks downloads unless
-    explicitly allowed via CDP (see set_download_directory), which main()
-    sets up once before this is ever called."""
-    existing = set(os.listdir(download_dir))
-
-    download_button = row.find_element(By.XPATH, DOWNLOAD_BUTTON_XPATH)
-    download_button.click()
-
+        kind = "P2P-capable server" if p2p_required else "server"
+        raise ValueError(f"Could not find a {kind} matching the state criteria.")
+
+    scores = scores or {}
+    candidates.sort(key=lambda c: scores.get(c[1], c[0]))
+    return candidates
+
+def find_lowest_utilization_p2p_server(records: List[Tuple[str, int, bool, Any]],
+                                       scores: Optional[Dict[str, float]] = None,
+                                       states: Optional[List[str]] = None,
+                                       p2p_required: bool = True) -> Tuple[str, int, Any]:
+    """Returns (server_name, utilization, handle) for the best match from
+    rank_candidates() - the lowest-utilization one, or with scores the
+    lowest trend score. The handle is the row itself (parse_rows) or its row
+    index (extract_server_records), so the caller can click that specific
+    server's own download button next."""
+    utilization, server_name, handle = rank_candidates(records, scores, states, p2p_required)[0]
+    announce_choice(server_name, utilization, scores, p2p_required)
+    return server_name, utilization, handle
+
+def announce_choice(server_name: str, utilization: int, scores: Optional[Dict[str, float]],
+                    p2p_required: bool = True) -> None:
+    kind = "P2P match" if p2p_required else "match"
+    if scores and server_name in scores:
+        print(f"Selected {server_name} ({utilization}%, trend score {scores[server_name]:.1f}) "
+              f"- best trend-weighted {kind}.")
+    else:
+        print(f"Selected {server_name} ({utilization}%) - lowest utilization {kind}.")
+
+def read_download_events(driver: uc.Chrome) -> List[Tuple[str, Dict[str, Any]]]:
+    """Drains Chrome's performance log and returns the (method, params) of
+    every download-related CDP event in it: Page.downloadWillBegin and
+    Page.downloadProgress. chromedriver's performance logger only forwards
+    the Network, Page and Tracing domains, so the Browser.download* events
+    set_download_directory() enables never show up here; the (deprecated)
+    Page ones are all there is. The log is only populated because
+    start_driver() enables it via goog:loggingPrefs."""
+    events = []
+    for entry in driver.get_log("performance"):
+        message = json.loads(entry["message"])["message"]
+        method = message.get("method", "")
+        if method in ("Page.downloadWillBegin", "Page.downloadProgress"):
+            events.append((method, message.get("params", {})))
+    return events
+
+def _await_download_by_polling(download_dir: str, existing: set) -> str:
+    """Fallback for download_openvpn_configs() without download events in
+    the performance log: waits for a new, non-.crdownload file to appear in
+    download_dir."""
     deadline = time.time() + DOWNLOAD_WAIT_TIMEOUT
     while time.time() < deadline:
         new_files = set(os.listdir(download_dir)) - existing
@@ -295,137 +684,1129 @@ def download_openvpn_config(driver: uc.Chrome, row: WebElement, download_dir: st
         if finished:
             return os.path.join(download_dir, finished[0])
         time.sleep(0.5)
-
     raise TimeoutException(f"Timed out waiting for the OpenVPN config download in {download_dir}.")
 
-def extract_endpoint_ip(config_path: str) -> str:
-    """Parses the downloaded .ovpn file for its first "remote <ip> <port>"
-    line. Proton lists the same entry IP multiple times with different
-    ports, so the first match is sufficient."""
+def download_openvpn_configs(driver: uc.Chrome, rows: List[WebElement], download_dir: str) -> List[str]:
+    """Clicks each row's own download button and returns the local paths of
+    the downloaded .ovpn files, in the same order. Headless Chrome blocks
+    downloads unless explicitly allowed via CDP (see set_download_directory),
+    which main() sets up once before this is ever called.
+
+    The clicks go out back to back, each only waiting for its download to
+    begin, and then all the downloads are waited on together, so fetching
+    the top few candidates costs about as long as fetching one. Completion
+    is driven by Chrome's own download events, as the performance log
+    carries them (see read_download_events): Page.downloadWillBegin names
+    each download's guid, and the matching Page.downloadProgress with
+    state=completed means it's fully on disk as download_dir/<guid> (the
+    allowAndName behavior set_download_directory asks for). That returns
+    the moment the files are complete and can't be confused by stray files
+    in download_dir. If the performance log isn't available, or no
+    downloadWillBegin arrives within DOWNLOAD_WAIT_TIMEOUT (a Chrome that
+    no longer sends the Page events), this falls back to downloading one
+    row at a time, polling the directory for each new, non-.crdownload
+    file."""
+    try:
+        read_download_events(driver)  # discard anything from earlier downloads
+    except WebDriverException:
+        print("Warning: Chrome performance log unavailable; polling the download directory instead.")
+        paths = []
+        for row in rows:
+            existing = set(os.listdir(download_dir))
+            row.find_element(By.XPATH, DOWNLOAD_BUTTON_XPATH).click()
+            paths.append(_await_download_by_polling(download_dir, existing))
+        return paths
+
+    guids: List[str] = []
+    states: Dict[str, str] = {}
+    # Per row, the guid its download began under, or (after falling back to
+    # polling) the path it was found at.
+    downloads: List[Tuple[Optional[str], Optional[str]]] = []
+
+    def drain_events() -> Optional[str]:
+        # Records every progress update and returns the guid of a download
+        # that has just begun, if any. A download can be reported more than
+        # once, hence the check against guids already seen.
+        started = None
+        for method, params in read_download_events(driver):
+            guid = params.get("guid")
+            if method == "Page.downloadWillBegin" and guid not in guids and started is None:
+                started = guid
+            elif method == "Page.downloadProgress" and params.get("state") in ("completed", "canceled"):
+                states[guid] = params["state"]
+        return started
+
+    deadline = time.time() + DOWNLOAD_WAIT_TIMEOUT
+    polling = False
+    for row in rows:
+        # Files of downloads already under way are named by their guid.
+        existing = set(os.listdir(download_dir)) | set(guids)
+        row.find_element(By.XPATH, DOWNLOAD_BUTTON_XPATH).click()
+        guid = None
+        while guid is None and not polling and time.time() < deadline:
+            guid = drain_events()
+            if guid is None:
+                time.sleep(0.05)
+        if guid is None:
+            if not polling:
+                print("Warning: no download events in Chrome's performance log; "
+                      "polling the download directory instead.")
+                polling = True
+            downloads.append((None, _await_download_by_polling(download_dir, existing)))
+            deadline = time.time() + DOWNLOAD_WAIT_TIMEOUT
+        else:
+            guids.append(guid)
+            downloads.append((guid, None))
+
+    while True:
+        canceled = [guid for guid in guids if states.get(guid) == "canceled"]
+        if canceled:
+            raise RuntimeError(f"Chrome canceled the OpenVPN config download ({', '.join(canceled)}).")
+        if all(states.get(guid) == "completed" for guid in guids):
+            return [path or os.path.join(download_dir, guid) for guid, path in downloads]
+        if time.time() >= deadline:
+            raise TimeoutException(f"Timed out waiting for the OpenVPN config downloads in {download_dir}.")
+        time.sleep(0.05)
+        drain_events()
+
+def download_openvpn_config(driver: uc.Chrome, row: WebElement, download_dir: str) -> str:
+    """Single-row download_openvpn_configs()."""
+    return download_openvpn_configs(driver, [row], download_dir)[0]
+
+def parse_remotes(content: str) -> List[Remote]:
+    """Returns every (ip, port, proto) from the .ovpn content's "remote <ip>
+    <port> [proto]" lines, in file order. A line without its own proto gets
+    the file's "proto" directive (OpenVPN's default, udp, if there's none);
+    udp4/tcp-client and the like are reduced to udp/tcp."""
+    default = re.search(r'^proto\s+(udp|tcp)', content, re.MULTILINE)
+    default_proto = default.group(1) if default else "udp"
+    return [
+        (ip, int(port), proto or default_proto)
+        for ip, port, proto in re.findall(
+            r'^remote\s+([\d.]+)\s+(\d+)(?:\s+(udp|tcp)\S*)?', content, re.MULTILINE)
+    ]
+
+def extract_remotes(config_path: str) -> Tuple[List[Remote], str]:
+    """Parses the downloaded .ovpn file's remote endpoints, returning them
+    along with the file content (so it can be hashed for the endpoint
+    cache)."""
     with open(config_path, 'r') as f:
         content = f.read()
 
-    match = re.search(r'^remote\s+([\d.]+)\s+\d+', content, re.MULTILINE)
-    if not match:
+    remotes = parse_remotes(content)
+    if not remotes:
         raise RuntimeError(
             f"Could not find a 'remote <ip> <port>' line in downloaded config "
             f"{config_path} - the .ovpn format may have changed."
         )
-    return match.group(1)
+    return remotes, content
+
+def extract_endpoint_ip(config_path: str) -> str:
+    """Parses the downloaded .ovpn file for its first "remote <ip> <port>"
+    line. Proton lists the same entry IP multiple times with different
+    ports, so the first match is sufficient."""
+    remotes, _ = extract_remotes(config_path)
+    return remotes[0][0]
 
 def set_download_directory(driver: uc.Chrome, download_dir: str) -> None:
     """Headless Chrome blocks file downloads by default; this explicitly
-    allows them and directs them to download_dir."""
-    driver.execute_cdp_cmd("Page.setDownloadBehavior", {
-        "behavior": "allow",
+    allows them and directs them to download_dir. allowAndName saves each
+    file as download_dir/<guid>, so download_openvpn_configs() knows exactly
+    which file is whose; it learns each guid and when the file is done from
+    the Page.download* events in the performance log (see
+    read_download_events). eventsEnabled only adds Browser.download*
+    events, which chromedriver doesn't log."""
+    driver.execute_cdp_cmd("Browser.setDownloadBehavior", {
+        "behavior": "allowAndName",
         "downloadPath": download_dir,
+        "eventsEnabled": True,
     })
 
-# --- MAIN EXECUTION ---
-if __name__ == "__main__":
-    driver = None
-    best_server_ip = None
-    download_dir = tempfile.mkdtemp(prefix="protonvpn-ovpn-")
-
-    try:
-        # 1. Load Configuration
-        print(f"Loading configuration from {CONFIG_FILE}...")
-        load_config(CONFIG_FILE)
-
-        # --- Driver Setup ---
-        options = uc.ChromeOptions()
-        options.add_argument('--headless=new')
-        options.add_argument('--no-sandbox')
-        options.add_argument('--disable-dev-shm-usage')
-
-        chrome_version = detect_chrome_major_version()
+def chrome_options() -> uc.ChromeOptions:
+    """A fresh set of launch options (undetected_chromedriver won't reuse
+    one across launches)."""
+    import undetected_chromedriver as uc
+    options = uc.ChromeOptions()
+    options.add_argument('--headless=new')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    # Surfaces CDP events (Page.downloadWillBegin/downloadProgress in
+    # particular) through driver.get_log("performance"); see
+    # read_download_events(). Network events would dwarf them, so only
+    # Page-domain events are logged.
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": False, "enablePage": True})
+    if LEAN_MODE:
+        for argument in LEAN_CHROME_ARGUMENTS:
+            options.add_argument(argument)
+    return options
+
+def start_driver(download_dir: str, telemetry: Optional[RunTelemetry] = None) -> uc.Chrome:
+    """Launches headless Chrome (on the persistent profile, if configured)
+    with downloads directed to download_dir. With STARTUP_CACHE_FILE, an
+    unchanged Chrome starts from the cached major version and patched
+    chromedriver; otherwise both are worked out as before and cached for
+    next time. A cached driver that fails to start Chrome is dropped and the
+    launch retried without it."""
+    import undetected_chromedriver as uc
+    cache = StartupCache(STARTUP_CACHE_FILE) if STARTUP_CACHE_FILE else None
+    chrome_binary = find_chrome_binary()
+    cached = cache.lookup(chrome_binary) if cache and chrome_binary else None
+    driver_path = None
+    if cached:
+        chrome_version = cached["major_version"]
+        driver_path = cached.get("driver_path")
+        print(f"Chrome major version {chrome_version} (startup cache"
+              f"{', with its patched chromedriver' if driver_path else ''}).")
+    else:
+        chrome_version = detect_chrome_major_version(chrome_binary)
         if chrome_version:
             print(f"Detected installed Chrome major version: {chrome_version}")
         else:
             print("Warning: could not detect installed Chrome version; "
                   "falling back to undetected_chromedriver's own auto-detection.")
-
-        print("Initializing WebDriver...")
+    if telemetry:
+        telemetry.gauge("startup_cache_hit", int(driver_path is not None),
+                        "Whether Chrome was started from the cached version and patched chromedriver.")
+
+    user_data_dir = None
+    if PERSISTENT_PROFILE_DIR:
+        user_data_dir = os.path.abspath(PERSISTENT_PROFILE_DIR)
+        os.makedirs(user_data_dir, mode=0o700, exist_ok=True)
+        # makedirs' mode doesn't apply to a pre-existing dir (or through the
+        # umask), so enforce it explicitly - it holds live session cookies.
+        os.chmod(user_data_dir, 0o700)
+        print(f"Using persistent browser profile: {user_data_dir}")
+
+    print("Initializing WebDriver...")
+    try:
         driver = uc.Chrome(
             use_subprocess=False,
-            options=options,
+            options=chrome_options(),
             version_main=chrome_version,
+            user_data_dir=user_data_dir,
+            driver_executable_path=driver_path,
         )
-        set_download_directory(driver, download_dir)
-
-        # --- Login Flow ---
-        print(f"Visiting login URL: {LOGIN_URL}")
-        driver.get(LOGIN_URL)
-        
-        print("Entering username...")
-        wait_and_find(driver, By.ID, USER_ID).send_keys(USERNAME)
-        safe_click(driver, By.CSS_SELECTOR, CONTINUE_BUTTON_SELECTOR)
-        check_for_login_error(driver)
-
-        print("Entering password...")
-        wait_and_find(driver, By.ID, PASS_ID).send_keys(PASSWORD)
-        safe_click(driver, By.CSS_SELECTOR, CONTINUE_BUTTON_SELECTOR)
-        check_for_login_error(driver)
-
-        print("Entering TOTP...")
-        totp = get_totp_code()
-        wait_and_find(driver, By.ID, TOTP_ID).send_keys(totp)
-        check_for_login_error(driver)
-
-        print("Entering mailbox password...")
-        wait_and_find(driver, By.ID, MAILBOX_PASSWORD_ID).send_keys(MAILBOX_PASSWORD)
-        safe_click(driver, By.CSS_SELECTOR, CONTINUE_BUTTON_SELECTOR)
-        check_for_login_error(driver)
-
-        print("Login complete. Waiting for dashboard...")
-        WebDriverWait(driver, DASHBOARD_WAIT_TIMEOUT).until(
-            EC.url_changes(LOGIN_URL)
+    except WebDriverException as e:
+        if not driver_path:
+            raise
+        print(f"Cached chromedriver failed to start Chrome ({type(e).__name__}); "
+              "clearing the startup cache and retrying.")
+        cache.invalidate()
+        driver_path = None
+        driver = uc.Chrome(
+            use_subprocess=False,
+            options=chrome_options(),
+            version_main=chrome_version,
+            user_data_dir=user_data_dir,
         )
 
-        # --- Data Extraction ---
-        rows = extract_server_rows(driver)
-        print(f"Found {len(rows)} server rows.")
+    if cache and chrome_binary and chrome_version and not driver_path:
+        try:
+            cache.store(chrome_binary, chrome_version, driver.patcher.executable_path)
+            print(f"Saved Chrome's version and patched chromedriver to {STARTUP_CACHE_FILE}.")
+        except OSError as e:
+            print(f"Warning: could not update the startup cache: {e}")
+    set_download_directory(driver, download_dir)
+    if LEAN_MODE:
+        apply_lean_settings(driver)
+    return driver
+
+def apply_lean_settings(driver: uc.Chrome) -> None:
+    """The LEAN_MODE settings that can only be applied to a running browser:
+    the URL blocklist, and the window size (undetected_chromedriver appends
+    its own --window-size, which would win over one passed as an option)."""
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": LEAN_BLOCKED_URL_PATTERNS})
+    width, height = LEAN_WINDOW_SIZE
+    driver.set_window_size(width, height)
+    print(f"Lean mode: blocking {len(LEAN_BLOCKED_URL_PATTERNS)} URL pattern(s), images off, "
+          f"{width}x{height} window.")
+
+# Reads the current page's navigation timing and what it fetched, from the
+# Performance API.
+_PAGE_LOAD_STATS_SCRIPT = """
+const nav = performance.getEntriesByType('navigation')[0];
+const resources = performance.getEntriesByType('resource');
+if (!nav) return null;
+return {
+    dom_content_loaded_ms: nav.domContentLoadedEventEnd,
+    load_ms: nav.loadEventEnd,
+    resources: resources.length,
+    transfer_bytes: nav.transferSize + resources.reduce((total, r) => total + (r.transferSize || 0), 0),
+};
+"""
+
+def report_page_load(driver: uc.Chrome, telemetry: RunTelemetry, page: str) -> None:
+    """Prints (and records as gauges) how long the current page took to load
+    and how much it fetched. Best-effort: a page without navigation timing
+    just isn't reported."""
+    try:
+        stats = driver.execute_script(_PAGE_LOAD_STATS_SCRIPT)
+    except WebDriverException:
+        stats = None
+    if not stats:
+        return
+    print(f"{page} page: DOM ready in {stats['dom_content_loaded_ms'] / 1000:.2f}s, "
+          f"loaded in {stats['load_ms'] / 1000:.2f}s, {stats['resources']} resource(s), "
+          f"{stats['transfer_bytes'] // 1024} KB transferred.")
+    telemetry.gauge("page_load_seconds", stats["load_ms"] / 1000, "Page load time.", page=page)
+    telemetry.gauge("page_transfer_bytes", stats["transfer_bytes"], "Bytes the page fetched.", page=page)
+    telemetry.gauge("page_resources", stats["resources"], "Subresources the page fetched.", page=page)
+
+def sample_chrome_rss(driver: uc.Chrome, telemetry: RunTelemetry) -> None:
+    """Records Chrome's current total RSS into the run's peak (see
+    process_tree_rss_bytes). Sampled after each heavy phase."""
+    rss = process_tree_rss_bytes(driver.browser_pid)
+    if rss is not None:
+        telemetry.gauge_max("chrome_peak_rss_bytes", rss, "Peak RSS of the Chrome process tree seen this run.")
+
+def session_is_valid(driver: uc.Chrome) -> bool:
+    """Goes straight to DOWNLOAD_URL and reports whether the saved session is
+    still logged in: True once the country table's section renders, False
+    if Proton redirects to LOGIN_URL (or neither happens in time). On True
+    the driver is left on the download page, so the caller can read the
+    table without navigating again."""
+    from selenium.webdriver.support.ui import WebDriverWait
+    driver.get(DOWNLOAD_URL)
+    try:
+        WebDriverWait(driver, ELEMENT_WAIT_TIMEOUT).until(
+            lambda d: d.current_url.startswith(LOGIN_URL)
+            or d.find_elements(By.XPATH, country_details_xpath())
+        )
+    except TimeoutException:
+        return False
+    return not driver.current_url.startswith(LOGIN_URL)
+
+def log_in(driver: uc.Chrome) -> None:
+    """Runs the full username -> password -> TOTP -> mailbox password login
+    and waits for the dashboard."""
+    from selenium.webdriver.support import expected_conditions as EC
+    print(f"Visiting login URL: {LOGIN_URL}")
+    driver.get(LOGIN_URL)
+
+    # Each step waits for whichever comes first: the next step's field
+    # (success) or an error banner (failure) - see wait_for_step_or_error.
+    print("Entering username...")
+    wait_and_find(driver, By.ID, USER_ID).send_keys(USERNAME)
+    safe_click(driver, By.CSS_SELECTOR, CONTINUE_BUTTON_SELECTOR)
+
+    print("Entering password...")
+    wait_for_step_or_error(
+        driver, EC.visibility_of_element_located((By.ID, PASS_ID)), "the password field"
+    ).send_keys(PASSWORD)
+    safe_click(driver, By.CSS_SELECTOR, CONTINUE_BUTTON_SELECTOR)
+
+    print("Entering TOTP...")
+    totp = get_totp_code()
+    wait_for_step_or_error(
+        driver, EC.visibility_of_element_located((By.ID, TOTP_ID)), "the TOTP field"
+    ).send_keys(totp)
+
+    print("Entering mailbox password...")
+    wait_for_step_or_error(
+        driver, EC.visibility_of_element_located((By.ID, MAILBOX_PASSWORD_ID)),
+        "the mailbox password field",
+    ).send_keys(MAILBOX_PASSWORD)
+    safe_click(driver, By.CSS_SELECTOR, CONTINUE_BUTTON_SELECTOR)
+
+    print("Login complete. Waiting for dashboard...")
+    wait_for_step_or_error(
+        driver, EC.url_changes(LOGIN_URL), "the dashboard", timeout=DASHBOARD_WAIT_TIMEOUT
+    )
+
+def count_webdriver_commands(driver: uc.Chrome, telemetry: Optional[RunTelemetry] = None) -> Dict[str, int]:
+    """Wraps driver.execute (which every WebDriver call, including those made
+    through a WebElement, funnels through) to count commands by name. Returns
+    the live counter; read it before/after a phase to measure that phase's
+    chromedriver round trips. Safe to call repeatedly on the same driver - it
+    is only wrapped once. With telemetry, every command's latency is also
+    recorded there from now on (a daemon passes each cycle's own)."""
+    if telemetry is not None:
+        driver._telemetry = telemetry
+    counts = getattr(driver, "_command_counts", None)
+    if counts is not None:
+        return counts
+    counts = {}
+    original_execute = driver.execute
+
+    def counting_execute(driver_command, params=None):
+        counts[driver_command] = counts.get(driver_command, 0) + 1
+        start = time.perf_counter()
+        try:
+            return original_execute(driver_command, params)
+        finally:
+            run_telemetry = getattr(driver, "_telemetry", None)
+            if run_telemetry is not None:
+                run_telemetry.observe("webdriver", driver_command, time.perf_counter() - start)
+
+    driver.execute = counting_execute
+    driver._command_counts = counts
+    return counts
+
+def process_tree_rss_bytes(root_pid: int) -> Optional[int]:
+    """Total resident memory of root_pid and all its descendants (Chrome
+    spreads itself over a dozen renderer/GPU/utility processes), read from
+    /proc. Returns None where /proc isn't available."""
+    children: Dict[int, List[int]] = {}
+    try:
+        pids = [int(p) for p in os.listdir("/proc") if p.isdigit()]
+    except OSError:
+        return None
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                # The command name (field 2) may itself contain spaces or
+                # parens, so split after its closing paren.
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(pid)
 
-        # --- Data Processing and Result ---
-        server_name, utilization, best_row = find_lowest_utilization_p2p_server(rows)
+    total, stack = 0, [root_pid]
+    while stack:
+        pid = stack.pop()
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except (OSError, ValueError):
+            pass
+        stack.extend(children.get(pid, []))
+    return total
+
+def ensure_session(driver: uc.Chrome, check_existing: bool) -> bool:
+    """Makes sure the driver is logged in, and returns True if it was left on
+    the download page (so the table can be read without navigating again).
+    With check_existing, a still-valid session (persistent profile, or a
+    warm daemon browser) is reused and only a redirect to LOGIN_URL triggers
+    a full login."""
+    if check_existing:
+        if session_is_valid(driver):
+            print("Session reused: browser is still logged in.")
+            return True
+        print("Session rebuilt: browser is logged out, logging in again.")
+    log_in(driver)
+    return False
+
+def sync_endpoint_cache(endpoint_cache: Optional[EndpointCache]) -> Optional[EndpointCache]:
+    """Returns the endpoint cache for the just-(re)loaded config: None if
+    ENDPOINT_CACHE_FILE is empty, otherwise endpoint_cache updated in place
+    (keeping its hit/miss counts across daemon cycles) or a new one."""
+    if not ENDPOINT_CACHE_FILE:
+        return None
+    if endpoint_cache is None:
+        return EndpointCache(ENDPOINT_CACHE_FILE, ENDPOINT_CACHE_TTL_SECONDS)
+    endpoint_cache.path = ENDPOINT_CACHE_FILE
+    endpoint_cache.ttl_seconds = ENDPOINT_CACHE_TTL_SECONDS
+    return endpoint_cache
+
+def resolve_remotes(driver: uc.Chrome, download_dir: str, wanted: List[Tuple[str, str, Any]],
+                    endpoint_cache: Optional[EndpointCache], download: Set[str]) -> Dict[str, List[Remote]]:
+    """Returns {server_name: its .ovpn remote endpoints} for the (country,
+    server_name, handle) entries in wanted: from endpoint_cache where it
+    holds a fresh entry, and the servers in download that it doesn't
+    downloaded together by clicking their rows' download buttons (handle is
+    the row or, in bulk mode, its row index in country's table) and parsing
+    the files. Other uncached servers are left out."""
+    resolved: Dict[str, List[Remote]] = {}
+    to_download: Dict[str, Tuple[str, Any]] = {}
+    for country, server_name, handle in wanted:
+        if server_name in resolved or server_name in to_download:
+            continue
+        remotes = endpoint_cache.get(server_name) if endpoint_cache else None
+        if remotes:
+            print(f"Using cached endpoints for {server_name}; skipping the download.")
+            resolved[server_name] = remotes
+        elif server_name in download:
+            to_download[server_name] = (country, handle)
+    if not to_download:
+        return resolved
+
+    rows = [row_element(driver, handle, country) if isinstance(handle, int) else handle
+            for country, handle in to_download.values()]
+    print(f"Downloading OpenVPN configs for {', '.join(to_download)}...")
+    for server_name, config_path in zip(to_download, download_openvpn_configs(driver, rows, download_dir)):
+        remotes, content = extract_remotes(config_path)
+        # Don't let files pile up across daemon iterations.
+        os.remove(config_path)
+        if endpoint_cache:
+            endpoint_cache.put(server_name, remotes, content)
+        resolved[server_name] = remotes
+    return resolved
+
+# Resolves (country, server_name, handle) entries to {server_name: its .ovpn
+# remote endpoints}; how depends on the path (browser download or HTTP +
+# endpoint cache). The second argument names the servers that must be
+# resolved (the winners), the third the RTT probe candidates; the rest are
+# failover runner-ups. Only the winners are guaranteed to be in the result.
+Resolver = Callable[[List[Tuple[str, str, Any]], Set[str], Set[str]], Dict[str, List[Remote]]]
+
+def choose_by_latency(candidates: List[Tuple[int, str, List[Remote]]]) -> Tuple[str, int, List[Remote]]:
+    """Probes the (utilization, server_name, remotes) candidates' endpoints
+    all at once (see rtt_probe.py) and returns (server_name, utilization,
+    remotes) for the best weighted load/RTT score. Candidates that don't
+    answer within RTT_PROBE_DEADLINE_SECONDS are dropped; if none answer,
+    the lowest-utilization candidate wins as it would without probing."""
+    from rtt_probe import probe_rtts, weighted_score
+    probe_start = time.monotonic()
+    rtts = probe_rtts(
+        [(remotes[0][0], RTT_PROBE_PORT) for _, _, remotes in candidates],
+        RTT_PROBE_DEADLINE_SECONDS, RTT_PROBE_ATTEMPTS,
+    )
+    print(f"Probed {len(candidates)} candidate(s) in {time.monotonic() - probe_start:.2f}s.")
 
-        print(f"Downloading OpenVPN config for {server_name}...")
-        config_path = download_openvpn_config(driver, best_row, download_dir)
-        best_server_ip = extract_endpoint_ip(config_path)
+    scored = []
+    for utilization, server_name, remotes in candidates:
+        rtt_ms = rtts.get((remotes[0][0], RTT_PROBE_PORT))
+        if rtt_ms is None:
+            print(f"  {server_name} ({utilization}%): no response, skipped.")
+            continue
+        score = weighted_score(utilization, rtt_ms, SCORE_LOAD_WEIGHT, SCORE_RTT_WEIGHT)
+        print(f"  {server_name} ({utilization}%): {rtt_ms:.1f} ms, score {score:.1f}")
+        scored.append((score, utilization, server_name, remotes))
+
+    if not scored:
+        print("No candidate answered the RTT probe; falling back to lowest utilization.")
+        utilization, server_name, remotes = candidates[0]
+        return server_name, utilization, remotes
+
+    scored.sort(key=lambda c: c[0])
+    _, utilization, server_name, remotes = scored[0]
+    print(f"Selected {server_name} ({utilization}%) - best load/RTT score.")
+    return server_name, utilization, remotes
+
+def current_server_utilization(records: List[Tuple[str, int, bool, Any]],
+                               applied_state_files: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Looks up the servers update_pfsense.py last applied (one per
+    applied_state_files entry - one per firewall, see applied_state_files -
+    default APPLIED_STATE_FILE) in this scrape's table, so its hysteresis
+    can compare the new winner against each one's live load rather than
+    its load when applied. current_utilizations maps each applied server to
+    its utilization, None if it's no longer listed; a server that isn't in
+    it isn't known to be applied. With a single applied server it's also
+    given as current_server / current_utilization, as before."""
+    live = {row[0]: row[1] for row in records}
+    current = {}
+    for path in applied_state_files or [APPLIED_STATE_FILE]:
+        try:
+            with open(path, 'r') as f:
+                applied_server = json.load(f).get("server")
+        except (OSError, ValueError):
+            continue
+        if applied_server:
+            current[applied_server] = live.get(applied_server)
+    if not current:
+        return {}
+    result = {"current_utilizations": current}
+    if len(current) == 1:
+        (server, utilization), = current.items()
+        result.update({"current_server": server, "current_utilization": utilization})
+    return result
+
+def unhealthy_servers(applied_state_files: List[str]) -> Set[str]:
+    """The applied servers (one per file - per firewall, see
+    applied_state_files) that monitor.py has marked unhealthy since they
+    were applied. The re-selection that follows shouldn't pick one straight
+    back, whichever firewall's tunnel it failed on."""
+    unhealthy = set()
+    for path in applied_state_files:
+        try:
+            with open(path, 'r') as f:
+                applied = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if applied.get("unhealthy_at", 0) > applied.get("applied_at", 0) and applied.get("server"):
+            unhealthy.add(applied["server"])
+    return unhealthy
+
+def record_history(records: List[Tuple[str, int, bool, Any]], store_rows: bool = True) -> Optional[Dict[str, float]]:
+    """Stores this scrape's full table in HISTORY_DB (see history.py) and,
+    under the "ewma" SELECTION_POLICY, returns the trend scores to rank
+    candidates by (None otherwise). store_rows=False only reads the scores,
+    for a browser run falling back from an HTTP refresh that already stored
+    this run's table. A history failure never fails the scrape; selection
+    just falls back to this snapshot."""
+    if not HISTORY_DB:
+        return None
+    try:
+        store = HistoryStore(HISTORY_DB)
+        try:
+            if store_rows:
+                store.record(
+                    (server_name, server_state(server_name), utilization, supports_p2p)
+                    for server_name, utilization, supports_p2p, _ in records
+                )
+                store.prune(HISTORY_DOWNSAMPLE_AFTER_HOURS, HISTORY_RETENTION_DAYS)
+            if SELECTION_POLICY != "ewma":
+                return None
+            return store.trend_scores(
+                [server_name for server_name, _, _, _ in records],
+                HISTORY_WINDOW_HOURS, HISTORY_EWMA_HALF_LIFE_HOURS, HISTORY_VARIANCE_WEIGHT,
+            )
+        finally:
+            store.close()
+    except sqlite3.Error as e:
+        print(f"Warning: utilization history unavailable ({e}); using this snapshot only.")
+        return None
 
-        print("\n--- RESULT ---")
-        print(f"Selected Server: {server_name}")
-        print(f"Utilization: {utilization}%")
-        print(f"**Best Server IP Address: {best_server_ip}**")
+def profile_settings() -> Dict[str, Any]:
+    """The loaded config's settings profiles.py works from."""
+    return {
+        "COUNTRY_NAME": COUNTRY_NAME,
+        "STATES": STATES,
+        "HTTP_COUNTRY_CODE": HTTP_COUNTRY_CODE,
+        "OUTPUT_FILE": OUTPUT_FILE_NAME,
+        "SELECTION_FILE": SELECTION_FILE,
+        "APPLIED_STATE_FILE": APPLIED_STATE_FILE,
+        "SELECTION_PROFILES": SELECTION_PROFILES,
+    }
+
+def active_profiles() -> List[Dict[str, Any]]:
+    """The loaded config's selection profiles (see profiles.py): one per
+    SELECTION_PROFILES entry, or a single one made of the top-level
+    settings."""
+    return selection_profiles(profile_settings())
+
+def applied_state_files(profile: Dict[str, Any]) -> List[str]:
+    """Every APPLIED_STATE_FILE update_pfsense.py records profile's applied
+    server in: one per FIREWALLS entry, or just the profile's own."""
+    if not FIREWALLS:
+        return [profile["APPLIED_STATE_FILE"]]
+    targets = expand_targets({**profile_settings(), "FIREWALLS": FIREWALLS})
+    return [target["APPLIED_STATE_FILE"] for target in targets if target["PROFILE"] == profile["PROFILE"]]
+
+def profile_countries(profiles: List[Dict[str, Any]]) -> List[str]:
+    """The distinct countries the profiles need, in first-use order."""
+    return list(dict.fromkeys(profile["COUNTRY_NAME"] for profile in profiles))
+
+def select_server(profile: Dict[str, Any], candidates: List[Tuple[int, str, Any]],
+                  resolved: Dict[str, List[Remote]], scores: Optional[Dict[str, float]],
+                  records: List[Tuple[str, int, bool, Any]], telemetry: RunTelemetry,
+                  labels: Dict[str, str]) -> Dict[str, Any]:
+    """Picks one profile's winner from its ranked candidates (see
+    rank_candidates) and returns the selection record write_output() hands
+    to update_pfsense.py: server, utilization, ip and remotes, the
+    FAILOVER_CANDIDATES best candidates (winner first) with all of their
+    remote endpoints, plus the currently-applied server's live utilization
+    (see current_server_utilization). resolved holds the endpoints
+    select_servers() fetched; candidates without them are passed over. With
+    RTT_PROBE_TOP_K > 1 the winner is picked by choose_by_latency() instead
+    of utilization alone."""
+    available = [(utilization, server_name, resolved[server_name])
+                 for utilization, server_name, _ in candidates if server_name in resolved]
+    if RTT_PROBE_TOP_K > 1:
+        with telemetry.span("select_by_latency", **labels):
+            server_name, utilization, remotes = choose_by_latency(available[:RTT_PROBE_TOP_K])
+    else:
+        utilization, server_name, remotes = available[0]
+        announce_choice(server_name, utilization, scores, profile["P2P_REQUIRED"])
+    telemetry.gauge("selected_utilization_percent", utilization, "Utilization of the selected server.", **labels)
+    ranked = [(utilization, server_name, remotes)] + [c for c in available if c[1] != server_name]
+    ranked = ranked[:max(1, FAILOVER_CANDIDATES)]
+    best_server_ip = remotes[0][0]
+
+    heading = f"RESULT ({profile['PROFILE']})" if labels else "RESULT"
+    print(f"\n--- {heading} ---")
+    print(f"Selected Server: {server_name}")
+    print(f"Utilization: {utilization}%")
+    print(f"**Best Server IP Address: {best_server_ip}**")
+    if len(ranked) > 1:
+        print("Failover: " + ", ".join(f"{name} ({util}%, {rem[0][0]})" for util, name, rem in ranked[1:]))
+    return {
+        "profile": profile["PROFILE"],
+        "server": server_name,
+        "utilization": utilization,
+        "ip": best_server_ip,
+        "remotes": [list(remote) for remote in remotes],
+        "candidates": [
+            {"server": name, "utilization": util, "ip": rem[0][0], "remotes": [list(remote) for remote in rem]}
+            for util, name, rem in ranked
+        ],
+        **current_server_utilization(records, applied_state_files(profile)),
+    }
+
+def select_servers(tables: Dict[str, List[Tuple[str, int, bool, Any]]], resolve: Resolver,
+                   telemetry: RunTelemetry,
+                   store_history: bool = True) -> List[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]]:
+    """Everything after the tables are read, shared by the browser and HTTP
+    paths: records history for every row read, ranks each profile's
+    candidates from its country's table (tables maps country name to
+    records), resolves the endpoints of every profile's top candidates in
+    one resolve() call - each winner's required, the rest (RTT probe and
+    failover candidates) best-effort, and a server shared by several
+    profiles fetched once - then runs select_server() per profile. Returns
+    (profile, selection) pairs, the selection None where no server matched
+    that profile's criteria. Each step is timed as a span in telemetry."""
+    profiles = active_profiles()
+    all_records = [record for records in tables.values() for record in records]
+    telemetry.gauge("server_rows", len(all_records), "Server rows read from the downloads page.")
+    with telemetry.span("history"):
+        scores = record_history(all_records, store_history)
+
+    def labels_for(profile: Dict[str, Any]) -> Dict[str, str]:
+        return {"profile": profile["PROFILE"]} if len(profiles) > 1 else {}
+
+    ranked: Dict[str, List[Tuple[int, str, Any]]] = {}
+    wanted: List[Tuple[str, str, Any]] = []
+    required: Set[str] = set()
+    probed: Set[str] = set()
+    depth = max(1, FAILOVER_CANDIDATES, RTT_PROBE_TOP_K)
+    for profile in profiles:
+        try:
+            with telemetry.span("select", **labels_for(profile)):
+                candidates = rank_candidates(tables[profile["COUNTRY_NAME"]], scores,
+                                             profile["STATES"], profile["P2P_REQUIRED"])
+        except ValueError as e:
+            print(f"❌ No server for profile {profile['PROFILE']}: {e}")
+            continue
+        unhealthy = unhealthy_servers(applied_state_files(profile))
+        healthy = [candidate for candidate in candidates if candidate[1] not in unhealthy]
+        if healthy and len(healthy) < len(candidates):
+            passed_over = sorted(unhealthy & {name for _, name, _ in candidates})
+            print(f"Passing over {', '.join(passed_over)}: monitor.py marked the tunnel unhealthy.")
+            candidates = healthy
+        ranked[profile["PROFILE"]] = candidates
+        wanted.extend((profile["COUNTRY_NAME"], server_name, handle) for _, server_name, handle in candidates[:depth])
+        required.add(candidates[0][1])
+        if RTT_PROBE_TOP_K > 1:
+            probed.update(server_name for _, server_name, _ in candidates[:RTT_PROBE_TOP_K])
+
+    with telemetry.span("resolve_endpoints"):
+        resolved = resolve(wanted, required, probed) if wanted else {}
+
+    results = []
+    for profile in profiles:
+        candidates = ranked.get(profile["PROFILE"])
+        selection = None
+        if candidates:
+            selection = select_server(profile, candidates, resolved, scores, tables[profile["COUNTRY_NAME"]],
+                                      telemetry, labels_for(profile))
+        results.append((profile, selection))
+    return results
+
+def scrape_best_servers(driver: uc.Chrome, download_dir: str, on_download_page: bool,
+                        endpoint_cache: Optional[EndpointCache] = None,
+                        telemetry: Optional[RunTelemetry] = None,
+                        store_history: bool = True) -> List[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]]:
+    """The browser path: reads every country the profiles need from one
+    load of the downloads page (expanding each country's section once), then
+    select_servers() with a resolver that downloads the candidates' .ovpn
+    files by their rows' own buttons, all in one go (see resolve_remotes)."""
+    telemetry = telemetry or RunTelemetry("scraper")
+    command_counts = count_webdriver_commands(driver, telemetry)
+    commands_before = sum(command_counts.values())
+    tables: Dict[str, List[Tuple[str, int, bool, Any]]] = {}
+    with telemetry.span("read_table"):
+        for country in profile_countries(active_profiles()):
+            # Only the first country needs the page loaded; the others are
+            # further <details> sections of the same page.
+            navigate = not on_download_page and not tables
+            if BULK_ROW_EXTRACTION:
+                tables[country] = extract_server_records(driver, navigate, country)
+            else:
+                tables[country] = parse_rows(extract_server_rows(driver, navigate, country))
+            print(f"Found {len(tables[country])} {country} server rows.")
+    report_page_load(driver, telemetry, "downloads")
+    sample_chrome_rss(driver, telemetry)
+
+    results = select_servers(
+        tables,
+        lambda wanted, required, probed: resolve_remotes(
+            driver, download_dir, wanted, endpoint_cache,
+            {server_name for _, server_name, _ in wanted} if FAILOVER_DOWNLOAD_UNCACHED else required | probed),
+        telemetry, store_history,
+    )
+    sample_chrome_rss(driver, telemetry)
+    peak_rss = telemetry.gauges.get(("chrome_peak_rss_bytes", ()))
+    if peak_rss is not None:
+        print(f"Peak Chrome RSS: {peak_rss // (1024 * 1024)} MB{' (lean mode)' if LEAN_MODE else ''}.")
+    print(f"Selection took {sum(command_counts.values()) - commands_before} WebDriver "
+          f"commands ({'bulk' if BULK_ROW_EXTRACTION else 'per-row'} mode).")
+    if endpoint_cache:
+        print(endpoint_cache.summary())
+    return results
+
+def read_tables_http(profiles: List[Dict[str, Any]]) -> Dict[str, List[Tuple[str, int, bool, None]]]:
+    """The HTTP path's equivalent of extract_server_records(), for every
+    country the profiles need from a single request: the table read with
+    the saved session's cookies (see http_scrape.py), parsed by the same
+    parse_server_fields(). Records carry no handle - there's no row to
+    click. Raises SessionExpired or HttpScrapeError."""
+    from http_scrape import HttpScrapeError, fetch, load_session, parse_logicals, parse_server_table
+    session = load_session(SESSION_COOKIE_FILE, HTTP_HEADERS)
+    try:
+        if HTTP_SOURCE == "json":
+            response = fetch(session, HTTP_SERVERS_JSON_URL, LOGIN_URL, HTTP_TIMEOUT_SECONDS)
+            try:
+                data = response.json()
+            except ValueError:
+                raise HttpScrapeError(f"{HTTP_SERVERS_JSON_URL} did not return JSON")
+            raw_tables = {profile["COUNTRY_NAME"]: parse_logicals(data, profile["HTTP_COUNTRY_CODE"])
+                          for profile in profiles}
+        else:
+            response = fetch(session, DOWNLOAD_URL, LOGIN_URL, HTTP_TIMEOUT_SECONDS)
+            raw_tables = {country: parse_server_table(response.text, country, P2P_ICON_SELECTOR)
+                          for country in profile_countries(profiles)}
+    finally:
+        session.close()
+    tables = {}
+    for country, raw_rows in raw_tables.items():
+        records = []
+        for server_name, utilization_str, supports_p2p in raw_rows:
+            parsed = parse_server_fields(server_name, utilization_str, supports_p2p)
+            if parsed is not None:
+                records.append((*parsed, None))
+        tables[country] = records
+    return tables
+
+def refresh_over_http(endpoint_cache: Optional[EndpointCache],
+                      telemetry: RunTelemetry) -> Tuple[Optional[List[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]]], bool]:
+    """Tries the whole selection without a browser. Returns (select_servers()
+    results, or None if the browser is needed after all; whether this run's
+    tables were already stored in history, so the browser run doesn't store
+    them twice)."""
+    from http_scrape import HttpScrapeError, SessionExpired
+    try:
+        with telemetry.span("http_read_table"):
+            tables = read_tables_http(active_profiles())
+    except (SessionExpired, HttpScrapeError) as e:
+        print(f"HTTP refresh unavailable ({e}); using the browser.")
+        return None, False
+    print(f"Found {sum(len(records) for records in tables.values())} server rows over HTTP (no browser).")
+
+    def resolve_cached(wanted: List[Tuple[str, str, Any]], required: Set[str],
+                       probed: Set[str]) -> Dict[str, List[Remote]]:
+        resolved = {}
+        for _, server_name, _ in wanted:
+            if server_name in resolved:
+                continue
+            remotes = endpoint_cache.get(server_name) if endpoint_cache else None
+            if remotes:
+                print(f"Using cached endpoints for {server_name}.")
+                resolved[server_name] = remotes
+            elif server_name in required:
+                raise HttpScrapeError(f"{server_name}'s endpoints aren't cached and its .ovpn needs the browser")
+        return resolved
 
-    except (TimeoutException, NoSuchElementException, WebDriverException) as e:
-        print(f"\n--- FATAL ERROR (LINE {inspect.currentframe().f_lineno}) ---")
+    try:
+        results = select_servers(tables, resolve_cached, telemetry)
+    except HttpScrapeError as e:
+        print(f"HTTP refresh incomplete ({e}); using the browser.")
+        return None, True
+    if endpoint_cache:
+        print(endpoint_cache.summary())
+    return results, True
+
+def export_session_cookies(driver: uc.Chrome) -> None:
+    """Saves the browser's (logged-in) cookies for the next run's HTTP
+    refresh. Best-effort: without them the next run just uses the browser."""
+    from http_scrape import save_cookies
+    try:
+        save_cookies(SESSION_COOKIE_FILE, driver.get_cookies())
+        print(f"Saved session cookies to {SESSION_COOKIE_FILE} for HTTP refresh.")
+    except (OSError, WebDriverException) as e:
+        print(f"Warning: could not save session cookies: {e}")
+
+def write_output(selection: Dict[str, Any], profile: Dict[str, Any]) -> bool:
+    """Writes the winning IP to the profile's OUTPUT_FILE (all find_vpn.sh
+    needs), then the full selection record to its SELECTION_FILE (what
+    update_pfsense.py reads), each atomically - see handoff.py."""
+    output_file = profile["OUTPUT_FILE"]
+    try:
+        write_atomic(output_file, selection["ip"])
+        write_atomic(profile["SELECTION_FILE"], json.dumps(selection, indent=2))
+        print(f"✅ IP address successfully written to **{output_file}**")
+        return True
+    except IOError as e:
+        print(f"❌ Failed to write IP to file {output_file}: {e}")
+        return False
+
+def write_outputs(results: List[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]], run_id: str) -> bool:
+    """write_output() for every profile that found a server, each record
+    stamped with this run's id and time, and every distinct IP among the
+    winner's remotes. True only if every profile did and was written - a
+    caller chaining update_pfsense.py must hear about any tunnel left on a
+    stale IP."""
+    written = []
+    for profile, selection in results:
+        if selection:
+            selection = {
+                **selection,
+                "ips": list(dict.fromkeys(remote[0] for remote in selection.get("remotes") or [[selection["ip"]]])),
+                "timestamp": time.time(),
+                "run_id": run_id,
+            }
+            written.append(write_output(selection, profile))
+    return len(written) == len(results) and all(written)
+
+def report_error(e: Exception, driver: Optional[uc.Chrome]) -> None:
+    """Prints a failed run's error (with the line it was raised from), plus a
+    screenshot of the page for Selenium errors."""
+    lineno = traceback.extract_tb(e.__traceback__)[-1].lineno if e.__traceback__ else "?"
+    print(f"\n--- FATAL ERROR (LINE {lineno}) ---")
+    if isinstance(e, (TimeoutException, NoSuchElementException, WebDriverException)):
         print(f"A Selenium error occurred: {type(e).__name__} - {e}")
         if driver:
-            driver.save_screenshot("error_screenshot.png")
-            print("Saved error_screenshot.png for debugging.")
-    except Exception as e:
-        print(f"\n--- FATAL ERROR (LINE {inspect.currentframe().f_lineno}) ---")
+            try:
+                driver.save_screenshot("error_screenshot.png")
+                print("Saved error_screenshot.png for debugging.")
+            except WebDriverException:
+                pass  # The browser itself may be what died.
+    else:
         print(f"An unexpected error occurred: {type(e).__name__} - {e}")
-    finally:
-        # --- File Output and Cleanup ---
-        if best_server_ip:
+
+def fresh_results() -> bool:
+    """Whether every profile's handoff files hold a result written at most
+    SCRAPE_REUSE_MAX_AGE_SECONDS ago, its OUTPUT_FILE matching its
+    SELECTION_FILE."""
+    for profile in active_profiles():
+        try:
+            with open(profile["SELECTION_FILE"], "r") as f:
+                selection = json.load(f)
+            with open(profile["OUTPUT_FILE"], "r") as f:
+                ip = f.read().strip()
+        except (OSError, ValueError):
+            return False
+        if ip != selection.get("ip") or time.time() - selection.get("timestamp", 0) > SCRAPE_REUSE_MAX_AGE_SECONDS:
+            return False
+    return True
+
+def single_flight(telemetry: RunTelemetry,
+                  updates_pfsense: bool = False) -> Tuple[Optional[ScrapeLock], Optional[int]]:
+    """Takes the scrape lock, waiting out another run that holds it;
+    updates_pfsense says in the lock whether this run goes on to update
+    pfSense. Returns (lock, None) if this run should scrape - lock is None
+    with the lock disabled - or (None, exit_code) if it shouldn't: 0 when
+    the other run's fresh result was reused, EXIT_SCRAPE_IN_FLIGHT when it's
+    still going."""
+    global reused_in_flight_result, reused_result_owner_updates
+    reused_in_flight_result = reused_result_owner_updates = False
+    if not SCRAPE_LOCK_FILE:
+        return None, None
+    lock = ScrapeLock(SCRAPE_LOCK_FILE, updates_pfsense)
+    owner = lock.acquire()
+    if owner is None:
+        return lock, None
+    producer = owner
+
+    age = time.time() - owner.get("started_at", time.time())
+    print(f"Another scrape is in flight (pid {owner.get('pid')} on {owner.get('host')}, started {age:.0f}s ago).")
+    start = time.monotonic()
+    with telemetry.span("wait_for_scrape_lock"):
+        while owner is not None and time.monotonic() - start < SCRAPE_LOCK_WAIT_SECONDS:
+            time.sleep(min(1.0, SCRAPE_LOCK_WAIT_SECONDS - (time.monotonic() - start)))
+            owner = lock.acquire()
+            producer = owner or producer
+    if owner is not None:
+        print(f"Still in flight after {SCRAPE_LOCK_WAIT_SECONDS}s; exiting with status {EXIT_SCRAPE_IN_FLIGHT}.")
+        return None, EXIT_SCRAPE_IN_FLIGHT
+
+    print(f"The other scrape finished after {time.monotonic() - start:.1f}s.")
+    if fresh_results():
+        lock.release()
+        reused_in_flight_result = True
+        reused_result_owner_updates = producer.get("updates_pfsense") is True
+        telemetry.gauge("reused_in_flight_result", 1, "Whether the run reused an overlapping run's result.")
+        print(f"Reusing its result (at most {SCRAPE_REUSE_MAX_AGE_SECONDS}s old) instead of scraping again.")
+        return None, 0
+    print("It left no fresh result; scraping.")
+    return lock, None
+
+def run_daemon(download_dir: str) -> None:
+    """--daemon: keeps one warm browser and re-scrapes every
+    DAEMON_INTERVAL_SECONDS, so each cycle costs a page load instead of a
+    Python/Chrome cold start plus a full login. config.json is reloaded at
+    the top of every cycle, as a fresh cron run would; a Selenium error
+    throws the browser away so the next cycle starts clean."""
+    driver = None
+    endpoint_cache = None
+    iterations = 0
+    try:
+        while True:
+            cycle_start = time.monotonic()
+            telemetry = RunTelemetry("scraper")
+            success = False
+            lock = None
             try:
-                with open(OUTPUT_FILE_NAME, 'w') as f:
-                    f.write(best_server_ip)
-                print(f"✅ IP address successfully written to **{OUTPUT_FILE_NAME}**")
-            except IOError as e:
-                print(f"❌ Failed to write IP to file {OUTPUT_FILE_NAME}: {e}")
-                
+                with telemetry.span("load_config"):
+                    load_config(CONFIG_FILE)
+                lock, exit_code = single_flight(telemetry)
+                if exit_code is not None:
+                    # Another run's result was reused, or it's still going.
+                    success = exit_code == 0
+                else:
+                    endpoint_cache = sync_endpoint_cache(endpoint_cache)
+
+                    if driver is not None:
+                        rss = process_tree_rss_bytes(driver.browser_pid)
+                        if rss is not None:
+                            telemetry.gauge("chrome_rss_bytes", rss, "Total RSS of the daemon's Chrome process tree.")
+                        if iterations >= DAEMON_RECYCLE_AFTER_ITERATIONS:
+                            print(f"Recycling browser after {iterations} iterations.")
+                            driver.quit()
+                            driver = None
+                        elif rss is not None and rss > DAEMON_MAX_RSS_MB * 1024 * 1024:
+                            print(f"Recycling browser: Chrome RSS {rss // (1024 * 1024)} MB "
+                                  f"exceeds {DAEMON_MAX_RSS_MB} MB.")
+                            driver.quit()
+                            driver = None
+
+                    warm = driver is not None
+                    if driver is None:
+                        with telemetry.span("start_driver"):
+                            driver = start_driver(download_dir, telemetry)
+                        iterations = 0
+                    count_webdriver_commands(driver, telemetry)
+
+                    with telemetry.span("login"):
+                        on_download_page = ensure_session(driver, check_existing=warm or bool(PERSISTENT_PROFILE_DIR))
+                    sample_chrome_rss(driver, telemetry)
+                    results = scrape_best_servers(driver, download_dir, on_download_page, endpoint_cache, telemetry)
+                    with telemetry.span("write_output"):
+                        success = write_outputs(results, telemetry.run_id)
+                    iterations += 1
+            except Exception as e:
+                report_error(e, driver)
+                if driver is not None and isinstance(e, WebDriverException):
+                    try:
+                        driver.quit()
+                    except Exception:
+                        pass
+                    driver = None
+            finally:
+                if lock:
+                    lock.release()
+
+            print(telemetry.summary())
+            telemetry.finish(success, METRICS_TRACE_FILE, METRICS_TEXTFILE_DIR)
+            elapsed = time.monotonic() - cycle_start
+            print(f"Scrape cycle took {elapsed:.1f}s; next in {max(0, DAEMON_INTERVAL_SECONDS - elapsed):.0f}s.")
+            time.sleep(max(0, DAEMON_INTERVAL_SECONDS - elapsed))
+    finally:
         if driver:
             print("Closing WebDriver.")
             driver.quit()
 
+def scrape_once(telemetry: RunTelemetry, download_dir: str) -> bool:
+    """One full run with the config already loaded: the browserless attempt
+    if HTTP_REFRESH is on, otherwise (or if that falls through) the browser,
+    then every profile's output. Returns whether all of it succeeded."""
+    driver = None
+    results = None
+    success = False
+    try:
+        endpoint_cache = sync_endpoint_cache(None)
+        history_stored = False
+        if HTTP_REFRESH:
+            # --- Browserless attempt ---
+            results, history_stored = refresh_over_http(endpoint_cache, telemetry)
+            telemetry.gauge("http_refresh", int(results is not None),
+                            "Whether the run was served without a browser.")
+
+        if results is None:
+            # --- Driver Setup ---
+            with telemetry.span("start_driver"):
+                driver = start_driver(download_dir, telemetry)
+            # Process start to a browser ready for its first URL: imports,
+            # config, finding Chrome and launching it - what the startup
+            # cache and the deferred imports above cut down.
+            first_navigation = time.monotonic() - STARTED_AT
+            telemetry.gauge("time_to_first_navigation_seconds", first_navigation,
+                            "Seconds from process start until the browser could navigate.")
+            print(f"Time to first navigation: {first_navigation:.2f}s.")
+            count_webdriver_commands(driver, telemetry)
+
+            # --- Login Flow ---
+            # With a persistent profile, a still-valid session lands straight on
+            # the download page; only a redirect to LOGIN_URL needs a full login.
+            with telemetry.span("login"):
+                on_download_page = ensure_session(driver, check_existing=bool(PERSISTENT_PROFILE_DIR))
+            sample_chrome_rss(driver, telemetry)
+
+            # --- Data Extraction, Processing and Result ---
+            results = scrape_best_servers(
+                driver, download_dir, on_download_page, endpoint_cache, telemetry,
+                store_history=not history_stored,
+            )
+            if HTTP_REFRESH:
+                export_session_cookies(driver)
+
+    except Exception as e:
+        report_error(e, driver)
+    finally:
+        # --- File Output and Cleanup ---
+        if results:
+            with telemetry.span("write_output"):
+                success = write_outputs(results, telemetry.run_id)
+
+        if driver:
+            print("Closing WebDriver.")
+            with telemetry.span("quit_driver"):
+                driver.quit()
+    return success
+
+def main(config: Optional[Dict[str, Any]] = None, daemon: bool = False, updates_pfsense: bool = False) -> int:
+    """Loads config.json (unless pipeline.py passes it in already parsed),
+    runs once - or forever with daemon - and exports the run's timings.
+    Either way each scrape holds the single-flight lock (see
+    single_flight); updates_pfsense (pipeline.py) records in it that this
+    run's result will be applied by the caller. Returns the exit code."""
+    success = False
+    exit_code = None
+    telemetry = RunTelemetry("scraper")
+    download_dir = tempfile.mkdtemp(prefix="protonvpn-ovpn-")
+    # Turn a plain `kill` into SystemExit so the finally blocks below still
+    # quit Chrome and clean up download_dir.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        # 1. Load Configuration
+        with telemetry.span("load_config"):
+            if config is None:
+                print(f"Loading configuration from {CONFIG_FILE}...")
+                load_config(CONFIG_FILE)
+            else:
+                apply_config(config)
+
+        if daemon:
+            # Only ever returns by way of SIGTERM / Ctrl-C.
+            run_daemon(download_dir)
+
+        lock, exit_code = single_flight(telemetry, updates_pfsense)
+        if exit_code is None:
+            try:
+                success = scrape_once(telemetry, download_dir)
+            finally:
+                if lock:
+                    lock.release()
+        else:
+            success = exit_code == 0
+    except Exception as e:
+        report_error(e, None)
+    finally:
+        print(telemetry.summary())
+        telemetry.finish(success, METRICS_TRACE_FILE, METRICS_TEXTFILE_DIR)
+
         # The downloaded .ovpn file contains Proton's shared CA cert/tls-crypt
         # key (not per-user secrets, but no reason to leave it on disk).
         shutil.rmtree(download_dir, ignore_errors=True)
 
     # A caller chaining `scrape-ng-v2.py && update_pfsense.py` must be able to tell a
     # failed run apart from a successful one - otherwise a failure here silently falls
-    # through to update_pfsense.py reusing the previous run's stale IP.
-    sys.exit(0 if best_server_ip else 1)
\ No newline at end of file
+    # through to update_pfsense.py reusing the previous run's stale IP. An
+    # overlapping run that gave up waiting says so with its own status.
+    if exit_code is not None:
+        return exit_code
+    return 0 if success else 1
+
+# --- MAIN EXECUTION ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the lowest-utilization ProtonVPN server and write its IP to OUTPUT_FILE.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep one browser alive and re-scrape every DAEMON_INTERVAL_SECONDS instead of running once")
+    args = parser.parse_args()
+    exit_code = main(daemon=args.daemon)
+    sys.exit(EXIT_REUSED_RESULT if exit_code == 0 and reused_in_flight_result else exit_code)
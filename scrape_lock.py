@@ -0,0 +1,129 @@
+"""Single-flight lock around a scrape, so overlapping runs don't each start
+a Chrome.
+
+A slow run (Proton's pages lagging, a long login) can still be going when
+the next cron tick, pipeline.py or monitor.py starts another. Two browsers
+then compete for memory, log in with the same TOTP code and race on
+OUTPUT_FILE. The first run takes the lock instead, and scrape-ng-v2.py
+decides what a second one does: wait and reuse its result, or exit.
+
+The lock is a file holding its owner's pid, the process's start time (from
+/proc, so a recycled pid isn't taken for the owner), host, when it was
+taken and whether the owner goes on to update pfSense itself (pipeline.py
+does; --daemon and a bare scraper run don't), so a run reusing its result
+knows whether that's left to it. It appears whole via a hard link to a temp file, never half-written.
+A lock whose owner has died - crashed, killed, the box rebooted - is
+stale, and the next run to find it breaks it. A lock taken on another host
+(a lock file on a shared directory) can't be checked and is always taken
+as live. Stdlib only, like handoff.py.
+"""
+import json
+import os
+import socket
+import time
+from typing import Any, Dict, Optional
+
+
+def process_start_time(pid: int) -> Optional[str]:
+    """pid's start time in clock ticks since boot (field 22 of
+    /proc/<pid>/stat), or None where there's no /proc or no such pid."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name (field 2) is in parentheses and may itself contain
+    # spaces or parentheses, so count fields from the last ")".
+    return stat.rsplit(")", 1)[1].split()[19]
+
+
+def owner_is_alive(owner: Dict[str, Any]) -> bool:
+    """Whether the process that wrote owner (a lock file's contents) is
+    still running."""
+    if owner.get("host") != socket.gethostname():
+        return True
+    pid = owner.get("pid")
+    if not isinstance(pid, int) or pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Alive, just not ours to signal.
+    recorded = owner.get("proc_start")
+    return recorded is None or process_start_time(pid) in (None, recorded)
+
+
+class ScrapeLock:
+    def __init__(self, path: str, updates_pfsense: bool = False):
+        self.path = path
+        self.updates_pfsense = updates_pfsense
+        self.held = False
+
+    def _read(self, path: str) -> Optional[Dict[str, Any]]:
+        """The lock file's contents; {} if it's there but unreadable, None
+        if it's gone."""
+        try:
+            with open(path, "r") as f:
+                owner = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            return {}
+        return owner if isinstance(owner, dict) else {}
+
+    def acquire(self) -> Optional[Dict[str, Any]]:
+        """Takes the lock if it's free (or stale, which is broken first).
+        Returns None once it's held, otherwise the live owner's record:
+        pid, host, started_at and updates_pfsense."""
+        me = {"pid": os.getpid(), "proc_start": process_start_time(os.getpid()),
+              "host": socket.gethostname(), "started_at": time.time(), "updates_pfsense": self.updates_pfsense}
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(me, f)
+        try:
+            for _ in range(3):
+                try:
+                    os.link(tmp_path, self.path)
+                except FileExistsError:
+                    owner = self._read(self.path)
+                    if owner is None:
+                        continue  # Released meanwhile; try again.
+                    if owner and owner_is_alive(owner):
+                        return owner
+                    self._break(owner)
+                    continue
+                self.held = True
+                return None
+            return self._read(self.path) or {}
+        finally:
+            os.remove(tmp_path)
+
+    def _break(self, stale: Dict[str, Any]) -> None:
+        """Removes a stale lock. It's renamed aside first, which only one of
+        several runs breaking it at once can do; if what got renamed turns
+        out not to be the stale lock read a moment ago (another run had
+        already replaced it), it's put back."""
+        aside = f"{self.path}.{os.getpid()}.stale"
+        try:
+            os.rename(self.path, aside)
+        except FileNotFoundError:
+            return
+        if self._read(aside) != stale:
+            try:
+                os.link(aside, self.path)
+            except FileExistsError:
+                pass
+        else:
+            print(f"Removed stale scrape lock {self.path} (pid {stale.get('pid')} is gone).")
+        os.remove(aside)
+
+    def release(self) -> None:
+        """Removes the lock, if this process holds it."""
+        if not self.held:
+            return
+        self.held = False
+        owner = self._read(self.path)
+        if owner and owner.get("pid") == os.getpid() and owner.get("host") == socket.gethostname():
+            os.remove(self.path)
@@ -0,0 +1,96 @@
+"""On-disk cache of what scrape-ng-v2.py works out before Chrome can start.
+
+A cold start used to run `<browser> --version` for up to four browser
+names until one answered, and let undetected_chromedriver download a fresh
+chromedriver, patch it, and delete it again when the run ended. Neither
+changes until the browser itself does, so both are cached here, keyed on
+the Chrome binary found on PATH - its path, mtime and size, so an apt
+upgrade (which replaces the file) rebuilds the entry:
+
+- major_version: the installed Chrome's major version, as
+  detect_chrome_major_version() reported it.
+- driver_path: a copy of the patched chromedriver, kept beside the cache
+  file. undetected_chromedriver uses a driver it's given as-is (it only
+  patches one that isn't patched yet) and never deletes it.
+
+Stdlib only, like endpoint_cache.py, so reading it costs the scraper
+nothing before the browser is actually needed.
+"""
+import json
+import os
+import shutil
+from typing import Any, Dict, Optional
+
+# The names detect_chrome_major_version() tries, in order.
+CHROME_BINARIES = ("google-chrome-stable", "google-chrome", "chromium-browser", "chromium")
+
+
+def find_chrome_binary() -> Optional[str]:
+    """The first of CHROME_BINARIES on PATH, without running it."""
+    for name in CHROME_BINARIES:
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+
+def binary_key(chrome_binary: str) -> Dict[str, Any]:
+    """What identifies one install of chrome_binary (stat follows the
+    /usr/bin symlink to the real file)."""
+    st = os.stat(chrome_binary)
+    return {"binary": chrome_binary, "mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+
+class StartupCache:
+    def __init__(self, path: str):
+        self.path = path
+        # The patched driver lives next to the cache file, one per cache.
+        self.driver_path = os.path.splitext(os.path.abspath(path))[0] + ".chromedriver"
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def lookup(self, chrome_binary: str) -> Optional[Dict[str, Any]]:
+        """The cached entry for chrome_binary as it is installed right now,
+        or None if there's none or Chrome has changed since. driver_path is
+        dropped from the entry if that file has gone missing."""
+        try:
+            key = binary_key(chrome_binary)
+        except OSError:
+            return None
+        entry = self._load()
+        if not entry.get("major_version") or any(entry.get(k) != v for k, v in key.items()):
+            return None
+        if entry.get("driver_path") and not os.access(entry["driver_path"], os.X_OK):
+            entry.pop("driver_path")
+        return entry
+
+    def store(self, chrome_binary: str, major_version: int, driver_path: Optional[str] = None) -> None:
+        """Records chrome_binary's major version and, if given, keeps a copy
+        of the patched driver at driver_path. Both files are replaced
+        atomically, so another run starting meanwhile sees the old entry or
+        the new one, never half of either."""
+        entry = {**binary_key(chrome_binary), "major_version": major_version}
+        if driver_path:
+            if os.path.abspath(driver_path) != self.driver_path:
+                tmp_driver = f"{self.driver_path}.{os.getpid()}.tmp"
+                shutil.copy2(driver_path, tmp_driver)
+                os.replace(tmp_driver, self.driver_path)
+            entry["driver_path"] = self.driver_path
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def invalidate(self) -> None:
+        """Forgets the entry, e.g. when the cached driver failed to start
+        Chrome; the next launch detects and patches from scratch."""
+        for path in (self.path, self.driver_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,227 @@
+"""Per-run timing spans and call counters, exported for monitoring.
+
+Both scrape-ng-v2.py and update_pfsense.py wrap each phase of a run (Chrome
+startup, login, table read, download, the pfSense lookups/PATCH/apply/
+restart and the waits in between) in a named span, and count every
+WebDriver command / pfSense API call with its latency. At the end of the run
+finish() writes it all out in two forms:
+
+- METRICS_TRACE_FILE: one JSON line per span, then one per-run summary line
+  (total time, success, per-call counts and latencies, gauges), all tagged
+  with the run's id. Both scripts append to the same file; "job" tells
+  their lines apart.
+- METRICS_TEXTFILE_DIR: protonvpn_<job>.prom in Prometheus' text format,
+  for node_exporter's textfile collector (--collector.textfile.directory).
+  It's a snapshot of the last run: phase durations, run duration, success,
+  and the last *successful* run's timestamp, carried over from the previous
+  file when a run fails, so "no success in N hours" can be alerted on.
+
+Either is skipped when its setting is empty. Nothing is written until
+finish(), so a span can be opened before config.json (and these settings)
+has even been loaded.
+"""
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    # Full precision: %g would round a Unix timestamp to the nearest ~100s.
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class RunTelemetry:
+    """Spans and counters for one run of job ("scraper" or "updater"). Safe
+    to use from several threads at once (update_pfsense.py's per-firewall
+    workers)."""
+
+    def __init__(self, job: str):
+        self.job = job
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.spans: List[Dict[str, Any]] = []
+        # (kind, name) -> [count, total_seconds, max_seconds]
+        self.calls: Dict[Tuple[str, str], List[float]] = {}
+        self.gauges: Dict[Tuple[str, Labels], float] = {}
+        self.gauge_help: Dict[str, str] = {}
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        """Times the with-block as phase `name`. An exception marks the span
+        failed (with the error's type) and propagates unchanged."""
+        start_wall, start = time.time(), time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            with self.lock:
+                self.spans.append({
+                    "name": name,
+                    "labels": dict(_labels(labels)),
+                    "start": round(start_wall, 3),
+                    "seconds": time.perf_counter() - start,
+                    "ok": error is None,
+                    **({"error": error} if error else {}),
+                })
+
+    def observe(self, kind: str, name: str, seconds: float) -> None:
+        """Counts one call (a WebDriver command, an API request) that took
+        seconds."""
+        with self.lock:
+            entry = self.calls.setdefault((kind, name), [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def gauge(self, name: str, value: float, help_text: str = "", **labels) -> None:
+        """Records a value to export as-is, e.g. the chosen server's
+        utilization. help_text becomes the Prometheus HELP line."""
+        with self.lock:
+            self.gauges[(name, _labels(labels))] = value
+            if help_text:
+                self.gauge_help[name] = help_text
+
+    def gauge_max(self, name: str, value: float, help_text: str = "", **labels) -> None:
+        """Like gauge(), but only ever raises the recorded value - for peaks
+        sampled several times over a run."""
+        with self.lock:
+            key = (name, _labels(labels))
+            if value > self.gauges.get(key, float("-inf")):
+                self.gauges[key] = value
+            if help_text:
+                self.gauge_help[name] = help_text
+
+    def phase_totals(self) -> Dict[Tuple[str, Labels], float]:
+        """Seconds per (phase, labels), summed over repeated spans (e.g. one
+        download per latency-probe candidate), in first-seen order."""
+        totals: Dict[Tuple[str, Labels], float] = {}
+        for span in self.spans:
+            key = (span["name"], _labels(span["labels"]))
+            totals[key] = totals.get(key, 0.0) + span["seconds"]
+        return totals
+
+    def summary(self) -> str:
+        """One human-readable line of phase timings, for the run's own log."""
+        parts = []
+        for (name, labels), seconds in self.phase_totals().items():
+            suffix = f"[{','.join(value for _, value in labels)}]" if labels else ""
+            parts.append(f"{name}{suffix} {seconds:.2f}s")
+        counts: Dict[str, int] = {}
+        for (kind, _), (count, _, _) in self.calls.items():
+            counts[kind] = counts.get(kind, 0) + int(count)
+        line = f"Timings: {', '.join(parts) or 'no phases'}; total {time.perf_counter() - self._start:.2f}s"
+        if counts:
+            line += " (" + ", ".join(f"{count} {kind} calls" for kind, count in sorted(counts.items())) + ")"
+        return line
+
+    def finish(self, success: bool, trace_file: str = "", textfile_dir: str = "") -> None:
+        """Writes the trace lines and/or the Prometheus textfile. Export
+        failures are reported but never fail the run itself."""
+        duration = time.perf_counter() - self._start
+        try:
+            if trace_file:
+                self._write_trace(trace_file, success, duration)
+            if textfile_dir:
+                self._write_textfile(textfile_dir, success, duration)
+        except OSError as e:
+            print(f"Warning: could not write {self.job} metrics: {e}")
+
+    def _write_trace(self, path: str, success: bool, duration: float) -> None:
+        common = {"run_id": self.run_id, "job": self.job}
+        lines = [json.dumps({**common, "type": "span", **span}) for span in self.spans]
+        lines.append(json.dumps({
+            **common,
+            "type": "run",
+            "start": round(self.started_at, 3),
+            "seconds": duration,
+            "ok": success,
+            "calls": [
+                {"kind": kind, "name": name, "count": int(count), "seconds": total, "max_seconds": longest}
+                for (kind, name), (count, total, longest) in sorted(self.calls.items())
+            ],
+            "gauges": [{"name": name, "labels": dict(labels), "value": value}
+                       for (name, labels), value in self.gauges.items()],
+        }))
+        # One write of whole lines in append mode, so the two scripts can
+        # share a trace file without interleaving mid-line.
+        with open(path, "a") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def _previous_success_timestamp(self, path: str, metric: str) -> Optional[float]:
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    match = re.match(rf"^{metric} (\S+)$", line.strip())
+                    if match:
+                        return float(match.group(1))
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def _write_textfile(self, directory: str, success: bool, duration: float) -> None:
+        prefix = f"protonvpn_{self.job}"
+        path = os.path.join(directory, f"{prefix}.prom")
+        last_success = time.time() if success else self._previous_success_timestamp(
+            path, f"{prefix}_last_success_timestamp_seconds")
+
+        out: List[str] = []
+
+        def metric(name: str, help_text: str, samples: List[Tuple[Labels, float]]) -> None:
+            if not samples:
+                return
+            out.append(f"# HELP {prefix}_{name} {help_text}")
+            out.append(f"# TYPE {prefix}_{name} gauge")
+            out.extend(f"{prefix}_{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples)
+
+        metric("last_run_success", "Whether the last run succeeded (1) or failed (0).", [((), int(success))])
+        metric("last_run_timestamp_seconds", "Unix time the last run finished.", [((), time.time())])
+        if last_success is not None:
+            metric("last_success_timestamp_seconds", "Unix time of the last successful run.", [((), last_success)])
+        metric("run_duration_seconds", "Wall time of the last run.", [((), duration)])
+        metric("phase_duration_seconds", "Wall time of each phase of the last run.", [
+            ((("phase", name),) + labels, seconds) for (name, labels), seconds in self.phase_totals().items()
+        ])
+        calls = sorted(self.calls.items())
+        metric("calls", "Calls made during the last run, by kind and name.", [
+            ((("kind", kind), ("name", name)), count) for (kind, name), (count, _, _) in calls
+        ])
+        metric("call_duration_seconds", "Total latency of those calls.", [
+            ((("kind", kind), ("name", name)), total) for (kind, name), (_, total, _) in calls
+        ])
+        for gauge_name in sorted({name for name, _ in self.gauges}):
+            metric(gauge_name, self.gauge_help.get(gauge_name, f"{gauge_name} (last run)."), [
+                (labels, value) for (name, labels), value in self.gauges.items() if name == gauge_name
+            ])
+
+        # node_exporter may read the file at any moment: write it whole
+        # under a temp name and swap it in.
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(out) + "\n")
+        os.replace(tmp_path, path)
@@ -0,0 +1,159 @@
+"""http_scrape.py against a saved downloads page and logicals response
+(tests/fixtures), and fetch()'s handling of an expired session against a
+local server."""
+import json
+import os
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import requests  # noqa: E402
+
+from http_scrape import HttpScrapeError, SessionExpired, fetch, parse_logicals, parse_server_table  # noqa: E402
+
+FIXTURES_DIR = os.path.join(TESTS_DIR, "fixtures")
+# config.example.json's P2P_ICON_SELECTOR.
+P2P_ICON_SELECTOR = "span.mx-2"
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+class ParseServerTableTest(unittest.TestCase):
+    def setUp(self):
+        self.html = read_fixture("downloads_page.html")
+
+    def test_rows_of_the_matching_country(self):
+        self.assertEqual(parse_server_table(self.html, "United States", P2P_ICON_SELECTOR), [
+            ("US-MA#412", "23%", True),
+            ("US-NY#97", "8%", False),
+            ("US-CA#203", "61%", True),
+            ("US-TX#58", "100%", False),
+            ("US-FREE#34", "45%", False),
+        ])
+
+    def test_selects_the_country_section_by_its_summary(self):
+        self.assertEqual(parse_server_table(self.html, "Canada", P2P_ICON_SELECTOR), [("CA#12", "17%", True)])
+        self.assertEqual(parse_server_table(self.html, "Germany", P2P_ICON_SELECTOR), [("DE#301", "34%", True)])
+
+    def test_p2p_flag_follows_the_selector(self):
+        rows = parse_server_table(self.html, "United States", "span.mx-1")
+        self.assertEqual([p2p for _, _, p2p in rows], [False, True, True, False, True])
+
+    def test_missing_country_section(self):
+        with self.assertRaisesRegex(HttpScrapeError, "no server section"):
+            parse_server_table(self.html, "Japan", P2P_ICON_SELECTOR)
+
+    def test_selector_too_complex_for_the_html_path(self):
+        with self.assertRaisesRegex(HttpScrapeError, "too complex"):
+            parse_server_table(self.html, "United States", "td > span[title=P2P]")
+
+
+class ParseLogicalsTest(unittest.TestCase):
+    def setUp(self):
+        self.data = json.loads(read_fixture("logicals.json"))
+
+    def test_online_servers_exiting_in_the_country(self):
+        # US-TX#58 is offline (Status 0); CH-US#1 enters in CH but exits in
+        # the US, so it's listed; CA#12 exits elsewhere.
+        self.assertEqual(parse_logicals(self.data, "US"), [
+            ("US-MA#412", "23%", True),
+            ("US-NY#97", "8%", False),
+            ("US-CA#203", "61%", True),
+            ("CH-US#1", "12%", False),
+        ])
+
+    def test_no_servers_for_the_country(self):
+        with self.assertRaisesRegex(HttpScrapeError, "no online JP servers"):
+            parse_logicals(self.data, "JP")
+
+    def test_not_a_server_list(self):
+        with self.assertRaisesRegex(HttpScrapeError, "no LogicalServers"):
+            parse_logicals({"Code": 10013, "Error": "Invalid access token"}, "US")
+
+
+class FetchTest(unittest.TestCase):
+    """fetch() against a local server: /downloads serves the saved page with
+    the session cookie and redirects to /login without it; /expired and
+    /forbidden answer 401 and 403, /broken 500."""
+
+    @classmethod
+    def setUpClass(cls):
+        page = read_fixture("downloads_page.html").encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: bytes = b"", extra=()):
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html")
+                self.send_header("Content-Length", str(len(body)))
+                for header, value in extra:
+                    self.send_header(header, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/downloads":
+                    if "Session-Id=live" in (self.headers.get("Cookie") or ""):
+                        self._send(200, page)
+                    else:
+                        self._send(302, extra=[("Location", "/login?redirect=%2Fdownloads")])
+                elif self.path.startswith("/login"):
+                    self._send(200, b"<!doctype html><title>Sign in</title>")
+                elif self.path == "/expired":
+                    self._send(401)
+                elif self.path == "/forbidden":
+                    self._send(403)
+                else:
+                    self._send(500)
+
+        cls.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        cls.base_url = f"http://127.0.0.1:{cls.httpd.server_address[1]}"
+        threading.Thread(target=cls.httpd.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def setUp(self):
+        self.session = requests.Session()
+        self.login_url = f"{self.base_url}/login"
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_live_session(self):
+        self.session.cookies.set("Session-Id", "live")
+        response = fetch(self.session, f"{self.base_url}/downloads", self.login_url, 5)
+        self.assertEqual(parse_server_table(response.text, "United States", P2P_ICON_SELECTOR)[0],
+                         ("US-MA#412", "23%", True))
+
+    def test_redirect_to_login(self):
+        with self.assertRaisesRegex(SessionExpired, "redirected to the login page"):
+            fetch(self.session, f"{self.base_url}/downloads", self.login_url, 5)
+
+    def test_refused(self):
+        for path in ("/expired", "/forbidden"):
+            with self.subTest(path=path), self.assertRaises(SessionExpired):
+                fetch(self.session, f"{self.base_url}{path}", self.login_url, 5)
+
+    def test_other_errors_are_not_an_expired_session(self):
+        with self.assertRaisesRegex(HttpScrapeError, "HTTP 500"):
+            fetch(self.session, f"{self.base_url}/broken", self.login_url, 5)
+
+    def test_unreachable(self):
+        with self.assertRaisesRegex(HttpScrapeError, "failed"):
+            fetch(self.session, "http://127.0.0.1:9/downloads", self.login_url, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+"""monitor.Monitor against bench/fake_pfsense.py: the breach window, the
+re-selection rate limit, skipped samples and per-target unhealthy flags.
+Time is a fake clock the tests move, so no test waits out a window."""
+import os
+import sys
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "bench"))
+sys.path.insert(0, REPO_DIR)
+
+import fake_pfsense  # noqa: E402
+import monitor  # noqa: E402
+import update_pfsense  # noqa: E402
+
+HEALTHY_IP = "203.0.113.1"
+DEGRADED_IP = "203.0.113.2"
+
+
+class MonitorTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.work_dir.cleanup)
+        self.now = 0.0
+        clock = SimpleNamespace(monotonic=lambda: self.now, time=time.time)
+        patcher = mock.patch.object(monitor, "time", clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.reselects = 0
+
+    def start_fake(self, current_ip: str) -> fake_pfsense.FakePfSense:
+        fake = fake_pfsense.FakePfSense(overrides=5, current_ip=current_ip, degraded_ips=(DEGRADED_IP,))
+        fake.__enter__()
+        self.addCleanup(fake.__exit__, None, None, None)
+        return fake
+
+    def config(self, **overrides) -> dict:
+        config = {
+            "NAME": "fw",
+            "PFSENSE_API_KEY": fake_pfsense.API_KEY,
+            "PFSENSE_RETRIES": 0,
+            "DNS_HOST": fake_pfsense.DNS_HOST,
+            "DNS_DOMAIN": fake_pfsense.DNS_DOMAIN,
+            "OPENVPN_VPNID": fake_pfsense.OPENVPN_VPNID,
+            "APPLIED_STATE_FILE": os.path.join(self.work_dir.name, "applied.json"),
+            "LOG_FILE": os.path.join(self.work_dir.name, "monitor.log"),
+            "MONITOR_GATEWAY": fake_pfsense.GATEWAY_NAME,
+            "MONITOR_BREACH_WINDOW_SECONDS": 300,
+            "MONITOR_MIN_RESELECT_INTERVAL_SECONDS": 1800,
+            **overrides,
+        }
+        monitor.apply_settings(config)
+        for target in update_pfsense.firewall_targets(config):
+            update_pfsense.save_json_file(target["APPLIED_STATE_FILE"], {
+                "server": "US-NY#9", "ip": HEALTHY_IP, "utilization": 41,
+                "applied_at": time.time(),
+            })
+        return config
+
+    def reselect(self) -> int:
+        self.reselects += 1
+        return 0
+
+    def check_at(self, watcher: monitor.Monitor, config: dict, now: float) -> bool:
+        self.now = now
+        return watcher.check(config)
+
+    def test_no_reselect_before_the_breach_window(self):
+        config = self.config(PFSENSE_BASE_URL=self.start_fake(DEGRADED_IP).base_url)
+        watcher = monitor.Monitor(reselect=self.reselect)
+
+        self.assertFalse(self.check_at(watcher, config, 1000))
+        self.assertFalse(self.check_at(watcher, config, 1299))
+        self.assertEqual(self.reselects, 0)
+        self.assertNotIn("unhealthy_at", update_pfsense.load_json_file(config["APPLIED_STATE_FILE"]))
+
+        self.assertTrue(self.check_at(watcher, config, 1300))
+        self.assertEqual(self.reselects, 1)
+
+    def test_healthy_sample_restarts_the_window(self):
+        fake = self.start_fake(DEGRADED_IP)
+        config = self.config(PFSENSE_BASE_URL=fake.base_url)
+        watcher = monitor.Monitor(reselect=self.reselect)
+
+        self.assertFalse(self.check_at(watcher, config, 1000))
+        fake.degraded_ips.clear()
+        self.assertFalse(self.check_at(watcher, config, 1200))
+        fake.degraded_ips.add(DEGRADED_IP)
+        self.assertFalse(self.check_at(watcher, config, 1400))
+        self.assertEqual(self.reselects, 0)
+        self.assertTrue(self.check_at(watcher, config, 1700))
+
+    def test_reselect_is_rate_limited(self):
+        config = self.config(PFSENSE_BASE_URL=self.start_fake(DEGRADED_IP).base_url,
+                             MONITOR_BREACH_WINDOW_SECONDS=0)
+        watcher = monitor.Monitor(reselect=self.reselect)
+
+        self.assertTrue(self.check_at(watcher, config, 1000))
+        self.assertFalse(self.check_at(watcher, config, 1100))
+        self.assertFalse(self.check_at(watcher, config, 2799))
+        self.assertEqual(self.reselects, 1)
+        self.assertTrue(self.check_at(watcher, config, 2800))
+        self.assertEqual(self.reselects, 2)
+
+    def test_unreachable_api_is_skipped_not_a_breach(self):
+        fake = self.start_fake(DEGRADED_IP)
+        config = self.config(PFSENSE_BASE_URL=fake.base_url)
+        # Nothing listens on the discard port.
+        unreachable = {**config, "PFSENSE_BASE_URL": "http://127.0.0.1:9"}
+        watcher = monitor.Monitor(reselect=self.reselect)
+
+        self.assertFalse(self.check_at(watcher, unreachable, 1000))
+        self.assertEqual(watcher.breach_since, {})
+
+        self.assertFalse(self.check_at(watcher, config, 1100))
+        self.assertFalse(self.check_at(watcher, unreachable, 1500))
+        self.assertEqual(self.reselects, 0)
+        self.assertNotIn("unhealthy_at", update_pfsense.load_json_file(config["APPLIED_STATE_FILE"]))
+        # The skipped sample neither ended nor extended the breach.
+        self.assertEqual(watcher.breach_since, {"fw": 1100})
+        self.assertTrue(self.check_at(watcher, config, 1600))
+
+    def test_only_the_breaching_target_is_marked_unhealthy(self):
+        breaching, healthy = self.start_fake(DEGRADED_IP), self.start_fake(HEALTHY_IP)
+        config = self.config(MONITOR_BREACH_WINDOW_SECONDS=0, FIREWALLS=[
+            {"NAME": "fw-a", "PFSENSE_BASE_URL": breaching.base_url},
+            {"NAME": "fw-b", "PFSENSE_BASE_URL": healthy.base_url},
+        ])
+        watcher = monitor.Monitor(reselect=self.reselect)
+
+        self.assertTrue(self.check_at(watcher, config, 1000))
+        applied = {target["NAME"]: update_pfsense.load_json_file(target["APPLIED_STATE_FILE"])
+                   for target in update_pfsense.firewall_targets(config)}
+        self.assertIn("unhealthy_at", applied["fw-a"])
+        self.assertIn("RTT", applied["fw-a"]["unhealthy_reason"])
+        self.assertNotIn("unhealthy_at", applied["fw-b"])
+        self.assertFalse(os.path.exists(config["APPLIED_STATE_FILE"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
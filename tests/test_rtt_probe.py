@@ -0,0 +1,142 @@
+"""rtt_probe.py against local listeners, with each endpoint's delay
+injected through probe_all()'s probe, and scrape-ng-v2.py's
+choose_by_latency() on top of it."""
+import asyncio
+import contextlib
+import importlib.util
+import io
+import os
+import socket
+import sys
+import time
+import unittest
+from unittest import mock
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import rtt_probe  # noqa: E402
+from rtt_probe import probe_all, tcp_connect  # noqa: E402
+
+
+def load_scraper():
+    """Imports scrape-ng-v2.py (whose name isn't a valid module name)."""
+    spec = importlib.util.spec_from_file_location("scrape_ng_v2", os.path.join(REPO_DIR, "scrape-ng-v2.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def delayed_probe(delays):
+    """A probe that waits delays[port] seconds (default none) before its
+    real TCP connect: the kernel answers a localhost handshake at once, so
+    a listener can't be slowed down any other way."""
+    async def probe(host: str, port: int) -> bool:
+        await asyncio.sleep(delays.get(port, 0))
+        return await tcp_connect(host, port)
+    return probe
+
+
+async def unanswered(host: str, port: int) -> bool:
+    await asyncio.sleep(60)
+    return True
+
+
+class ProbeAllTest(unittest.TestCase):
+    def setUp(self):
+        self.listeners = []
+        for _ in range(3):
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.bind(("127.0.0.1", 0))
+            listener.listen(16)
+            self.addCleanup(listener.close)
+            self.listeners.append(listener)
+        self.ports = [listener.getsockname()[1] for listener in self.listeners]
+        self.endpoints = [("127.0.0.1", port) for port in self.ports]
+
+    def test_ranks_by_injected_delay(self):
+        fast, slow, medium = self.ports
+        rtts = asyncio.run(probe_all(self.endpoints, 5, attempts=2,
+                                     probe=delayed_probe({fast: 0.01, slow: 0.2, medium: 0.08})))
+        ranked = sorted(rtts, key=rtts.get)
+        self.assertEqual([port for _, port in ranked], [fast, medium, slow])
+        self.assertGreaterEqual(rtts[("127.0.0.1", slow)], 200)
+        self.assertLess(rtts[("127.0.0.1", fast)], 80)
+
+    def test_best_of_the_attempts(self):
+        port = self.ports[0]
+        delays = iter([0.15, 0.02, 0.1])
+
+        async def probe(host: str, port: int) -> bool:
+            await asyncio.sleep(next(delays))
+            return await tcp_connect(host, port)
+
+        rtts = asyncio.run(probe_all(self.endpoints[:1], 5, attempts=3, probe=probe))
+        self.assertLess(rtts[("127.0.0.1", port)], 100)
+
+    def test_deadline_drops_slow_endpoints(self):
+        fast, slow, _ = self.ports
+        start = time.monotonic()
+        rtts = asyncio.run(probe_all(self.endpoints[:2], 0.3, probe=delayed_probe({fast: 0.01, slow: 5})))
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertIsNotNone(rtts[("127.0.0.1", fast)])
+        self.assertIsNone(rtts[("127.0.0.1", slow)])
+
+    def test_refused_connection_is_a_sample(self):
+        closed = self.listeners.pop()
+        closed.close()
+        rtts = asyncio.run(probe_all([("127.0.0.1", self.ports[2])], 5))
+        self.assertIsNotNone(rtts[("127.0.0.1", self.ports[2])])
+
+    def test_unreachable_endpoint_has_no_rtt(self):
+        async def unreachable(host: str, port: int) -> bool:
+            return False
+
+        rtts = asyncio.run(probe_all(self.endpoints, 5, attempts=3, probe=unreachable))
+        self.assertEqual(set(rtts.values()), {None})
+
+
+class ChooseByLatencyTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.scraper = load_scraper()
+
+    def setUp(self):
+        self.scraper.RTT_PROBE_PORT = 443
+        self.scraper.RTT_PROBE_ATTEMPTS = 1
+        self.scraper.RTT_PROBE_DEADLINE_SECONDS = 0.3
+        self.scraper.SCORE_LOAD_WEIGHT = 1.0
+        self.scraper.SCORE_RTT_WEIGHT = 0.5
+        # (utilization, server_name, remotes), lowest utilization first.
+        self.candidates = [
+            (20, "US-NY#1", [("192.0.2.1", 1194, "udp")]),
+            (25, "US-CA#2", [("192.0.2.2", 1194, "udp")]),
+            (30, "US-TX#3", [("192.0.2.3", 1194, "udp")]),
+        ]
+
+    def choose(self, probe):
+        def probe_rtts(endpoints, deadline_seconds, attempts=1):
+            return asyncio.run(probe_all(endpoints, deadline_seconds, attempts, probe=probe))
+
+        with mock.patch.object(rtt_probe, "probe_rtts", probe_rtts), contextlib.redirect_stdout(io.StringIO()):
+            return self.scraper.choose_by_latency(self.candidates)
+
+    def test_best_weighted_score_wins(self):
+        # Scores: NY 20 + 0.5 * ~150, CA 25 + 0.5 * ~10, TX never answers.
+        delays = {"192.0.2.1": 0.15, "192.0.2.2": 0.01, "192.0.2.3": 5}
+
+        async def probe(host: str, port: int) -> bool:
+            await asyncio.sleep(delays[host])
+            return True
+
+        self.assertEqual(self.choose(probe), ("US-CA#2", 25, self.candidates[1][2]))
+
+    def test_falls_back_to_lowest_utilization_when_nothing_answers(self):
+        start = time.monotonic()
+        self.assertEqual(self.choose(unanswered), ("US-NY#1", 20, self.candidates[0][2]))
+        self.assertLess(time.monotonic() - start, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
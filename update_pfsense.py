@@ -7,28 +7,73 @@ anywhere that can reach pfSense's web UI - it does not need to run on the
 firewall itself.
 
 Steps, all via the API:
-  1. Read the winning IP from OUTPUT_FILE (written by scrape-ng-v2.py).
+  1. Read the winning IP from OUTPUT_FILE (written by scrape-ng-v2.py; one
+     per selection profile, see profiles.py).
   2. Look up the existing DNS Resolver host override for DNS_HOST.DNS_DOMAIN
      to get its real id (never assume it's 0 - it shifts if overrides are
-     added/removed/reordered in the UI).
+     added/removed/reordered in the UI). The id is cached between runs and
+     re-checked with a single-object GET; the full list is only fetched
+     when that check fails.
   3. PATCH that host override with the new IP.
   4. POST /services/dns_resolver/apply to activate the change.
   5. Look up the running OpenVPN client matching OPENVPN_VPNID to get the
-     Service model's id (a positional index, distinct from vpnid).
+     Service model's id (a positional index, distinct from vpnid). This
+     runs concurrently with step 2.
   6. POST /status/service with action=restart for that service.
 
+Between steps 4 and 6, and after 6, the script polls for readiness (the
+resolver serving the new IP, then the OpenVPN client reporting up) instead
+of sleeping a fixed time; see READINESS_POLLING.
+
+Before step 3, the live override value from step 2 is compared against the
+new winner (see should_switch): if the gain is marginal, nothing is changed
+and the tunnel is left alone. If the tunnel doesn't come up on the winner,
+steps 3-6 are repeated for the next endpoint in the scraper's ranked
+candidate list (SELECTION_FILE's "candidates").
+
+With STANDBY_OPENVPN_VPNID set, each switch is make-before-break instead:
+steps 2-6 run against whichever of the two OpenVPN clients is idle (each
+has its own host override, DNS_HOST / STANDBY_DNS_HOST), and only once it
+reports up does GATEWAY_GROUP's tier order flip to carry traffic over it.
+The client that was active is never restarted; it stays connected as the
+standby. See apply_update_make_before_break.
+
+With OPENVPN_ENDPOINT_MODE "direct", steps 2-4 and the DNS wait are
+replaced by one PATCH of the OpenVPN client's own server_addr/server_port
+(the entry IP and port from the .ovpn remote line), which the API applies
+by restarting the client, so step 6 is just the wait for it to come up. No
+resolver apply means no unbound reload for every LAN client. The host
+override can still be updated afterwards as a record (see
+DIRECT_UPDATE_HOST_OVERRIDE). See apply_update_direct.
+
+All calls share one keep-alive session (see PfSenseClient).
+
 Every step checks the HTTP status and the API's own "status" field before
 moving on - unlike the old script, a failed DNS update will NOT be followed
 by a pointless OpenVPN restart.
 """
+import argparse
 import json
 import os
+import random
+import socket
+import struct
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from endpoint_cache import EndpointCache
+from handoff import POLL_INTERVAL_SECONDS, HandoffWatcher
+from profiles import expand_targets
+from telemetry import RunTelemetry
 
 # CONFIG_FILE can't itself live inside config.json (chicken-and-egg), so it's
 # the one true constant. The values below are fallback defaults only - main()
@@ -37,9 +82,49 @@ CONFIG_FILE = "config.json"
 LOG_FILE = "/var/log/find_vpn.log" if os.path.isdir("/var/log") and os.access("/var/log", os.W_OK) else "update_pfsense.log"
 APPLY_WAIT_SECONDS = 5
 RESTART_WAIT_SECONDS = 30
+# Readiness polling (replaces the two fixed sleeps above unless disabled):
+# after the DNS apply, poll until the resolver answers DNS_HOST.DNS_DOMAIN
+# with the new IP (queried directly at DNS_READY_SERVER if set, otherwise by
+# asking the API whether the apply is still pending); after the restart, poll
+# until the OpenVPN client reports up. Each wait gives up at its own ceiling.
+READINESS_POLLING = True
+DNS_READY_SERVER = ""
+DNS_READY_TIMEOUT_SECONDS = 30
+TUNNEL_READY_TIMEOUT_SECONDS = 60
+READY_POLL_INTERVAL_SECONDS = 1
+# Hysteresis: only switch servers when the new winner is at least
+# SWITCH_MIN_IMPROVEMENT_POINTS utilization points better than the live load
+# of the currently-applied server, and never sooner than
+# SWITCH_MIN_DWELL_SECONDS after the last switch - unless the current server
+# disappeared from Proton's list, which always switches.
+SWITCH_MIN_IMPROVEMENT_POINTS = 5
+SWITCH_MIN_DWELL_SECONDS = 3600
+# Per-phase timings and API call counts/latencies (see telemetry.py),
+# appended to METRICS_TRACE_FILE and written as protonvpn_updater.prom into
+# METRICS_TEXTFILE_DIR. Empty disables either.
+METRICS_TRACE_FILE = ""
+METRICS_TEXTFILE_DIR = ""
+# --watch: after a scraper (possibly on another host, writing to a shared
+# directory) replaces a profile's SELECTION_FILE, wait WATCH_SETTLE_SECONDS
+# for the rest of its files to land, then update the targets that changed.
+WATCH_SETTLE_SECONDS = 1
+# Per-target OPENVPN_ENDPOINT_MODE: "dns" points the OpenVPN client at the
+# new server through the DNS_HOST host override it resolves; "direct"
+# PATCHes the client's own server address instead (see apply_update_direct).
+ENDPOINT_MODES = ("dns", "direct")
+
+
+# When updating several firewalls at once (FIREWALLS), each worker thread
+# sets its target's name here so its log lines can be told apart.
+_log_context = threading.local()
+# Serializes read-modify-write of the state files shared between targets.
+_state_file_lock = threading.Lock()
 
 
 def log(message: str) -> None:
+    target = getattr(_log_context, "target", None)
+    if target:
+        message = f"[{target}] {message}"
     line = f"{datetime.now().isoformat(timespec='seconds')} {message}"
     print(line)
     try:
@@ -55,44 +140,142 @@ def load_config(path: str) -> Dict[str, Any]:
     with open(path, "r") as f:
         config = json.load(f)
 
-    required = ["PFSENSE_BASE_URL", "PFSENSE_API_KEY", "DNS_HOST", "DNS_DOMAIN", "OPENVPN_VPNID"]
-    missing = [k for k in required if not config.get(k) and config.get(k) != 0]
-    if missing:
-        raise ValueError(f"Missing required config keys: {', '.join(missing)}")
+    firewall_targets(config)  # validates every target's required keys
     return config
 
 
-def api_request(config: Dict[str, Any], method: str, path: str, **kwargs) -> Dict[str, Any]:
-    url = config["PFSENSE_BASE_URL"].rstrip("/") + path
-    verify_tls = config.get("PFSENSE_VERIFY_TLS", True)
-    if not verify_tls:
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+def firewall_targets(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Returns one fully-merged config per firewall and selection profile to
+    update. Without FIREWALLS or SELECTION_PROFILES that's just config
+    itself; with FIREWALLS, each entry (its own PFSENSE_BASE_URL,
+    PFSENSE_API_KEY, DNS_HOST/DNS_DOMAIN, OPENVPN_VPNID, optional NAME, ...)
+    is laid over the top-level config, so shared settings only need to be
+    written once. Each SELECTION_PROFILES entry (its own DNS_HOST,
+    OPENVPN_VPNID and handoff files) is then laid over every firewall, and
+    the target is named "<firewall>/<profile>". Each firewall gets its own
+    APPLIED_STATE_FILE (see profiles.expand_targets)."""
+    targets = expand_targets(config)
 
-    headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "X-API-Key": config["PFSENSE_API_KEY"],
-    }
-    response = requests.request(method, url, headers=headers, verify=verify_tls, timeout=30, **kwargs)
+    required = ["PFSENSE_BASE_URL", "PFSENSE_API_KEY", "OPENVPN_VPNID"]
+    for target in targets:
+        if target.get("OPENVPN_ENDPOINT_MODE", "dns") not in ENDPOINT_MODES:
+            raise ValueError(f"OPENVPN_ENDPOINT_MODE for {target['NAME'] or 'firewall'} must be one of "
+                             f"{', '.join(ENDPOINT_MODES)}, not {target['OPENVPN_ENDPOINT_MODE']!r}")
+        keys = list(required)
+        if uses_host_override(target):
+            keys += ["DNS_HOST", "DNS_DOMAIN"]
+        if is_dual_client(target):
+            keys += ["OPENVPN_GATEWAY", "STANDBY_OPENVPN_GATEWAY", "GATEWAY_GROUP"]
+            keys += ["STANDBY_DNS_HOST"] if uses_host_override(target) else []
+        missing = [k for k in keys if not target.get(k) and target.get(k) != 0]
+        if missing:
+            raise ValueError(f"Missing required config keys for {target['NAME'] or 'firewall'}: {', '.join(missing)}")
+    return targets
 
-    try:
-        body = response.json()
-    except ValueError:
-        raise RuntimeError(f"{method} {path} returned non-JSON response (HTTP {response.status_code}): {response.text[:500]}")
 
-    # pfSense REST API responses always carry their own {"code": <http status>, "status": "ok"|...}
-    # regardless of the transport-level HTTP status, so check both.
-    if not response.ok or body.get("code", 500) >= 300:
-        raise RuntimeError(f"{method} {path} failed: {json.dumps(body)[:500]}")
+class PfSenseClient:
+    """A reusable pfSense REST API client. One keep-alive requests.Session
+    (so every call after the first skips the TCP+TLS handshake), with
+    retry/backoff on transient 5xx responses for idempotent methods only - a
+    retried POST could e.g. restart OpenVPN twice. Safe to share across the
+    threads main() runs lookups on. Every request's latency is recorded in
+    telemetry, and span() times a phase tagged with this client's labels
+    (its firewall's NAME, when several are updated)."""
+
+    def __init__(self, config: Dict[str, Any], telemetry: Optional[RunTelemetry] = None,
+                 labels: Optional[Dict[str, str]] = None):
+        self.config = config
+        self.telemetry = telemetry or RunTelemetry("updater")
+        self.labels = labels or {}
+        self.base_url = config["PFSENSE_BASE_URL"].rstrip("/")
+        self.session = requests.Session()
+        self.session.verify = config.get("PFSENSE_VERIFY_TLS", True)
+        if not self.session.verify:
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        self.session.headers.update({
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "X-API-Key": config["PFSENSE_API_KEY"],
+        })
+        retry = Retry(
+            total=config.get("PFSENSE_RETRIES", 3),
+            backoff_factor=config.get("PFSENSE_RETRY_BACKOFF", 0.5),
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "PATCH"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_maxsize=4)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def span(self, name: str):
+        return self.telemetry.span(name, **self.labels)
+
+    def request(self, method: str, path: str, **kwargs) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=30, **kwargs)
+        finally:
+            self.telemetry.observe("pfsense_api", f"{method} {path}", time.perf_counter() - start)
+
+        try:
+            body = response.json()
+        except ValueError:
+            raise RuntimeError(f"{method} {path} returned non-JSON response (HTTP {response.status_code}): {response.text[:500]}")
+
+        # pfSense REST API responses always carry their own {"code": <http status>, "status": "ok"|...}
+        # regardless of the transport-level HTTP status, so check both.
+        if not response.ok or body.get("code", 500) >= 300:
+            raise RuntimeError(f"{method} {path} failed: {json.dumps(body)[:500]}")
+
+        return body
+
+    def close(self) -> None:
+        self.session.close()
+
 
-    return body
+def _id_cache_key(config: Dict[str, Any]) -> str:
+    return f"{config['PFSENSE_BASE_URL'].rstrip('/')}|{config['DNS_HOST']}.{config['DNS_DOMAIN']}"
 
 
-def find_host_override_id(config: Dict[str, Any]) -> int:
-    body = api_request(config, "GET", "/api/v2/services/dns_resolver/host_overrides")
+def find_host_override(client: PfSenseClient) -> Dict[str, Any]:
+    """Returns the host override entry for DNS_HOST.DNS_DOMAIN. Its id is
+    cached in PFSENSE_ID_CACHE_FILE and checked with a single-object GET, so
+    the full collection (possibly hundreds of overrides) is only listed when
+    the cached id is missing or no longer points at this host."""
+    config = client.config
+    cache_file = config.get("PFSENSE_ID_CACHE_FILE", "pfsense_ids.json")
+    cache = (load_json_file(cache_file) or {}) if cache_file else {}
+    cached_id = cache.get(_id_cache_key(config))
+
+    if cached_id is not None:
+        try:
+            entry = client.request(
+                "GET", "/api/v2/services/dns_resolver/host_override", params={"id": cached_id}
+            ).get("data") or {}
+            if entry.get("host") == config["DNS_HOST"] and entry.get("domain") == config["DNS_DOMAIN"]:
+                return entry
+        except RuntimeError:
+            pass  # Deleted/reordered since it was cached - fall back to listing.
+
+    # Query parameters narrow the list server-side on API versions that
+    # support filtering; older ones return everything and the scan below
+    # still finds the match.
+    body = client.request(
+        "GET", "/api/v2/services/dns_resolver/host_overrides",
+        params={"host": config["DNS_HOST"], "domain": config["DNS_DOMAIN"]},
+    )
     for entry in body.get("data", []):
         if entry.get("host") == config["DNS_HOST"] and entry.get("domain") == config["DNS_DOMAIN"]:
-            return entry["id"]
+            if cache_file:
+                with _state_file_lock:
+                    cache = load_json_file(cache_file) or {}
+                    cache[_id_cache_key(config)] = entry["id"]
+                    try:
+                        save_json_file(cache_file, cache)
+                    except OSError:
+                        pass  # Only an optimization for the next run.
+            return entry
     raise RuntimeError(
         f"No existing DNS Resolver host override found for "
         f"{config['DNS_HOST']}.{config['DNS_DOMAIN']} - create it once in the "
@@ -100,88 +283,770 @@ def find_host_override_id(config: Dict[str, Any]) -> int:
     )
 
 
-def find_openvpn_service_id(config: Dict[str, Any]) -> int:
-    body = api_request(config, "GET", "/api/v2/status/services")
-    target_vpnid = int(config["OPENVPN_VPNID"])
+def find_host_override_id(client: PfSenseClient) -> int:
+    return find_host_override(client)["id"]
+
+
+def is_direct(config: Dict[str, Any]) -> bool:
+    return config.get("OPENVPN_ENDPOINT_MODE", "dns") == "direct"
+
+
+def uses_host_override(config: Dict[str, Any]) -> bool:
+    """Whether target's DNS_HOST override is updated at all: always in dns
+    mode, and in direct mode only as the optional record of the endpoint."""
+    return not is_direct(config) or bool(config.get("DIRECT_UPDATE_HOST_OVERRIDE"))
+
+
+def find_openvpn_client(client: PfSenseClient) -> Dict[str, Any]:
+    """Returns the OpenVPN client config entry for OPENVPN_VPNID (its id is
+    a positional index like the service's, so it's looked up every run)."""
+    target_vpnid = str(client.config["OPENVPN_VPNID"])
+    body = client.request("GET", "/api/v2/vpn/openvpn/clients", params={"vpnid": target_vpnid})
+    for entry in body.get("data", []):
+        if str(entry.get("vpnid")) == target_vpnid:
+            return entry
+    raise RuntimeError(f"No OpenVPN client configured with vpnid={target_vpnid}.")
+
+
+def find_openvpn_service_id(client: PfSenseClient) -> int:
+    # The service's id is a positional index into the current service list
+    # (and there's no single-service GET to verify a cached one with), so
+    # it's looked up fresh every run - filtered server-side where supported.
+    target_vpnid = int(client.config["OPENVPN_VPNID"])
+    body = client.request("GET", "/api/v2/status/services", params={"name": "openvpn", "vpnid": target_vpnid})
     for entry in body.get("data", []):
         if entry.get("name") == "openvpn" and str(entry.get("vpnid")) == str(target_vpnid):
             return entry["id"]
     raise RuntimeError(f"No running OpenVPN client found with vpnid={target_vpnid}.")
 
 
-def main() -> int:
+def query_a_records(name: str, server: str, timeout: float = 2.0) -> List[str]:
+    """Sends one DNS A query for name straight to server (UDP/53), bypassing
+    this machine's own resolver and its cache, and returns the IPv4
+    addresses in the answer."""
+    query_id = random.randint(0, 0xFFFF)
+    question = b"".join(bytes([len(label)]) + label.encode() for label in name.rstrip(".").split(".")) + b"\0"
+    packet = struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0) + question + struct.pack("!HH", 1, 1)
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.sendto(packet, (server, 53))
+        response, _ = sock.recvfrom(4096)
+
+    response_id, _, _, answer_count, _, _ = struct.unpack("!HHHHHH", response[:12])
+    if response_id != query_id:
+        return []
+    offset = 12 + len(question) + 4
+    addresses = []
+    for _ in range(answer_count):
+        # Answer names are almost always a 2-byte compression pointer, but
+        # walk labels in case one isn't.
+        while response[offset] != 0 and response[offset] & 0xC0 != 0xC0:
+            offset += response[offset] + 1
+        offset += 2 if response[offset] & 0xC0 == 0xC0 else 1
+        record_type, _, _, rdlength = struct.unpack("!HHIH", response[offset:offset + 10])
+        offset += 10
+        if record_type == 1 and rdlength == 4:
+            addresses.append(socket.inet_ntoa(response[offset:offset + 4]))
+        offset += rdlength
+    return addresses
+
+
+def wait_until(description: str, check, timeout: float, interval: float) -> bool:
+    """Polls check() every interval seconds until it returns truthy (True)
+    or timeout seconds pass (False), logging how long it actually took.
+    Errors from check() count as "not yet"."""
+    start = time.monotonic()
+    last_error = None
+    while True:
+        try:
+            if check():
+                log(f"{description} after {time.monotonic() - start:.1f}s")
+                return True
+        except Exception as e:
+            last_error = e
+        if time.monotonic() - start >= timeout:
+            detail = f" (last error: {last_error})" if last_error else ""
+            log(f"WARNING: gave up waiting for {description.lower()} after {timeout}s{detail}")
+            return False
+        time.sleep(interval)
+
+
+def dns_is_ready(client: PfSenseClient, new_ip: str) -> bool:
+    config = client.config
+    dns_server = config.get("DNS_READY_SERVER", DNS_READY_SERVER)
+    if dns_server:
+        return new_ip in query_a_records(f"{config['DNS_HOST']}.{config['DNS_DOMAIN']}", dns_server)
+    body = client.request("GET", "/api/v2/services/dns_resolver/apply")
+    return bool((body.get("data") or {}).get("applied"))
+
+
+def openvpn_client_is_up(client: PfSenseClient, vpnid: Optional[int] = None, remote: Optional[str] = None) -> bool:
+    """Whether the OpenVPN client reports up - and, with remote, connected
+    to that IP, where the API says which it's connected to."""
+    vpnid = str(client.config["OPENVPN_VPNID"] if vpnid is None else vpnid)
+    try:
+        body = client.request("GET", "/api/v2/status/openvpn/clients")
+    except RuntimeError:
+        # Older API versions lack the OpenVPN status endpoint; fall back to
+        # the generic service status (running, if not necessarily connected).
+        body = client.request("GET", "/api/v2/status/services", params={"name": "openvpn", "vpnid": vpnid})
+        return any(str(entry.get("vpnid")) == vpnid and entry.get("status") is True
+                   for entry in body.get("data", []))
+    return any(str(entry.get("vpnid")) == vpnid and str(entry.get("status", "")).lower() == "up"
+               and (remote is None or entry.get("remote_host") in (None, "", remote))
+               for entry in body.get("data", []))
+
+
+def invalidate_cached_endpoint(config: Dict[str, Any], ip: str) -> None:
+    """The tunnel failed to come up on ip, so make the next scrape download
+    that server's .ovpn fresh instead of trusting its cached endpoints."""
+    cache_file = config.get("ENDPOINT_CACHE_FILE", "endpoint_cache.json")
+    if not cache_file:
+        return
+    with _state_file_lock:
+        dropped = EndpointCache(cache_file, 0).invalidate_ip(ip)
+    if dropped:
+        log(f"Dropped cached endpoints for {', '.join(dropped)} ({ip} failed)")
+
+
+def load_json_file(path: str) -> Optional[Dict[str, Any]]:
+    """Returns the parsed JSON object at path, or None if it's missing or
+    unreadable."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_json_file(path: str, data: Dict[str, Any]) -> None:
+    """Writes data to path via a temp file + rename, so a reader never sees
+    a half-written file."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def save_applied_state(path: str, selection: Dict[str, Any]) -> None:
+    """Records the server pfSense now points at, for the next run's
+    should_switch()."""
+    state = {
+        "server": selection.get("server"),
+        "ip": selection["ip"],
+        "utilization": selection.get("utilization"),
+        "applied_at": time.time(),
+    }
+    save_json_file(path, state)
+
+
+def should_switch(selection: Dict[str, Any], live_ips: List[str], applied: Optional[Dict[str, Any]]) -> Tuple[bool, str]:
+    """Decides whether the new winner is worth a DNS update and tunnel
+    restart. selection is the scraper's record of this run (ip, plus server,
+    utilization and the applied servers' live current_utilizations when
+    available); live_ips is what the host override actually holds right
+    now; applied is the state saved by the last switch. Returns (switch,
+    reason)."""
+    new_ip = selection["ip"]
+    if new_ip in live_ips:
+        return False, f"override already points at {new_ip}"
+
+    # Without a trustworthy record of what's applied (first run, an older
+    # scraper, or the override was changed by hand) there's nothing to
+    # compare against - just switch.
+    if not applied or applied.get("ip") not in live_ips or selection.get("utilization") is None:
+        return True, "no matching record of the currently-applied server"
+
+    # The live load of every target's applied server (see the scraper's
+    # current_server_utilization); older records carry only this one's.
+    live = selection.get("current_utilizations")
+    if live is None and "current_utilization" in selection:
+        live = {selection.get("current_server", applied.get("server")): selection["current_utilization"]}
+    live = live or {}
+    if applied.get("server") in live and live[applied.get("server")] is None:
+        return True, f"current server {applied.get('server')} is no longer listed"
+
+    # monitor.py flags a server whose tunnel stayed unhealthy; this run is
+    # the re-selection it asked for, so neither rule below may keep it.
+    if applied.get("unhealthy_at", 0) > applied.get("applied_at", 0):
+        return True, f"current server {applied.get('server')} is unhealthy ({applied.get('unhealthy_reason')})"
+
+    dwell = time.time() - applied.get("applied_at", 0)
+    if dwell < SWITCH_MIN_DWELL_SECONDS:
+        return False, f"current server applied only {dwell:.0f}s ago (minimum {SWITCH_MIN_DWELL_SECONDS}s)"
+
+    current_utilization = live.get(applied.get("server"), applied.get("utilization"))
+    if current_utilization is None:
+        return True, "current server's utilization is unknown"
+    improvement = current_utilization - selection["utilization"]
+    if improvement < SWITCH_MIN_IMPROVEMENT_POINTS:
+        return False, (f"{selection.get('server')} ({selection['utilization']}%) is only {improvement} point(s) "
+                       f"better than {applied.get('server')} ({current_utilization}%)")
+    return True, f"{improvement} point(s) better than {applied.get('server')} ({current_utilization}%)"
+
+
+def main(config: Optional[Dict[str, Any]] = None, changed: Optional[Set[str]] = None) -> int:
+    """Runs one update and exports its timings (see telemetry.py), whatever
+    the outcome. config is config.json already parsed (by pipeline.py or
+    watch()); changed limits the run to the targets whose handoff files are
+    among those paths."""
+    telemetry = RunTelemetry("updater")
+    exit_code = 1
+    try:
+        exit_code = run_update(telemetry, config, changed)
+        return exit_code
+    finally:
+        log(telemetry.summary())
+        telemetry.finish(exit_code == 0, METRICS_TRACE_FILE, METRICS_TEXTFILE_DIR)
+
+
+def apply_settings(config: Dict[str, Any]) -> None:
     global LOG_FILE, APPLY_WAIT_SECONDS, RESTART_WAIT_SECONDS
+    global READINESS_POLLING, DNS_READY_SERVER, DNS_READY_TIMEOUT_SECONDS
+    global TUNNEL_READY_TIMEOUT_SECONDS, READY_POLL_INTERVAL_SECONDS
+    global SWITCH_MIN_IMPROVEMENT_POINTS, SWITCH_MIN_DWELL_SECONDS
+    global METRICS_TRACE_FILE, METRICS_TEXTFILE_DIR, WATCH_SETTLE_SECONDS
 
-    config = load_config(CONFIG_FILE)
     LOG_FILE = config.get("LOG_FILE", LOG_FILE)
     APPLY_WAIT_SECONDS = config.get("APPLY_WAIT_SECONDS", APPLY_WAIT_SECONDS)
     RESTART_WAIT_SECONDS = config.get("RESTART_WAIT_SECONDS", RESTART_WAIT_SECONDS)
+    READINESS_POLLING = config.get("READINESS_POLLING", READINESS_POLLING)
+    DNS_READY_SERVER = config.get("DNS_READY_SERVER", DNS_READY_SERVER)
+    DNS_READY_TIMEOUT_SECONDS = config.get("DNS_READY_TIMEOUT_SECONDS", DNS_READY_TIMEOUT_SECONDS)
+    TUNNEL_READY_TIMEOUT_SECONDS = config.get("TUNNEL_READY_TIMEOUT_SECONDS", TUNNEL_READY_TIMEOUT_SECONDS)
+    READY_POLL_INTERVAL_SECONDS = config.get("READY_POLL_INTERVAL_SECONDS", READY_POLL_INTERVAL_SECONDS)
+    SWITCH_MIN_IMPROVEMENT_POINTS = config.get("SWITCH_MIN_IMPROVEMENT_POINTS", SWITCH_MIN_IMPROVEMENT_POINTS)
+    SWITCH_MIN_DWELL_SECONDS = config.get("SWITCH_MIN_DWELL_SECONDS", SWITCH_MIN_DWELL_SECONDS)
+    METRICS_TRACE_FILE = config.get("METRICS_TRACE_FILE", METRICS_TRACE_FILE)
+    METRICS_TEXTFILE_DIR = config.get("METRICS_TEXTFILE_DIR", METRICS_TEXTFILE_DIR)
+    WATCH_SETTLE_SECONDS = config.get("WATCH_SETTLE_SECONDS", WATCH_SETTLE_SECONDS)
+
+
+def run_update(telemetry: RunTelemetry, config: Optional[Dict[str, Any]] = None,
+               changed: Optional[Set[str]] = None) -> int:
+    if config is None:
+        with telemetry.span("load_config"):
+            config = load_config(CONFIG_FILE)
+    apply_settings(config)
+
+    targets = firewall_targets(config)
+    if changed is not None:
+        targets = [target for target in targets if handoff_paths(target) & changed]
+        if not targets:
+            return 0
+    if len(targets) == 1:
+        return update_target(targets[0], telemetry)[1]
+
+    # Each target's whole lookup -> PATCH -> apply -> wait -> restart runs on
+    # its own thread, so the total is about the slowest box, not the sum.
+    concurrency = max(1, int(config.get("FIREWALL_CONCURRENCY", 4)))
+    log(f"Updating {len(targets)} targets, {concurrency} at a time...")
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda target: update_target(target, telemetry, label=True), targets))
+
+    log("--- Firewall summary ---")
+    for name, exit_code, elapsed in results:
+        log(f"  {name}: {'OK' if exit_code == 0 else 'FAILED'} ({elapsed:.1f}s)")
+    failed = sum(1 for _, exit_code, _ in results if exit_code != 0)
+    if failed:
+        log(f"{failed} of {len(results)} target(s) failed.")
+        return 1
+    return 0
+
+
+def handoff_paths(target: Dict[str, Any]) -> Set[str]:
+    return {os.path.abspath(target["OUTPUT_FILE"]), os.path.abspath(target["SELECTION_FILE"])}
 
-    output_file = config.get("OUTPUT_FILE", "/tmp/tmpIPFile.txt")
 
+def watch() -> None:
+    """--watch: waits for the scraper to replace a profile's SELECTION_FILE
+    (see handoff.py) and updates that profile's targets straight away,
+    instead of on the next cron tick. config.json is reloaded before every
+    update, as a fresh run would. Files already there at startup are left
+    alone; only changes after that count. Runs until interrupted."""
+    config = load_config(CONFIG_FILE)
+    apply_settings(config)
+    selection_files = {os.path.abspath(target["SELECTION_FILE"]) for target in firewall_targets(config)}
+    watcher = HandoffWatcher(selection_files)
+    if watcher.inotify_error:
+        log(f"WARNING: inotify unavailable ({watcher.inotify_error}); "
+            f"polling every {POLL_INTERVAL_SECONDS}s instead.")
+    log(f"Watching {', '.join(sorted(selection_files))} ({watcher.mode}).")
+    try:
+        while True:
+            changed = watcher.wait()
+            # The scraper writes one profile after another; let the rest of
+            # the run land so it's handled as one update.
+            time.sleep(WATCH_SETTLE_SECONDS)
+            changed |= watcher.wait(timeout=0)
+            log(f"Handoff changed: {', '.join(sorted(changed))}")
+            try:
+                main(load_config(CONFIG_FILE), changed)
+            except Exception as e:
+                log(f"ERROR: {type(e).__name__} - {e}")
+    finally:
+        watcher.close()
+
+
+def read_selection(target: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The scraper's result for target's profile: the IP in its OUTPUT_FILE,
+    plus its SELECTION_FILE record (server, utilization, the applied
+    server's live load) when that matches the IP. None, logged, if there's
+    no usable IP."""
+    output_file = target["OUTPUT_FILE"]
     if not os.path.exists(output_file):
         log(f"ERROR: {output_file} does not exist. Run scrape-ng-v2.py first.")
-        return 1
+        return None
 
     with open(output_file, "r") as f:
         new_ip = f.read().strip()
 
     if not new_ip:
         log(f"ERROR: {output_file} is empty.")
-        return 1
+        return None
+
+    selection = load_json_file(target["SELECTION_FILE"])
+    if not selection or selection.get("ip") != new_ip:
+        selection = {"ip": new_ip}
+    run = f" (scraper run {selection['run_id']})" if selection.get("run_id") else ""
+    log(f"Read best server IP: {new_ip}{run}")
+    return selection
 
-    log(f"Read best server IP: {new_ip}")
 
+def update_target(target: Dict[str, Any], telemetry: RunTelemetry, label: bool = False) -> Tuple[str, int, float]:
+    """Runs apply_update() against one firewall/profile with its own client,
+    and returns (name, exit_code, elapsed_seconds). Never raises - an error
+    on one target must not take the others down with it. With label, log
+    lines and timing spans are tagged with the target's NAME."""
+    start = time.monotonic()
+    if label:
+        _log_context.target = target["NAME"]
+    client = None
     try:
-        override_id = find_host_override_id(config)
-        log(f"Found host override id={override_id} for {config['DNS_HOST']}.{config['DNS_DOMAIN']}")
+        client = PfSenseClient(target, telemetry, {"target": target["NAME"]} if label else None)
+        selection = read_selection(target)
+        exit_code = apply_update(client, selection, target["APPLIED_STATE_FILE"]) if selection else 1
+    except Exception as e:
+        log(f"ERROR: {type(e).__name__} - {e}")
+        exit_code = 1
+    finally:
+        if client is not None:
+            client.close()
+        _log_context.target = None
+    telemetry.gauge("target_success", int(exit_code == 0), "Whether this target's update succeeded.",
+                    target=target["NAME"])
+    return target["NAME"], exit_code, time.monotonic() - start
+
+
+def failover_endpoints(selection: Dict[str, Any]) -> List[Tuple[str, Optional[str], Optional[int]]]:
+    """(ip, server, utilization) for every distinct entry IP in the scraper's
+    ranked candidate list, the winner's first. A selection without one (an
+    older scraper, or only OUTPUT_FILE to go on) yields just its ip."""
+    endpoints = [(selection["ip"], selection.get("server"), selection.get("utilization"))]
+    for candidate in selection.get("candidates") or []:
+        for remote in candidate.get("remotes") or [[candidate.get("ip")]]:
+            if remote and remote[0] and remote[0] not in [ip for ip, _, _ in endpoints]:
+                endpoints.append((remote[0], candidate.get("server"), candidate.get("utilization")))
+    return endpoints
 
-        api_request(
-            config, "PATCH", "/api/v2/services/dns_resolver/host_override",
+
+def update_host_override(client: PfSenseClient, override_id: int, ip: str) -> None:
+    """PATCHes the host override to ip and applies the DNS Resolver change."""
+    config = client.config
+    with client.span("update_host_override"):
+        client.request(
+            "PATCH", "/api/v2/services/dns_resolver/host_override",
             json={
                 "id": override_id,
                 "host": config["DNS_HOST"],
                 "domain": config["DNS_DOMAIN"],
-                "ip": [new_ip],
+                "ip": [ip],
                 "descr": f"Fastest ProtonVPN server, updated {datetime.now().isoformat(timespec='seconds')}",
             },
         )
-        log(f"Updated host override -> {new_ip}")
+    log(f"Updated host override -> {ip}")
+
+    with client.span("apply_dns"):
+        client.request("POST", "/api/v2/services/dns_resolver/apply")
+    log("Applied DNS Resolver changes")
+
 
-        api_request(config, "POST", "/api/v2/services/dns_resolver/apply")
-        log("Applied DNS Resolver changes")
+def restart_tunnel(client: PfSenseClient, service_id: int, ip: str) -> Optional[bool]:
+    """Waits for the DNS change to ip to take, restarts the OpenVPN client
+    and waits for it to come up connected to ip - a client that re-resolved
+    the name before the resolver served the change comes up on the old
+    server. Returns True once it's up on ip, False if it never came up on
+    ip, and None if the restart itself failed."""
+    config = client.config
+    with client.span("wait_dns"):
+        if READINESS_POLLING:
+            # A resolver that never confirms isn't fatal - it's no worse than
+            # the fixed sleep this replaces - so restart regardless.
+            wait_until("DNS Resolver is serving the new IP", lambda: dns_is_ready(client, ip),
+                       DNS_READY_TIMEOUT_SECONDS, READY_POLL_INTERVAL_SECONDS)
+        else:
+            log(f"Waiting {APPLY_WAIT_SECONDS}s for DNS apply to settle...")
+            time.sleep(APPLY_WAIT_SECONDS)
 
+            log(f"Waiting {RESTART_WAIT_SECONDS}s before restarting OpenVPN...")
+            time.sleep(RESTART_WAIT_SECONDS)
+
+    try:
+        with client.span("restart_openvpn"):
+            client.request(
+                "POST", "/api/v2/status/service",
+                json={"id": service_id, "name": "openvpn", "action": "restart"},
+            )
+        log(f"Restarted OpenVPN client (vpnid={config['OPENVPN_VPNID']})")
     except Exception as e:
-        log(f"ERROR updating DNS: {e}")
+        log(f"ERROR restarting OpenVPN client: {e}")
+        return None
+
+    if not READINESS_POLLING:
+        return True
+    with client.span("wait_tunnel"):
+        return wait_until("OpenVPN client is up", lambda: openvpn_client_is_up(client, remote=ip),
+                          TUNNEL_READY_TIMEOUT_SECONDS, READY_POLL_INTERVAL_SECONDS)
+
+
+def remote_port(selection: Dict[str, Any], ip: str, protocol: str = "") -> Optional[int]:
+    """The port of ip's remote line in the scraper's .ovpn records, for
+    the OpenVPN client's protocol (e.g. "UDP4") if one of ip's remotes
+    matches it. None if the selection doesn't list ip's remotes (an older
+    scraper, or only OUTPUT_FILE to go on)."""
+    remotes = [remote for candidate in [selection] + (selection.get("candidates") or [])
+               for remote in candidate.get("remotes") or [] if remote and remote[0] == ip]
+    for remote in remotes:
+        if len(remote) > 2 and protocol.lower().startswith(str(remote[2]).lower()):
+            return int(remote[1])
+    return int(remotes[0][1]) if remotes and len(remotes[0]) > 1 else None
+
+
+def update_client_endpoint(client: PfSenseClient, openvpn_client: Dict[str, Any], ip: str,
+                           port: Optional[int]) -> None:
+    """PATCHes the OpenVPN client's server_addr (and server_port, when
+    known - otherwise the configured one is kept) to the endpoint. The API
+    applies it by restarting that client with the new remote."""
+    data = {"id": openvpn_client["id"], "server_addr": ip}
+    if port:
+        data["server_port"] = str(port)
+    with client.span("update_openvpn_client"):
+        client.request("PATCH", "/api/v2/vpn/openvpn/client", json=data)
+    log(f"Updated OpenVPN client (vpnid={client.config['OPENVPN_VPNID']}) -> {ip}:{port or openvpn_client.get('server_port')}")
+
+
+def wait_for_tunnel(client: PfSenseClient, ip: str) -> bool:
+    """restart_tunnel() for direct mode, where the PATCH itself restarted
+    the client: only waits for it to come up connected to ip."""
+    if not READINESS_POLLING:
+        return True
+    with client.span("wait_tunnel"):
+        return wait_until("OpenVPN client is up", lambda: openvpn_client_is_up(client, remote=ip),
+                          TUNNEL_READY_TIMEOUT_SECONDS, READY_POLL_INTERVAL_SECONDS)
+
+
+def direct_steps(client: PfSenseClient, openvpn_client: Dict[str, Any], selection: Dict[str, Any]):
+    """bring_up()'s (point_at, restart) for direct mode."""
+    protocol = str(openvpn_client.get("protocol") or "")
+    return (lambda ip: update_client_endpoint(client, openvpn_client, ip, remote_port(selection, ip, protocol)),
+            lambda ip: wait_for_tunnel(client, ip))
+
+
+def dns_steps(client: PfSenseClient, override_id: int, service_id: int):
+    """bring_up()'s (point_at, restart) for the host override path."""
+    return (lambda ip: update_host_override(client, override_id, ip),
+            lambda ip: restart_tunnel(client, service_id, ip))
+
+
+def record_host_override(client: PfSenseClient, ip: str) -> None:
+    """Direct mode's optional secondary update: points DNS_HOST's override
+    at the endpoint the tunnel came up on, for anything else that resolves
+    it. The tunnel no longer depends on it, so a failure is only a
+    warning."""
+    if not client.config.get("DIRECT_UPDATE_HOST_OVERRIDE"):
+        return
+    try:
+        update_host_override(client, find_host_override_id(client), ip)
+    except Exception as e:
+        log(f"WARNING: the tunnel is up on {ip}, but updating the host override failed: {e}")
+
+
+def bring_up(client: PfSenseClient, endpoints: List[Tuple[str, Optional[str], Optional[int]]],
+             point_at, restart, pointed: bool = False) -> Optional[Tuple[str, Optional[str], Optional[int]]]:
+    """Tries each of endpoints (see failover_endpoints) in turn until
+    client's OpenVPN tunnel comes up: point_at(ip) points the client there
+    (skipped for the first endpoint if the caller already pointed it), then
+    restart(ip) restarts it and returns True once it's up, False if it
+    never came up and None if the restart itself failed (see dns_steps and
+    direct_steps). Returns the (ip, server, utilization) it came up on, or
+    None if none did or a step failed outright."""
+    config = client.config
+    for attempt, (ip, server, utilization) in enumerate(endpoints):
+        if attempt or not pointed:
+            if attempt:
+                log(f"Failing over to {server or 'the next candidate'} at {ip} "
+                    f"({attempt + 1} of {len(endpoints)} endpoints)")
+            try:
+                point_at(ip)
+            except Exception as e:
+                log(f"ERROR pointing the OpenVPN client at {ip}: {e}")
+                return None
+
+        tunnel_up = restart(ip)
+        if tunnel_up is None:
+            invalidate_cached_endpoint(config, ip)
+            return None
+        if tunnel_up:
+            client.telemetry.gauge("failover_attempts", attempt, "Candidates tried after the winner failed to come up.",
+                                   **client.labels)
+            return ip, server, utilization
+        log(f"ERROR: OpenVPN client (vpnid={config['OPENVPN_VPNID']}) did not come up on {ip}")
+        invalidate_cached_endpoint(config, ip)
+    log(f"ERROR: the tunnel came up on none of the {len(endpoints)} candidate endpoint(s)")
+    return None
+
+
+def record_applied(applied_state_file: str, selection: Dict[str, Any],
+                   endpoint: Tuple[str, Optional[str], Optional[int]]) -> None:
+    """save_applied_state() for the endpoint the tunnel actually came up on."""
+    ip, server, utilization = endpoint
+    try:
+        with _state_file_lock:
+            save_applied_state(applied_state_file,
+                               {**selection, "ip": ip, "server": server, "utilization": utilization})
+    except OSError as e:
+        log(f"WARNING: could not record applied server in {applied_state_file}: {e}")
+
+
+def apply_update(client: PfSenseClient, selection: Dict[str, Any], applied_state_file: str) -> int:
+    """Points client's pfSense at selection["ip"] (unless should_switch()
+    says not to) and restarts its OpenVPN client. If the tunnel doesn't come
+    up there, fails over down the scraper's ranked candidate list (see
+    failover_endpoints) without waiting for another scrape. With a standby
+    client configured, switches make-before-break instead (see
+    apply_update_make_before_break). Returns the exit code."""
+    config = client.config
+    if is_dual_client(config):
+        return apply_update_make_before_break(client, selection, applied_state_file)
+    if is_direct(config):
+        return apply_update_direct(client, selection, applied_state_file)
+    new_ip = selection["ip"]
+
+    # Both lookups are independent reads, so run them side by side; the
+    # service lookup's result (or error) isn't needed until after the DNS
+    # update, same as when it ran sequentially.
+    def timed_lookup(name, lookup):
+        with client.span(name):
+            return lookup(client)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        override_future = executor.submit(timed_lookup, "find_host_override", find_host_override)
+        service_future = executor.submit(timed_lookup, "find_openvpn_service", find_openvpn_service_id)
+
+        try:
+            override = override_future.result()
+            override_id = override["id"]
+            log(f"Found host override id={override_id} for {config['DNS_HOST']}.{config['DNS_DOMAIN']}")
+
+            switch, reason = should_switch(selection, override.get("ip") or [], load_json_file(applied_state_file))
+            client.telemetry.gauge("switched", int(switch), "Whether the last run switched servers.", **client.labels)
+            if not switch:
+                log(f"Not switching: {reason}. Leaving pfSense and the tunnel untouched.")
+                return 0
+            log(f"Switching: {reason}")
+
+            update_host_override(client, override_id, new_ip)
+
+        except Exception as e:
+            log(f"ERROR updating DNS: {e}")
+            return 1
+
+        try:
+            service_id = service_future.result()
+            log(f"Found OpenVPN client service id={service_id} (vpnid={config['OPENVPN_VPNID']})")
+        except Exception as e:
+            log(f"ERROR locating OpenVPN client service, NOT restarting: {e}")
+            return 1
+
+    endpoint = bring_up(client, failover_endpoints(selection), *dns_steps(client, override_id, service_id),
+                        pointed=True)
+    if endpoint is None:
         return 1
+    record_applied(applied_state_file, selection, endpoint)
+    log("Done.")
+    return 0
 
-    log(f"Waiting {APPLY_WAIT_SECONDS}s for DNS apply to settle...")
-    import time
-    time.sleep(APPLY_WAIT_SECONDS)
 
+def apply_update_direct(client: PfSenseClient, selection: Dict[str, Any], applied_state_file: str) -> int:
+    """apply_update() for OPENVPN_ENDPOINT_MODE "direct": the OpenVPN
+    client's own server_addr/server_port is PATCHed to the endpoint instead
+    of the host override it resolves, so there's no DNS Resolver apply (and
+    no unbound reload) and no wait for it to settle. should_switch()
+    compares against that server_addr. Returns the exit code."""
+    config = client.config
     try:
-        service_id = find_openvpn_service_id(config)
-        log(f"Found OpenVPN client service id={service_id} (vpnid={config['OPENVPN_VPNID']})")
+        with client.span("find_openvpn_client"):
+            openvpn_client = find_openvpn_client(client)
+        log(f"Found OpenVPN client id={openvpn_client['id']} (vpnid={config['OPENVPN_VPNID']}, "
+            f"server {openvpn_client.get('server_addr')}:{openvpn_client.get('server_port')})")
     except Exception as e:
-        log(f"ERROR locating OpenVPN client service, NOT restarting: {e}")
+        log(f"ERROR locating OpenVPN client: {e}")
         return 1
 
-    log(f"Waiting {RESTART_WAIT_SECONDS}s before restarting OpenVPN...")
-    time.sleep(RESTART_WAIT_SECONDS)
+    switch, reason = should_switch(selection, [openvpn_client.get("server_addr")], load_json_file(applied_state_file))
+    client.telemetry.gauge("switched", int(switch), "Whether the last run switched servers.", **client.labels)
+    if not switch:
+        log(f"Not switching: {reason}. Leaving pfSense and the tunnel untouched.")
+        return 0
+    log(f"Switching: {reason}")
+
+    endpoint = bring_up(client, failover_endpoints(selection), *direct_steps(client, openvpn_client, selection))
+    if endpoint is None:
+        return 1
+    record_host_override(client, endpoint[0])
+    record_applied(applied_state_file, selection, endpoint)
+    log("Done.")
+    return 0
+
 
+def is_dual_client(config: Dict[str, Any]) -> bool:
+    return config.get("STANDBY_OPENVPN_VPNID") not in (None, "")
+
+
+def find_gateway_group(client: PfSenseClient) -> Dict[str, Any]:
+    name = client.config["GATEWAY_GROUP"]
+    body = client.request("GET", "/api/v2/routing/gateway/groups", params={"name": name})
+    for entry in body.get("data", []):
+        if entry.get("name") == name:
+            return entry
+    raise RuntimeError(f"No gateway group named {name} - create it in System > Routing > Gateway Groups, "
+                       f"with OPENVPN_GATEWAY and STANDBY_OPENVPN_GATEWAY on different tiers.")
+
+
+def client_roles(config: Dict[str, Any], group: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """(active, standby): the target's two OpenVPN clients, each as a copy of
+    config with that client's own OPENVPN_VPNID, DNS_HOST and
+    OPENVPN_GATEWAY. Whichever gateway sits on the lower tier of the
+    gateway group is carrying traffic; the group is the record of that,
+    so a switch made by hand in the UI is respected."""
+    primary = dict(config)
+    standby = {
+        **config,
+        "OPENVPN_VPNID": config["STANDBY_OPENVPN_VPNID"],
+        "DNS_HOST": config.get("STANDBY_DNS_HOST"),
+        "OPENVPN_GATEWAY": config["STANDBY_OPENVPN_GATEWAY"],
+    }
+    tiers = {entry.get("gateway"): int(entry.get("tier", 5)) for entry in group.get("priorities") or []}
+    for member in (primary, standby):
+        if member["OPENVPN_GATEWAY"] not in tiers:
+            raise RuntimeError(f"Gateway {member['OPENVPN_GATEWAY']} is not a member of gateway group {group.get('name')}.")
+    if tiers[standby["OPENVPN_GATEWAY"]] < tiers[primary["OPENVPN_GATEWAY"]]:
+        return standby, primary
+    return primary, standby
+
+
+def promote(client: PfSenseClient, group: Dict[str, Any], new_gateway: str, old_gateway: str) -> None:
+    """Swaps the two gateways' tiers in group and applies the routing
+    change, so new_gateway carries traffic and old_gateway becomes the
+    group's failover."""
+    tiers = {entry["gateway"]: entry.get("tier") for entry in group["priorities"]}
+    priorities = []
+    for entry in group["priorities"]:
+        if entry["gateway"] == new_gateway:
+            entry = {**entry, "tier": tiers[old_gateway]}
+        elif entry["gateway"] == old_gateway:
+            entry = {**entry, "tier": tiers[new_gateway]}
+        priorities.append(entry)
+    client.request("PATCH", "/api/v2/routing/gateway/group", json={"id": group["id"], "priorities": priorities})
+    client.request("POST", "/api/v2/routing/apply")
+
+
+def apply_update_make_before_break(client: PfSenseClient, selection: Dict[str, Any], applied_state_file: str) -> int:
+    """The dual-client switch: the idle (standby) OpenVPN client is pointed
+    at the new server through its own host override and restarted, and
+    only once it reports connected does the gateway group move traffic onto
+    it. The client that was carrying traffic is never touched and stays up
+    as the warm standby (and the group's failover). If the standby comes up
+    on none of the candidates, traffic stays where it was. Returns the exit
+    code."""
     try:
-        api_request(
-            config, "POST", "/api/v2/status/service",
-            json={"id": service_id, "name": "openvpn", "action": "restart"},
-        )
-        log(f"Restarted OpenVPN client (vpnid={config['OPENVPN_VPNID']})")
+        with client.span("find_gateway_group"):
+            group = find_gateway_group(client)
+        active, standby = client_roles(client.config, group)
     except Exception as e:
-        log(f"ERROR restarting OpenVPN client: {e}")
+        log(f"ERROR reading gateway group: {e}")
         return 1
+    log(f"Active OpenVPN client vpnid={active['OPENVPN_VPNID']} ({active['OPENVPN_GATEWAY']}), "
+        f"standby vpnid={standby['OPENVPN_VPNID']} ({standby['OPENVPN_GATEWAY']})")
+    active_client = PfSenseClient(active, client.telemetry, client.labels)
+    standby_client = PfSenseClient(standby, client.telemetry, client.labels)
+
+    def timed_lookup(name, lookup, member_client):
+        with client.span(name):
+            return lookup(member_client)
+
+    direct = is_direct(client.config)
+    try:
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            if direct:
+                live_future = executor.submit(timed_lookup, "find_openvpn_client", find_openvpn_client, active_client)
+                standby_future = executor.submit(timed_lookup, "find_standby_openvpn_client", find_openvpn_client,
+                                                 standby_client)
+            else:
+                live_future = executor.submit(timed_lookup, "find_host_override", find_host_override, active_client)
+                override_future = executor.submit(timed_lookup, "find_standby_override", find_host_override,
+                                                  standby_client)
+                service_future = executor.submit(timed_lookup, "find_openvpn_service", find_openvpn_service_id,
+                                                 standby_client)
+            try:
+                live = live_future.result()
+                live_ips = [live.get("server_addr")] if direct else live.get("ip") or []
+                switch, reason = should_switch(selection, live_ips, load_json_file(applied_state_file))
+                client.telemetry.gauge("switched", int(switch), "Whether the last run switched servers.",
+                                       **client.labels)
+                if not switch:
+                    log(f"Not switching: {reason}. Leaving pfSense and both tunnels untouched.")
+                    return 0
+                log(f"Switching: {reason}")
+                if direct:
+                    steps = direct_steps(standby_client, standby_future.result(), selection)
+                else:
+                    steps = dns_steps(standby_client, override_future.result()["id"], service_future.result())
+            except Exception as e:
+                log(f"ERROR looking up the OpenVPN clients: {e}")
+                return 1
+
+        log(f"Bringing up standby client vpnid={standby['OPENVPN_VPNID']} before moving traffic")
+        endpoint = bring_up(standby_client, failover_endpoints(selection), *steps)
+        if endpoint is None:
+            log(f"Traffic stays on vpnid={active['OPENVPN_VPNID']}, untouched.")
+            return 1
+        if direct:
+            record_host_override(standby_client, endpoint[0])
+
+        try:
+            with client.span("promote_standby"):
+                promote(client, group, standby["OPENVPN_GATEWAY"], active["OPENVPN_GATEWAY"])
+        except Exception as e:
+            log(f"ERROR moving traffic to {standby['OPENVPN_GATEWAY']}: {e}")
+            return 1
+        log(f"Traffic moved to vpnid={standby['OPENVPN_VPNID']} ({standby['OPENVPN_GATEWAY']}); "
+            f"vpnid={active['OPENVPN_VPNID']} is now the warm standby")
+    finally:
+        active_client.close()
+        standby_client.close()
 
+    record_applied(applied_state_file, selection, endpoint)
     log("Done.")
     return 0
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Point pfSense at the server scrape-ng-v2.py picked.")
+    parser.add_argument("--watch", action="store_true",
+                        help="stay running and update as soon as the scraper replaces SELECTION_FILE")
+    args = parser.parse_args()
+    if args.watch:
+        watch()
     sys.exit(main())